@@ -1,5 +1,12 @@
-# This will make sure the app is always imported when
-# Django starts so that shared_task will use this app.
-from .celery import app as celery_app
-
+# The celery app is loaded on first use rather than with every web process;
+# the worker finds it through BlogApp.celery and tasks dispatched from the web
+# side import it along with their module.
 __all__ = ("celery_app",)
+
+
+def __getattr__(name):
+    if name == "celery_app":
+        from .celery import app
+
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,120 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from BlogApp import metrics
+
+
+def user_cache_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def invalidate_users(user_ids):
+    cache.delete_many([user_cache_key(user_id) for user_id in user_ids])
+
+
+def snapshot(user):
+    # resolving the permissions fills the backend's per-instance caches,
+    # has_perm then reads them instead of querying
+    return {"user": user, "permissions": user.get_all_permissions()}
+
+
+def restore(cached):
+    user = cached["user"]
+    user._perm_cache = set(cached["permissions"])
+    return user
+
+
+def check_user(user, validated_token):
+    if not user.is_active:
+        raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+    if api_settings.CHECK_REVOKE_TOKEN:
+        if validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(
+                _("The user's password has been changed."), code="password_changed"
+            )
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication reading users and their resolved permissions from the
+    cache, so an authenticated request served from the cache runs no queries.
+    Snapshots are dropped when a user, their groups or their permissions
+    change (see ``BlogApp.blog.signals``) and expire after
+    ``AUTH_USER_CACHE_TTL`` seconds otherwise.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        cached = cache.get(user_cache_key(user_id))
+        metrics.record_cache("auth", cached is not None)
+        if cached is None:
+            user = super().get_user(validated_token)
+            cache.set(
+                user_cache_key(user_id), snapshot(user), settings.AUTH_USER_CACHE_TTL
+            )
+            return user
+
+        user = restore(cached)
+        check_user(user, validated_token)
+        return user
+
+
+class AsyncJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication for async views: the token checks are shared and the
+    user is loaded from the same cache as ``CachedJWTAuthentication``, or
+    through the async ORM.
+    """
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        cached = await cache.aget(user_cache_key(user_id))
+        metrics.record_cache("auth", cached is not None)
+        if cached is not None:
+            user = restore(cached)
+            check_user(user, validated_token)
+            return user
+
+        try:
+            user = await self.user_model.objects.aget(
+                **{api_settings.USER_ID_FIELD: user_id}
+            )
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        check_user(user, validated_token)
+        await cache.aset(
+            user_cache_key(user_id),
+            await sync_to_async(snapshot)(user),
+            settings.AUTH_USER_CACHE_TTL,
+        )
+        return user
@@ -1,5 +1,188 @@
-from django.contrib import admin
+"""
+Admin for tables with millions of posts.
+
+The changelist of ``PostAdmin`` never counts or sorts the whole table, nor
+loads the content of the posts it lists:
+
+- the row count is the planner's estimate once it passes
+  ``POSTS_ADMIN_EXACT_COUNT_LIMIT``,
+- a page walks its offset over the primary keys alone, in the order of the
+  ``(created_at, id)`` index, then loads its own rows by key,
+- searches go through the full-text index,
+- the date hierarchy finds its years, months and days with one index lookup
+  each instead of grouping every row,
+- bulk actions are queued as celery tasks in chunks.
+"""
+import datetime
+import json
+
 from django.apps import apps
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.postgres.search import SearchQuery
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .models import Post, PostQuerySet
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate < settings.POSTS_ADMIN_EXACT_COUNT_LIMIT:
+            return super().count
+        return estimate
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        pks = self.object_list.values_list("pk", flat=True)
+        pks = list(pks[bottom : bottom + self.per_page])
+        return self._get_page(self.object_list.filter(pk__in=pks), number, self)
+
+
+def estimated_count(queryset):
+    """The planner's row estimate for ``queryset``, -1 if it has none."""
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            # kept up to date by autovacuum, -1 before the first analyze
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+        else:
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        row = cursor.fetchone()
+    if row is None:
+        return -1
+    value = row[0]
+    if isinstance(value, str):
+        value = json.loads(value)
+    if isinstance(value, list):
+        value = value[0]["Plan"]["Plan Rows"]
+    return int(value)
+
+
+class IndexedDatesQuerySet(PostQuerySet):
+    def datetimes(self, field_name, kind, order="ASC", tzinfo=None, **kwargs):
+        if kind not in ("year", "month", "day"):
+            return super().datetimes(field_name, kind, order, tzinfo, **kwargs)
+
+        # a loose index scan: the first value after each period found so far
+        tzinfo = tzinfo or timezone.get_current_timezone()
+        queryset = self.order_by()
+        periods = []
+        first = queryset.aggregate(first=Min(field_name))["first"]
+        while first is not None:
+            start = truncate(timezone.localtime(first, tzinfo), kind)
+            periods.append(start)
+            first = queryset.filter(
+                **{f"{field_name}__gte": following(start, kind, tzinfo)}
+            ).aggregate(first=Min(field_name))["first"]
+        return periods[::-1] if order == "DESC" else periods
+
+
+def truncate(value, kind):
+    value = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if kind in ("year", "month"):
+        value = value.replace(day=1)
+    if kind == "year":
+        value = value.replace(month=1)
+    return value
+
+
+def following(start, kind, tzinfo):
+    start = timezone.make_naive(start, tzinfo)
+    if kind == "year":
+        start = start.replace(year=start.year + 1)
+    elif kind == "month":
+        year, month = divmod(start.month, 12)
+        start = start.replace(year=start.year + year, month=month + 1)
+    else:
+        start += datetime.timedelta(days=1)
+    return timezone.make_aware(start, tzinfo)
+
+
+def chunked_pks(queryset):
+    pks = queryset.order_by().values_list("pk", flat=True)
+    chunk = []
+    for pk in pks.iterator(chunk_size=settings.POSTS_ADMIN_ACTION_CHUNK_SIZE):
+        chunk.append(pk)
+        if len(chunk) == settings.POSTS_ADMIN_ACTION_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@admin.register(Post)
+class PostAdmin(admin.ModelAdmin):
+    list_display = ("id", "title", "word_count", "views", "created_at", "updated_at")
+    # the columns with an index to sort by
+    sortable_by = ("id", "created_at", "updated_at")
+    ordering = ("-created_at", "-id")
+    date_hierarchy = "created_at"
+    search_fields = ("title", "content")
+    search_help_text = "Full-text search over the title and the content."
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ("delete_in_background", "render_in_background")
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        queryset = IndexedDatesQuerySet(
+            model=queryset.model, query=queryset.query.chain(), using=queryset._db
+        )
+        # the form loads the post again, with every column
+        return queryset.defer("content", "content_html", "toc", "search_vector")
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        query = SearchQuery(
+            search_term, search_type="websearch", config=settings.POSTS_SEARCH_CONFIG
+        )
+        return queryset.filter(search_vector=query), False
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # it loads every selected post and its relations in the request
+        actions.pop("delete_selected", None)
+        return actions
+
+    @admin.action(
+        permissions=["delete"], description="Delete selected posts in the background"
+    )
+    def delete_in_background(self, request, queryset):
+        from .tasks import delete_posts
+
+        self.queue(request, queryset, delete_posts, "deletion")
+
+    @admin.action(
+        permissions=["change"], description="Render selected posts in the background"
+    )
+    def render_in_background(self, request, queryset):
+        from .tasks import render_post_ids
+
+        self.queue(request, queryset, render_post_ids, "rendering")
+
+    def queue(self, request, queryset, task, name):
+        queued = 0
+        for pks in chunked_pks(queryset):
+            task.delay(pks)
+            queued += len(pks)
+        self.message_user(
+            request, f"Queued the {name} of {queued} posts.", messages.SUCCESS
+        )
+
 
 for key, model in apps.get_app_config("blog").models.items():
-    admin.site.register(model)
+    if not admin.site.is_registered(model):
+        admin.site.register(model)
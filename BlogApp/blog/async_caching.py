@@ -0,0 +1,178 @@
+"""
+Coroutine counterparts of ``caching`` for the ASGI read path.
+
+They talk to redis through ``redis.asyncio`` but build the same keys and store
+the same encoded entries as django_redis, so both paths share one cache.
+"""
+import asyncio
+import random
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from redis import asyncio as aioredis
+from redis.exceptions import LockError
+
+from BlogApp import metrics
+from BlogApp.db import routers
+
+from .caching import (
+    LIST_NAMESPACE,
+    POPULAR_KEY,
+    detail_namespace,
+    generation_key,
+    key_family,
+    make_entry,
+    params_digest,
+    redis_stats,
+    should_refresh,
+    stale_key,
+)
+from .counters import PENDING_KEY, RANKING_KEY
+from .local_cache import local_cache
+
+# a client is bound to the event loop it was created on
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = aioredis.from_url(settings.CACHES["default"]["LOCATION"])
+        _clients[loop] = client
+    return client
+
+
+async def aget(key):
+    with metrics.timer("redis"):
+        value = await get_client().get(cache.make_key(key))
+    return None if value is None else cache.client.decode(value)
+
+
+async def aset(key, value, timeout):
+    with metrics.timer("redis"):
+        await get_client().set(
+            cache.make_key(key), cache.client.encode(value), ex=timeout
+        )
+
+
+async def aget_generation(namespace):
+    key = generation_key(namespace)
+    if local_cache.enabled:
+        if not local_cache.listening:
+            # subscribing is a blocking round trip to redis
+            await sync_to_async(local_cache.ensure_listener, thread_sensitive=False)()
+        generation = local_cache.get(key)
+        if generation is not None:
+            return generation
+
+    generation = await aget(key)
+    if generation is None:
+        # same clock seed as the synchronous path
+        await get_client().set(
+            cache.make_key(key),
+            time.time_ns(),
+            nx=True,
+            ex=settings.POSTS_CACHE_GENERATION_TTL,
+        )
+        generation = await aget(key)
+
+    if local_cache.enabled:
+        local_cache.set(key, generation)
+    return generation
+
+
+async def abuild_key(namespace, query_params, variant=""):
+    digest = params_digest(query_params, variant)
+    return f"{namespace}:{await aget_generation(namespace)}:{digest}"
+
+
+async def aget_entry(key, family):
+    if local_cache.enabled:
+        entry = local_cache.get(key)
+        if entry is not None:
+            metrics.record_cache(family, True)
+            return entry
+
+    entry = await aget(key)
+    redis_stats["misses" if entry is None else "hits"] += 1
+    metrics.record_cache(family, entry is not None)
+    if entry is not None and local_cache.enabled:
+        local_cache.set(key, entry)
+    return entry
+
+
+async def afill(key, stale, compute):
+    started = time.time()
+    if await routers.arecent_write():
+        with routers.use_primary():
+            value = await compute()
+    else:
+        value = await compute()
+    entry = make_entry(value, started)
+    await aset(key, entry, settings.POSTS_CACHE_TTL)
+    await aset(stale, entry, settings.POSTS_CACHE_TTL + settings.POSTS_CACHE_GRACE)
+    if local_cache.enabled:
+        local_cache.set(key, entry)
+    return entry["value"]
+
+
+async def aget_or_compute(namespace, query_params, compute, variant=""):
+    key = await abuild_key(namespace, query_params, variant)
+    stale = stale_key(namespace, query_params, variant)
+
+    entry = await aget_entry(key, key_family(namespace, variant))
+    if entry is not None and not should_refresh(entry):
+        return entry["value"]
+
+    lock = get_client().lock(
+        cache.make_key(f"{key}:lock"), timeout=settings.POSTS_CACHE_LOCK_TIMEOUT
+    )
+    if await lock.acquire(blocking=False):
+        try:
+            return await afill(key, stale, compute)
+        finally:
+            try:
+                await lock.release()
+            except LockError:
+                pass
+
+    if entry is not None:
+        return entry["value"]
+    entry = await aget(stale)
+    if (
+        entry is not None
+        and time.time() < entry["expires"] + settings.POSTS_CACHE_GRACE
+    ):
+        return entry["value"]
+
+    deadline = time.monotonic() + settings.POSTS_CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        entry = await aget(key)
+        if entry is not None:
+            return entry["value"]
+    return await compute()
+
+
+async def alist_value(query_params, compute, variant=""):
+    return await aget_or_compute(LIST_NAMESPACE, query_params, compute, variant)
+
+
+async def adetail_value(pk, query_params, compute):
+    return await aget_or_compute(detail_namespace(pk), query_params, compute)
+
+
+async def arecord_hit(pk):
+    if random.random() < settings.POSTS_POPULAR_SAMPLE_RATE:
+        await get_client().zincrby(cache.make_key(POPULAR_KEY), 1, pk)
+
+
+async def arecord_view(pk):
+    pipeline = get_client().pipeline(transaction=False)
+    pipeline.hincrby(cache.make_key(PENDING_KEY), pk, 1)
+    pipeline.zincrby(cache.make_key(RANKING_KEY), 1, pk)
+    await pipeline.execute()
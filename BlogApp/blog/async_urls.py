@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .async_views import post_detail, post_list
+
+urlpatterns = [
+    path("posts/", post_list, name="async-posts-list"),
+    path("posts/<str:pk>/", post_detail, name="async-posts-detail"),
+]
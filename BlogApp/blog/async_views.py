@@ -0,0 +1,124 @@
+"""
+Async variants of the posts read endpoints for ASGI workers.
+
+They share the cache entries, the keyset pagination and the serializers of
+``PostViewSet`` and enforce the same JWT authentication and
+``CustomModelPermission`` checks, but load users and posts through the async
+ORM and redis through ``redis.asyncio``, so a worker waiting on either keeps
+serving its other connections.
+"""
+from functools import wraps
+
+from django.conf import settings
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import HttpResponse
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from BlogApp.authentication import AsyncJWTAuthentication
+from BlogApp.permissions import CustomModelPermission
+from . import async_caching, caching, row_serializers
+from .models import Post
+from .pagination import KeysetPagination
+from .serializers import PostSerializer, PostSummarySerializer
+from .views import PostViewSet
+
+
+def error_response(exc, authenticator, request):
+    if isinstance(exc.detail, (list, dict)):
+        data = exc.detail
+    else:
+        data = {"detail": exc.detail}
+
+    response = HttpResponse(
+        JSONRenderer().render(data),
+        content_type=JSONRenderer.media_type,
+        status=exc.status_code,
+    )
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        # what APIView does for an authenticator with a challenge header
+        response.status_code = status.HTTP_401_UNAUTHORIZED
+        response["WWW-Authenticate"] = authenticator.authenticate_header(request)
+    return response
+
+
+def posts_endpoint(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        authenticator = AsyncJWTAuthentication()
+        try:
+            if request.method not in ("GET", "HEAD"):
+                raise exceptions.MethodNotAllowed(request.method)
+
+            authenticated = await authenticator.aauthenticate(request)
+            if authenticated is None:
+                raise exceptions.NotAuthenticated()
+            user, _ = authenticated
+
+            perms = CustomModelPermission().get_required_permissions("GET", Post)
+            # the authenticator resolved the permissions already
+            if not user.has_perms(perms):
+                raise exceptions.PermissionDenied()
+
+            return await view(Request(request), *args, **kwargs)
+        except exceptions.APIException as exc:
+            return error_response(exc, authenticator, request)
+
+    return wrapper
+
+
+def render(data):
+    return caching.rendered(JSONRenderer().render(data), JSONRenderer.media_type)
+
+
+@posts_endpoint
+async def post_list(request):
+    async def compute():
+        paginator = KeysetPagination()
+        if settings.POSTS_FAST_SERIALIZATION:
+            layout = row_serializers.layout_for(PostSummarySerializer, request)
+            queryset = layout.rows(Post.objects.all(), "id", "created_at")
+        else:
+            queryset = Post.objects.only(*PostSummarySerializer.columns(request))
+        rows = [post async for post in paginator.page_queryset(queryset, request)]
+        page = paginator.set_page(rows)
+        if settings.POSTS_FAST_SERIALIZATION:
+            data = layout.serialize_many(page)
+        else:
+            data = PostSummarySerializer(
+                page, many=True, context={"request": request}
+            ).data
+        return render(paginator.get_paginated_response(data).data)
+
+    # pagination links point at this endpoint, so pages are cached apart
+    rendered = await async_caching.alist_value(
+        request.query_params, compute, variant="async"
+    )
+    return PostViewSet.cached_response(request, rendered)
+
+
+@posts_endpoint
+async def post_detail(request, pk):
+    pk = PostViewSet.detail_pk(pk)
+
+    async def compute():
+        if settings.POSTS_FAST_SERIALIZATION:
+            layout = row_serializers.layout_for(PostSerializer, request)
+            queryset = layout.rows(Post.objects.all(), "id")
+        else:
+            queryset = Post.objects.defer("search_vector")
+        try:
+            post = await queryset.aget(pk=pk)
+        except (Post.DoesNotExist, ValueError, DjangoValidationError):
+            raise exceptions.NotFound()
+        if settings.POSTS_FAST_SERIALIZATION:
+            return render(layout.serialize(post))
+        serializer = PostSerializer(post, context={"request": request})
+        return render(serializer.data)
+
+    rendered = await async_caching.adetail_value(pk, request.query_params, compute)
+    await async_caching.arecord_hit(pk)
+    await async_caching.arecord_view(pk)
+    return PostViewSet.cached_response(request, rendered)
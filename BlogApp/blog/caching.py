@@ -0,0 +1,318 @@
+"""
+Cache keys for the posts endpoints.
+
+Every key belongs to a namespace with a generation counter kept in redis and
+embeds that generation, so invalidating a namespace is a single INCR instead
+of finding and deleting the keys built from it; stale entries are simply never
+read again and age out through their TTL.
+
+Misses are recomputed by a single worker holding a redis lock. The others keep
+serving the last value built for the same parameters for up to
+``POSTS_CACHE_GRACE`` seconds, and entries are refreshed early with a
+probability that grows as their expiry approaches (XFetch), so a hot key does
+not expire under everyone at once.
+
+With ``POSTS_LOCAL_CACHE`` on, generations and entries are also kept in a small
+per-process tier (see ``local_cache``) that is consulted before redis.
+
+With ``POSTS_CACHE_WARM`` on, every invalidation also queues a celery task that
+rebuilds the first list pages and the changed details (see ``warming``).
+"""
+import hashlib
+import math
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import urlencode
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+from BlogApp import metrics
+from BlogApp.db import routers
+
+from . import compression
+from .local_cache import local_cache
+from .queues import DebouncedQueue
+
+LIST_NAMESPACE = "posts:list"
+POPULAR_KEY = "posts:popular"
+
+redis_stats = {"hits": 0, "misses": 0}
+
+_pending = ContextVar("posts_pending_invalidations", default=None)
+
+warm_queue = DebouncedQueue(
+    "posts:warm", "BlogApp.blog.tasks.warm_posts_cache", "POSTS_CACHE_WARM_DEBOUNCE"
+)
+
+
+def detail_namespace(pk):
+    return f"posts:detail:{pk}"
+
+
+def generation_key(namespace):
+    return f"{namespace}:generation"
+
+
+def get_generation(namespace):
+    key = generation_key(namespace)
+    if local_cache.enabled:
+        local_cache.ensure_listener()
+        generation = local_cache.get(key)
+        if generation is not None:
+            return generation
+
+    generation = cache.get(key)
+    if generation is None:
+        # seed from the clock so a lost or expired counter can never make keys
+        # from an earlier generation valid again
+        cache.add(key, time.time_ns(), timeout=settings.POSTS_CACHE_GENERATION_TTL)
+        generation = cache.get(key)
+
+    if local_cache.enabled:
+        local_cache.set(key, generation)
+    return generation
+
+
+def bump_generations(namespaces):
+    # seed-if-missing and increment every counter in a single round trip
+    pipeline = get_redis_connection("default").pipeline(transaction=False)
+    for namespace in namespaces:
+        key = cache.make_key(generation_key(namespace))
+        pipeline.set(
+            key, time.time_ns(), nx=True, ex=settings.POSTS_CACHE_GENERATION_TTL
+        )
+        pipeline.incr(key)
+    pipeline.execute()
+
+
+def normalize_params(query_params):
+    items = sorted(
+        (key, value) for key in query_params for value in query_params.getlist(key)
+    )
+    return urlencode(items)
+
+
+def params_digest(query_params, variant=""):
+    # the variant tells apart endpoints sharing a namespace, e.g. list and search
+    normalized = f"{variant}?{normalize_params(query_params)}"
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+def build_key(namespace, query_params, variant=""):
+    digest = params_digest(query_params, variant)
+    return f"{namespace}:{get_generation(namespace)}:{digest}"
+
+
+def stale_key(namespace, query_params, variant=""):
+    return f"{namespace}:stale:{params_digest(query_params, variant)}"
+
+
+def list_key(query_params, variant=""):
+    return build_key(LIST_NAMESPACE, query_params, variant)
+
+
+def detail_key(pk, query_params):
+    return build_key(detail_namespace(pk), query_params)
+
+
+def should_refresh(entry):
+    # the product of the recompute time and an exponentially distributed
+    # random number: expensive entries start refreshing earlier
+    jitter = -entry["delta"] * settings.POSTS_CACHE_EARLY_REFRESH_BETA
+    return time.time() + jitter * math.log(1.0 - random.random()) >= entry["expires"]
+
+
+def make_entry(value, started):
+    finished = time.time()
+    return {
+        "value": value,
+        "delta": finished - started,
+        "expires": finished + settings.POSTS_CACHE_TTL,
+    }
+
+
+def fill(key, stale, compute):
+    started = time.time()
+    # entries built from a replica could miss a write for their whole ttl
+    with routers.primary_after_writes():
+        value = compute()
+    entry = make_entry(value, started)
+    cache.set(key, entry, settings.POSTS_CACHE_TTL)
+    cache.set(stale, entry, settings.POSTS_CACHE_TTL + settings.POSTS_CACHE_GRACE)
+    if local_cache.enabled:
+        local_cache.set(key, entry)
+    return entry["value"]
+
+
+def key_family(namespace, variant=""):
+    # the metrics label, e.g. "list", "list:search" or "detail"
+    family = "list" if namespace == LIST_NAMESPACE else "detail"
+    return f"{family}:{variant}" if variant else family
+
+
+def get_entry(key, family):
+    if local_cache.enabled:
+        entry = local_cache.get(key)
+        if entry is not None:
+            metrics.record_cache(family, True)
+            return entry
+
+    entry = cache.get(key)
+    redis_stats["misses" if entry is None else "hits"] += 1
+    metrics.record_cache(family, entry is not None)
+    if entry is not None and local_cache.enabled:
+        local_cache.set(key, entry)
+    return entry
+
+
+@contextmanager
+def rebuild_lock(key):
+    lock = cache.lock(f"{key}:lock", timeout=settings.POSTS_CACHE_LOCK_TIMEOUT)
+    acquired = lock.acquire(blocking=False)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except LockError:
+                # the rebuild outlived the lock timeout
+                pass
+
+
+def get_or_compute(namespace, query_params, compute, variant=""):
+    key = build_key(namespace, query_params, variant)
+    stale = stale_key(namespace, query_params, variant)
+
+    entry = get_entry(key, key_family(namespace, variant))
+    if entry is not None and not should_refresh(entry):
+        return entry["value"]
+
+    with rebuild_lock(key) as acquired:
+        if acquired:
+            return fill(key, stale, compute)
+
+    # somebody else is rebuilding this key
+    if entry is not None:
+        return entry["value"]
+    entry = cache.get(stale)
+    if (
+        entry is not None
+        and time.time() < entry["expires"] + settings.POSTS_CACHE_GRACE
+    ):
+        return entry["value"]
+
+    # nothing to serve yet, give the winner a moment before computing ourselves
+    deadline = time.monotonic() + settings.POSTS_CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry["value"]
+    return compute()
+
+
+def warm(namespace, query_params, compute, variant=""):
+    """
+    Fill the entry for ``query_params`` ahead of the readers. Returns its
+    value, or None if somebody else is rebuilding it.
+    """
+    key = build_key(namespace, query_params, variant)
+    entry = cache.get(key)
+    if entry is not None:
+        return entry["value"]
+    with rebuild_lock(key) as acquired:
+        if acquired:
+            return fill(key, stale_key(namespace, query_params, variant), compute)
+    return None
+
+
+def rendered(body, content_type):
+    """
+    A cacheable response: the encoded body, its compressed variants and a
+    strong ETag hashed from the body, pagination links included.
+    """
+    with metrics.timer("compress"):
+        encodings = compression.compress(body)
+    return {
+        "body": body,
+        "content_type": content_type,
+        "etag": f'"{hashlib.sha1(body).hexdigest()}"',
+        "encodings": encodings,
+    }
+
+
+def list_value(query_params, compute, variant=""):
+    return get_or_compute(LIST_NAMESPACE, query_params, compute, variant)
+
+
+def detail_value(pk, query_params, compute):
+    return get_or_compute(detail_namespace(pk), query_params, compute)
+
+
+@contextmanager
+def batched_invalidation():
+    """
+    Collect the invalidations issued inside the block and apply them once on
+    the way out, so a batch of writes bumps every generation a single time.
+    Open it outside the transaction to invalidate after the commit.
+    """
+    if _pending.get() is not None:
+        yield
+        return
+
+    pks = set()
+    token = _pending.set(pks)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+        invalidate_posts(pks)
+
+
+def invalidate_posts(pks=()):
+    pending = _pending.get()
+    if pending is not None:
+        pending.update(pks)
+        return
+
+    namespaces = [LIST_NAMESPACE, *(detail_namespace(pk) for pk in pks)]
+    bump_generations(namespaces)
+    routers.record_write()
+    if local_cache.enabled:
+        local_cache.publish([generation_key(namespace) for namespace in namespaces])
+    if settings.POSTS_CACHE_WARM:
+        # rebuilt in the background before most readers ask for them
+        warm_queue.add_on_commit(pks)
+
+
+def record_hit(pk):
+    # sampled, the scores only have to rank the posts
+    if random.random() < settings.POSTS_POPULAR_SAMPLE_RATE:
+        get_redis_connection("default").zincrby(cache.make_key(POPULAR_KEY), 1, pk)
+
+
+def popular_posts(count):
+    pks = get_redis_connection("default").zrevrange(
+        cache.make_key(POPULAR_KEY), 0, count - 1
+    )
+    return [int(pk) for pk in pks]
+
+
+def decay_popular(factor, keep):
+    # older requests weigh less after every run and only the top ``keep``
+    # posts are tracked, so the ranking follows the current traffic
+    key = cache.make_key(POPULAR_KEY)
+    pipeline = get_redis_connection("default").pipeline(transaction=True)
+    pipeline.zunionstore(key, {key: factor})
+    pipeline.zremrangebyrank(key, 0, -keep - 1)
+    pipeline.execute()
+
+
+def tier_stats():
+    return {"local": local_cache.stats(), "redis": dict(redis_stats)}
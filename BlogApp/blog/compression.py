@@ -0,0 +1,69 @@
+"""
+Compressed variants of cached responses.
+
+Bodies of at least ``POSTS_COMPRESS_MIN_SIZE`` bytes are compressed with gzip,
+and with brotli when it is installed, once when their entry is filled. Cache
+hits pick the variant the client accepts and send it as is.
+"""
+import gzip
+import re
+
+from django.conf import settings
+from rest_framework.exceptions import NotAcceptable
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# the order a client's equally weighted codings are preferred in
+PREFERENCE = ("br", "gzip")
+
+_coding = re.compile(r"^\s*([a-z*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$", re.IGNORECASE)
+
+
+def compress(body):
+    """The encoded variants of ``body`` by content coding."""
+    if len(body) < settings.POSTS_COMPRESS_MIN_SIZE:
+        return {}
+    encodings = {"gzip": gzip.compress(body, settings.POSTS_GZIP_LEVEL, mtime=0)}
+    if brotli is not None:
+        encodings["br"] = brotli.compress(body, quality=settings.POSTS_BROTLI_QUALITY)
+    return encodings
+
+
+def accepted(header):
+    """The content codings in an ``Accept-Encoding`` header and their weights."""
+    weights = {}
+    for item in header.split(","):
+        match = _coding.match(item)
+        if match is None:
+            continue
+        try:
+            weight = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            continue
+        weights[match.group(1).lower()] = weight
+    return weights
+
+
+def negotiate(header, available):
+    """The best coding in ``available`` for ``header``, None for identity."""
+    if not header:
+        return None
+    weights = accepted(header)
+    # RFC 9110 12.5.3: identity is acceptable unless refused by name or by "*",
+    # and one that is not listed loses to any coding that is
+    identity = weights.get("identity", weights.get("*"))
+    best, best_weight = None, 0.0
+    for coding in PREFERENCE:
+        if coding not in available:
+            continue
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    if best is not None and (identity is None or best_weight >= identity):
+        return best
+    if identity == 0.0:
+        raise NotAcceptable("None of the accepted content codings is available.")
+    return None
@@ -0,0 +1,114 @@
+"""
+Write-behind view counts.
+
+Every retrieve adds one to the post's pending count in a redis hash and to its
+total in a sorted set, in a single round trip, so reads never write to
+postgres. A periodic celery task moves the pending counts to ``Post.views``
+with one UPDATE, and the most viewed posts are ranked from the sorted set.
+
+A flush first renames the hash to ``FLUSHING_KEY``, so views recorded
+meanwhile go to a fresh hash, and deletes it only after the UPDATE committed.
+A flush that finds the key left by a worker that died on the way applies it
+before anything else, so no counts are lost; a worker dying right after the
+commit would have that batch applied twice.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django_redis import get_redis_connection
+from redis.exceptions import LockError, ResponseError
+
+from .models import Post
+
+PENDING_KEY = "posts:views:pending"
+FLUSHING_KEY = "posts:views:flushing"
+RANKING_KEY = "posts:views:ranking"
+SEEDED_KEY = "posts:views:ranking:seeded"
+FLUSH_LOCK_KEY = "posts:views:flush"
+
+
+def record_view(pk):
+    pipeline = get_redis_connection("default").pipeline(transaction=False)
+    pipeline.hincrby(cache.make_key(PENDING_KEY), pk, 1)
+    pipeline.zincrby(cache.make_key(RANKING_KEY), 1, pk)
+    pipeline.execute()
+
+
+def most_viewed(count):
+    """The ``count`` most viewed post ids with their view counts."""
+    pairs = get_redis_connection("default").zrevrange(
+        cache.make_key(RANKING_KEY), 0, count - 1, withscores=True
+    )
+    return [(int(pk), int(score)) for pk, score in pairs]
+
+
+def take_pending(redis):
+    flushing = cache.make_key(FLUSHING_KEY)
+    # a batch left over by a flush that did not finish goes first
+    if not redis.exists(flushing):
+        try:
+            redis.rename(cache.make_key(PENDING_KEY), flushing)
+        except ResponseError:
+            # no views since the last flush
+            return {}
+    return {int(pk): int(delta) for pk, delta in redis.hgetall(flushing).items()}
+
+
+def apply_deltas(deltas):
+    """Add ``deltas`` to the view counts in one UPDATE, returns the new totals."""
+    table = connection.ops.quote_name(Post._meta.db_table)
+    rows = ", ".join(["(%s, %s)"] * len(deltas))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} SET views = {table}.views + deltas.delta "
+            f"FROM (VALUES {rows}) AS deltas (id, delta) "
+            f"WHERE {table}.id = deltas.id RETURNING {table}.id, {table}.views",
+            [value for item in deltas.items() for value in item],
+        )
+        return dict(cursor.fetchall())
+
+
+def flush():
+    """Move the pending view counts to postgres, returns how many posts changed."""
+    redis = get_redis_connection("default")
+    lock = cache.lock(FLUSH_LOCK_KEY, timeout=settings.POSTS_VIEWS_FLUSH_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return 0
+    try:
+        deltas = take_pending(redis)
+        totals = {}
+        if deltas:
+            # deleted posts are simply left out of the update
+            with transaction.atomic():
+                totals = apply_deltas(deltas)
+            redis.delete(cache.make_key(FLUSHING_KEY))
+        sync_ranking(redis, totals)
+        return len(totals)
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            # the flush outlived the lock timeout
+            pass
+
+
+def sync_ranking(redis, totals):
+    key = cache.make_key(RANKING_KEY)
+    # the marker goes along with the ranking when redis loses its data
+    if redis.set(cache.make_key(SEEDED_KEY), 1, nx=True):
+        totals = {
+            **dict(
+                Post.objects.filter(views__gt=0)
+                .order_by("-views", "id")
+                .values_list("id", "views")[: settings.POSTS_VIEWS_MAX_RANKED]
+            ),
+            **totals,
+        }
+    if not totals:
+        return
+    pipeline = redis.pipeline(transaction=True)
+    # the stored totals only ever raise a score: they lag the live counts but
+    # bring back the views the ranking lost
+    pipeline.zadd(key, totals, gt=True)
+    pipeline.zremrangebyrank(key, 0, -settings.POSTS_VIEWS_MAX_RANKED - 1)
+    pipeline.execute()
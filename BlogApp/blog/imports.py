@@ -0,0 +1,115 @@
+"""
+Bulk import of posts from NDJSON or CSV files.
+
+Uploads are copied to ``POSTS_IMPORT_DIR`` as they are read from the request
+and imported by a celery task, which validates the rows with
+``PostSerializer`` and inserts them ``POSTS_IMPORT_CHUNK_SIZE`` at a time.
+"""
+import csv
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
+from rest_framework.serializers import ValidationError
+
+from .caching import invalidate_posts
+from .serializers import PostSerializer
+
+FORMATS = {
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+}
+
+# the report keeps the details of this many invalid rows
+MAX_REPORTED_ERRORS = 100
+
+
+def upload_format(content_type):
+    media_type = content_type.split(";")[0].strip().lower()
+    try:
+        return FORMATS[media_type]
+    except KeyError:
+        raise UnsupportedMediaType(media_type)
+
+
+def save_upload(request, format):
+    """Copy the request body to a new file, returns its path."""
+    if request.stream is None:
+        raise ParseError("The upload is empty.")
+
+    os.makedirs(settings.POSTS_IMPORT_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=f".{format}", dir=settings.POSTS_IMPORT_DIR)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            shutil.copyfileobj(request.stream, file, 64 * 1024)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def read_rows(path, format):
+    """Yield ``(line, row)`` for each record, ``row`` is None if unreadable."""
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        if format == "csv":
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row
+            return
+
+        for line, text in enumerate(file, 1):
+            if not text.strip():
+                continue
+            try:
+                yield line, json.loads(text)
+            except ValueError:
+                yield line, None
+
+
+def import_file(path, format, progress=None):
+    """
+    Import the posts in ``path`` and return a report of the rows processed,
+    created and rejected. ``progress`` is called with the report after each
+    chunk.
+    """
+    report = {"processed": 0, "created": 0, "failed": 0, "errors": []}
+    serializer = PostSerializer(many=True)
+
+    def reject(line, errors):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line, "errors": errors})
+
+    def create(chunk):
+        with transaction.atomic():
+            serializer.create(chunk)
+        report["created"] += len(chunk)
+        if progress is not None:
+            progress(dict(report))
+
+    chunk = []
+    for line, row in read_rows(path, format):
+        report["processed"] += 1
+        if row is None:
+            reject(line, ["Invalid JSON."])
+            continue
+        try:
+            chunk.append(serializer.child.run_validation(row))
+        except ValidationError as exc:
+            reject(line, exc.detail)
+            continue
+        if len(chunk) == settings.POSTS_IMPORT_CHUNK_SIZE:
+            create(chunk)
+            chunk = []
+    if chunk:
+        create(chunk)
+
+    # new posts only change the list pages, invalidated once for the file
+    if report["created"]:
+        invalidate_posts()
+    return report
@@ -0,0 +1,130 @@
+"""
+Per-process LRU tier in front of the shared redis cache.
+
+Entries live for at most ``POSTS_LOCAL_CACHE_TTL`` seconds and the tier holds
+at most ``POSTS_LOCAL_CACHE_MAX_ENTRIES`` of them. Invalidations are published
+on a redis channel and every process listening on it drops the affected keys
+right away; the TTL only bounds staleness when a message is missed.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "posts:invalidate"
+
+
+class LocalCache:
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener_lock = threading.Lock()
+        self._listener = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return settings.POSTS_LOCAL_CACHE
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        expires = time.monotonic() + settings.POSTS_LOCAL_CACHE_TTL
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.POSTS_LOCAL_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    def publish(self, keys):
+        # the publishing process drops its own copies without the round trip
+        self.delete_many(keys)
+        try:
+            get_redis_connection("default").publish(
+                INVALIDATION_CHANNEL, json.dumps(list(keys))
+            )
+        except RedisError:
+            logger.exception("could not broadcast the posts cache invalidation")
+
+    @property
+    def listening(self):
+        # forked workers inherit the object but not the thread
+        return self._pid == os.getpid() and self._listener.is_alive()
+
+    def ensure_listener(self):
+        if self.listening:
+            return
+        # the entries stay readable while this process subscribes
+        with self._listener_lock:
+            if self.listening:
+                return
+            # subscribe before serving anything from this process' tier
+            pubsub = self._subscribe()
+            self.clear()
+            self._pid = os.getpid()
+            self._listener = threading.Thread(
+                target=self._listen,
+                args=(pubsub,),
+                name="posts-cache-invalidation",
+                daemon=True,
+            )
+            self._listener.start()
+
+    @staticmethod
+    def _subscribe():
+        pubsub = get_redis_connection("default").pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(INVALIDATION_CHANNEL)
+        return pubsub
+
+    def _listen(self, pubsub):
+        while True:
+            try:
+                for message in pubsub.listen():
+                    self.delete_many(json.loads(message["data"]))
+            except (RedisError, ValueError):
+                logger.exception("posts cache invalidation listener failed")
+                time.sleep(1)
+                try:
+                    pubsub = self._subscribe()
+                except RedisError:
+                    continue
+                # anything published while we were not subscribed is lost
+                self.clear()
+
+
+local_cache = LocalCache()
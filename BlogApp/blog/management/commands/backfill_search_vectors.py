@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from BlogApp.blog.caching import invalidate_posts
+from BlogApp.blog.models import Post
+
+
+class Command(BaseCommand):
+    help = "Compute the full-text search vector of existing posts in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recompute every post, not only those without a vector.",
+        )
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.order_by("id")
+        if not options["all"]:
+            queryset = queryset.filter(search_vector__isnull=True)
+
+        # walk the primary key so every chunk is a short, index-backed update
+        # instead of one transaction locking the whole table
+        last_id, updated = 0, 0
+        while True:
+            ids = list(
+                queryset.filter(id__gt=last_id).values_list("id", flat=True)[
+                    : options["chunk_size"]
+                ]
+            )
+            if not ids:
+                break
+            updated += Post.objects.filter(id__in=ids).update_search_vector()
+            last_id = ids[-1]
+            self.stdout.write(f"{updated} posts updated (last id {last_id})")
+
+        if updated:
+            invalidate_posts()
+        self.stdout.write(self.style.SUCCESS(f"Done, {updated} posts updated."))
@@ -0,0 +1,82 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from BlogApp.blog.models import Post
+from BlogApp.blog.row_serializers import layout_for
+from BlogApp.blog.serializers import PostSerializer, PostSummarySerializer
+
+SERIALIZERS = {"summary": PostSummarySerializer, "detail": PostSerializer}
+
+
+def model_path(serializer_class, rows):
+    # the columns PostViewSet loads for the list and the detail
+    queryset = Post.objects.order_by("-created_at", "-id")
+    if serializer_class is PostSummarySerializer:
+        queryset = queryset.only(*PostSummarySerializer.columns(None))
+    else:
+        queryset = queryset.defer("search_vector")
+    return serializer_class(list(queryset[:rows]), many=True).data
+
+
+def row_path(serializer_class, rows):
+    layout = layout_for(serializer_class)
+    queryset = layout.rows(Post.objects.order_by("-created_at", "-id"))
+    return layout.serialize_many(list(queryset[:rows]))
+
+
+def best_of(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), statistics.median(timings)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time fetching and serializing a page of posts through model instances "
+        "and through rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--output", help="write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        if Post.objects.count() < rows:
+            raise CommandError(f"Seed at least {rows} posts first, see seed_posts.")
+
+        results = []
+        for name, serializer_class in SERIALIZERS.items():
+            # a speedup only counts if both build the same output
+            if model_path(serializer_class, rows) != row_path(serializer_class, rows):
+                raise CommandError(f"The {name} outputs differ.")
+
+            repeat = options["repeat"]
+            model = best_of(lambda: model_path(serializer_class, rows), repeat)
+            row = best_of(lambda: row_path(serializer_class, rows), repeat)
+            result = {
+                "serializer": name,
+                "rows": rows,
+                # per 1k rows, best and median of the runs
+                "model_ms": round(model[0] * 1e6 / rows, 2),
+                "model_median_ms": round(model[1] * 1e6 / rows, 2),
+                "rows_ms": round(row[0] * 1e6 / rows, 2),
+                "rows_median_ms": round(row[1] * 1e6 / rows, 2),
+                "speedup": round(model[0] / row[0], 2),
+            }
+            results.append(result)
+            self.stdout.write(
+                f"{name}: {result['model_ms']} ms per 1k rows through models, "
+                f"{result['rows_ms']} ms through rows, {result['speedup']}x"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
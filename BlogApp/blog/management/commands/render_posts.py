@@ -0,0 +1,50 @@
+from celery import group
+from django.core.management.base import BaseCommand
+
+from BlogApp.blog.models import Post
+from BlogApp.blog.tasks import render_post_ids
+
+
+class Command(BaseCommand):
+    help = "Render the markdown content of existing posts with celery workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Render every post, not only those without html.",
+        )
+        parser.add_argument(
+            "--wait",
+            action="store_true",
+            help="Wait for the workers to finish and report the rendered posts.",
+        )
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.order_by("id")
+        if not options["all"]:
+            queryset = queryset.filter(content_html="").exclude(content="")
+
+        # one task per chunk of ids, the workers render them in parallel
+        chunks, last_id = [], 0
+        while True:
+            ids = list(
+                queryset.filter(id__gt=last_id).values_list("id", flat=True)[
+                    : options["chunk_size"]
+                ]
+            )
+            if not ids:
+                break
+            chunks.append(render_post_ids.s(ids))
+            last_id = ids[-1]
+
+        if not chunks:
+            self.stdout.write(self.style.SUCCESS("Nothing to render."))
+            return
+
+        result = group(chunks).apply_async()
+        self.stdout.write(f"{len(chunks)} chunks queued.")
+        if options["wait"]:
+            rendered = sum(result.get())
+            self.stdout.write(self.style.SUCCESS(f"Done, {rendered} posts rendered."))
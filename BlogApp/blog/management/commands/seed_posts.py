@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from benchmarks.content import PostFactory
+from BlogApp.blog.caching import invalidate_posts
+from BlogApp.blog.models import Post
+from BlogApp.blog.rendering import render_posts
+
+
+class Command(BaseCommand):
+    help = "Fill the database with generated posts for the benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--seed", type=int, default=0, help="The same seed makes the same posts."
+        )
+        parser.add_argument(
+            "--clear", action="store_true", help="Delete every post first."
+        )
+        parser.add_argument(
+            "--defer-render",
+            action="store_true",
+            help="Leave the rendering to the celery workers instead of doing it here.",
+        )
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            deleted, _ = Post.objects.all().delete()
+            self.stdout.write(f"{deleted} posts deleted.")
+
+        factory = PostFactory(options["seed"])
+        created = 0
+        while created < options["count"]:
+            size = min(options["batch_size"], options["count"] - created)
+            posts = [Post(**factory.post()) for _ in range(size)]
+            if not options["defer_render"]:
+                # posts created with their html are not queued for rendering
+                for post in posts:
+                    post.refresh_summary()
+                render_posts(posts)
+            Post.objects.bulk_create(posts)
+            created += size
+            self.stdout.write(f"{created}/{options['count']} posts created.")
+
+        invalidate_posts()
+        self.stdout.write(self.style.SUCCESS(f"Done, {created} posts created."))
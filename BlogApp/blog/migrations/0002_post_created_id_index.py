@@ -0,0 +1,18 @@
+# Generated by Django 4.2.9 on 2026-10-18 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("blog", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["created_at", "id"], name="blog_post_created_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.9 on 2026-10-18 17:33
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+# the default of POSTS_EXCERPT_LENGTH, later writes use the setting
+EXCERPT_LENGTH = 200
+
+
+def fill_summaries(apps, schema_editor):
+    Post = apps.get_model("blog", "Post")
+    posts = Post.objects.only("id", "content").order_by("id")
+
+    last_id = 0
+    while True:
+        chunk = list(posts.filter(id__gt=last_id)[:1000])
+        if not chunk:
+            break
+        for post in chunk:
+            words = post.content.split()
+            post.excerpt = Truncator(" ".join(words)).chars(EXCERPT_LENGTH)
+            post.word_count = len(words)
+        Post.objects.bulk_update(chunk, ["excerpt", "word_count"])
+        last_id = chunk[-1].id
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("blog", "0003_post_search_vector"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="excerpt",
+            field=models.CharField(blank=True, editable=False, max_length=300),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="word_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
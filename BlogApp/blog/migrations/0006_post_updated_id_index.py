@@ -0,0 +1,18 @@
+# Generated by Django 4.2.9 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("blog", "0005_post_content_html"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["updated_at", "id"], name="blog_post_updated_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.9 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("blog", "0006_post_updated_id_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="views",
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
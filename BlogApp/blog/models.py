@@ -1,11 +1,90 @@
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
+from django.utils.text import Truncator
+
+from .rendering import schedule_render
 
 
 # Create your models here.
 
 
+class PostQuerySet(models.QuerySet):
+    def update_search_vector(self):
+        config = settings.POSTS_SEARCH_CONFIG
+        return self.update(
+            search_vector=SearchVector("title", weight="A", config=config)
+            + SearchVector("content", weight="B", config=config)
+        )
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.refresh_summary()
+
+        # bulk inserts skip the signals that keep the search vector current
+        objs = super().bulk_create(objs, *args, **kwargs)
+        ids = [obj.id for obj in objs]
+        self.model.objects.filter(id__in=ids).update_search_vector()
+        schedule_render(obj.id for obj in objs if not obj.content_html)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if "content" in fields:
+            objs = list(objs)
+            for obj in objs:
+                obj.refresh_summary()
+            fields = [*fields, "excerpt", "word_count"]
+
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        ids = [obj.id for obj in objs]
+        if {"title", "content"} & set(fields):
+            self.model.objects.filter(id__in=ids).update_search_vector()
+        if "content" in fields:
+            schedule_render(ids)
+        return rows
+
+
 class Post(models.Model):
     title = models.CharField(max_length=200)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    excerpt = models.CharField(max_length=300, blank=True, editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    # rendered from the content by a celery task after each write
+    content_html = models.TextField(blank=True, editable=False)
+    reading_time = models.PositiveIntegerField(default=0, editable=False)
+    toc = models.JSONField(default=list, blank=True, editable=False)
+    # counted in redis and added up here by a periodic celery task
+    views = models.PositiveBigIntegerField(default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # backs the keyset pagination of the posts list in both directions
+            models.Index(fields=["created_at", "id"], name="blog_post_created_id_idx"),
+            GinIndex(fields=["search_vector"], name="blog_post_search_idx"),
+            # backs the incremental exports
+            models.Index(fields=["updated_at", "id"], name="blog_post_updated_id_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.refresh_summary()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "content" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "excerpt", "word_count"}
+        super().save(*args, **kwargs)
+
+    def refresh_summary(self):
+        # stored so list pages never have to load the content column
+        words = self.content.split()
+        # the setting can ask for more than the column holds
+        length = min(
+            settings.POSTS_EXCERPT_LENGTH, self._meta.get_field("excerpt").max_length
+        )
+        self.excerpt = Truncator(" ".join(words)).chars(length)
+        self.word_count = len(words)
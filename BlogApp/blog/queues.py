@@ -0,0 +1,63 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+
+class DebouncedQueue:
+    """
+    Post ids collected in a redis set and handled by a single celery task.
+
+    The first ``add`` schedules the task ``delay_setting`` seconds later and
+    the ones made before it starts only add to the set, so a burst of writes
+    runs the task once. The task calls ``clear_scheduled`` first, then pops
+    the ids in batches.
+    """
+
+    def __init__(self, name, task, delay_setting):
+        self.pending_key = f"{name}:pending"
+        self.scheduled_key = f"{name}:scheduled"
+        self.task = task
+        self.delay_setting = delay_setting
+
+    @property
+    def delay(self):
+        return getattr(settings, self.delay_setting)
+
+    def add_on_commit(self, pks=()):
+        pks = list(pks)
+        transaction.on_commit(lambda: self.add(pks))
+
+    def add(self, pks=()):
+        connection = get_redis_connection("default")
+        if pks:
+            connection.sadd(cache.make_key(self.pending_key), *pks)
+        scheduled = cache.make_key(self.scheduled_key)
+        # expires in case the task is lost, so a later write schedules again
+        if not connection.set(scheduled, 1, nx=True, ex=max(self.delay * 10, 60)):
+            return
+        try:
+            # celery is only imported once a task is dispatched
+            import_string(self.task).apply_async(countdown=self.delay)
+        except Exception:
+            connection.delete(scheduled)
+            logger.exception("could not schedule %s", self.task)
+
+    def pop(self, count):
+        pks = get_redis_connection("default").spop(
+            cache.make_key(self.pending_key), count
+        )
+        return [int(pk) for pk in pks or ()]
+
+    def clear_scheduled(self):
+        get_redis_connection("default").delete(cache.make_key(self.scheduled_key))
+
+    def clear(self):
+        get_redis_connection("default").delete(
+            cache.make_key(self.pending_key), cache.make_key(self.scheduled_key)
+        )
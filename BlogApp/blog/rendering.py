@@ -0,0 +1,68 @@
+"""
+Markdown rendering of post content, done by celery after writes.
+
+Saved posts are added to a redis set and a single flush task is scheduled
+``POSTS_RENDER_DEBOUNCE`` seconds later, so a burst of edits to the same post is
+rendered once and edits to many posts are rendered in batches. The task always
+renders the content stored at the time it runs; an edit landing after that is
+queued again.
+"""
+import math
+
+from django.conf import settings
+from django.utils.text import slugify
+from markdown_it import MarkdownIt
+
+from .queues import DebouncedQueue
+
+# raw html in the content is escaped and unsafe link schemes are not rendered
+markdown = MarkdownIt("commonmark", {"html": False})
+
+
+def render_markdown(content):
+    """The html of ``content`` and a table of contents of its headings."""
+    env = {}
+    tokens = markdown.parse(content, env)
+    toc, slugs = [], set()
+    for index, token in enumerate(tokens):
+        if token.type != "heading_open":
+            continue
+        title = "".join(
+            child.content
+            for child in tokens[index + 1].children or ()
+            if child.type in ("text", "code_inline")
+        )
+        slug = base = slugify(title) or "section"
+        suffix = 1
+        while slug in slugs:
+            suffix += 1
+            slug = f"{base}-{suffix}"
+        slugs.add(slug)
+        token.attrSet("id", slug)
+        toc.append({"level": int(token.tag[1]), "title": title, "id": slug})
+    return markdown.renderer.render(tokens, markdown.options, env), toc
+
+
+def reading_time(word_count):
+    return math.ceil(word_count / settings.POSTS_WORDS_PER_MINUTE)
+
+
+def render_posts(posts):
+    """Render ``posts`` and set their html, reading time and toc."""
+    posts = list(posts)
+    for post in posts:
+        post.content_html, post.toc = render_markdown(post.content)
+        post.reading_time = reading_time(post.word_count)
+    return posts
+
+
+queue = DebouncedQueue(
+    "posts:render", "BlogApp.blog.tasks.flush_render_queue", "POSTS_RENDER_DEBOUNCE"
+)
+
+
+def schedule_render(pks):
+    """Queue posts for rendering once the current transaction commits."""
+    pks = list(pks)
+    if pks:
+        queue.add_on_commit(pks)
@@ -0,0 +1,108 @@
+"""
+Read-only serialization of posts straight from database rows.
+
+A ``ModelSerializer`` class is compiled once into a ``RowLayout``: the model
+column behind each of its fields and a function turning a column value into
+what the field's ``to_representation`` returns for it. Pages are then fetched
+as named tuples with ``values_list`` and turned into the same dicts the
+serializer builds, without a model instance or a bound serializer per row.
+
+Only fields reading a concrete column of the model can be compiled. The
+posts endpoints use it when ``POSTS_FAST_SERIALIZATION`` is on.
+"""
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+_layouts = {}
+
+
+def identity(value):
+    return value
+
+
+def datetime_converter(field):
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != ISO_8601:
+        return field.to_representation
+
+    enforce_timezone = field.enforce_timezone
+
+    def convert(value):
+        value = enforce_timezone(value).isoformat()
+        if value.endswith("+00:00"):
+            value = value[:-6] + "Z"
+        return value
+
+    return convert
+
+
+def converter(field):
+    """What ``field.to_representation`` does, minus the per call overhead."""
+    kind = type(field)
+    if kind is serializers.IntegerField:
+        return int
+    if kind is serializers.CharField:
+        return str
+    if kind is serializers.JSONField and not field.binary:
+        return identity
+    if kind is serializers.DateTimeField:
+        return datetime_converter(field)
+    return field.to_representation
+
+
+class RowLayout:
+    def __init__(self, fields):
+        # (name, column, convert) in the order of the serializer's output
+        self.fields = tuple(fields)
+        self.columns = list(dict.fromkeys(column for _, column, _ in self.fields))
+        self.positions = [self.columns.index(column) for _, column, _ in self.fields]
+
+    @classmethod
+    def compile(cls, serializer_class):
+        model = serializer_class.Meta.model
+        fields = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            try:
+                column = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                column = None
+            if column is None or not column.concrete or column.is_relation:
+                raise ImproperlyConfigured(
+                    f"{serializer_class.__name__}.{name} does not read a column "
+                    f"of {model.__name__}"
+                )
+            fields.append((name, column.attname, converter(field)))
+        return cls(fields)
+
+    def select(self, names):
+        if not names:
+            return self
+        return RowLayout(field for field in self.fields if field[0] in names)
+
+    def rows(self, queryset, *extra):
+        """``queryset`` as named tuples of the layout's columns and ``extra``."""
+        columns = self.columns + [
+            column for column in extra if column not in self.columns
+        ]
+        return queryset.values_list(*columns, named=True)
+
+    def serialize(self, row):
+        return {
+            name: None if row[position] is None else convert(row[position])
+            for (name, _, convert), position in zip(self.fields, self.positions)
+        }
+
+    def serialize_many(self, rows):
+        return [self.serialize(row) for row in rows]
+
+
+def layout_for(serializer_class, request=None):
+    """The compiled layout of ``serializer_class``, narrowed to the request."""
+    layout = _layouts.get(serializer_class)
+    if layout is None:
+        layout = _layouts[serializer_class] = RowLayout.compile(serializer_class)
+    requested = getattr(serializer_class, "requested_fields", None)
+    return layout.select(requested(request) if requested else None)
@@ -1,8 +1,121 @@
+from django.conf import settings
+from django.utils import timezone
+from django.utils.html import escape
 from .models import Post
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import (
+    CharField,
+    FloatField,
+    IntegerField,
+    ListField,
+    ListSerializer,
+    ModelSerializer,
+    Serializer,
+    ValidationError,
+)
 
 
-class PostSerializer(ModelSerializer):
+class PostListSerializer(ListSerializer):
+    def create(self, validated_data):
+        return Post.objects.bulk_create(Post(**attrs) for attrs in validated_data)
+
+    def update(self, instance, validated_data):
+        # ``instance`` is the list of posts, in the same order as the payload
+        fields = {"updated_at"}
+        now = timezone.now()
+        for post, attrs in zip(instance, validated_data):
+            attrs = {attr: value for attr, value in attrs.items() if attr != "id"}
+            for attr, value in attrs.items():
+                setattr(post, attr, value)
+            post.updated_at = now
+            fields.update(attrs)
+        Post.objects.bulk_update(instance, sorted(fields))
+        return instance
+
+
+class SparseFieldsetMixin:
+    """
+    Narrow the representation to the comma separated ``fields`` query
+    parameter of the request in the serializer context, if any.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.requested_fields(self.context.get("request"))
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @staticmethod
+    def requested_fields(request):
+        if request is None or request.method != "GET":
+            return None
+        fields = request.query_params.get("fields")
+        if not fields:
+            return None
+        return {name.strip() for name in fields.split(",") if name.strip()}
+
+
+class PostSerializer(SparseFieldsetMixin, ModelSerializer):
+    class Meta:
+        model = Post
+        # the views change with every read, they are served by most_viewed
+        exclude = ("search_vector", "views")
+        list_serializer_class = PostListSerializer
+
+
+class PostBulkUpdateSerializer(PostSerializer):
+    id = IntegerField(min_value=1)
+
+
+class PostSummarySerializer(SparseFieldsetMixin, ModelSerializer):
+    class Meta:
+        model = Post
+        fields = ("id", "title", "excerpt", "word_count", "created_at", "updated_at")
+
+    @classmethod
+    def columns(cls, request):
+        # the summary never needs the content column; pagination needs the
+        # id and the creation time
+        fields = set(cls.Meta.fields)
+        requested = cls.requested_fields(request)
+        if requested:
+            fields &= requested
+        return {"id", "created_at", *fields}
+
+
+class PostViewsSerializer(PostSummarySerializer):
+    class Meta(PostSummarySerializer.Meta):
+        fields = (*PostSummarySerializer.Meta.fields, "views")
+
+
+# what Postgres puts around the matches in a headline, marked up once the
+# content around them is escaped
+HEADLINE_START = "\x02"
+HEADLINE_STOP = "\x03"
+
+
+class HeadlineField(CharField):
+    def to_representation(self, value):
+        value = escape(super().to_representation(value))
+        return value.replace(HEADLINE_START, "<mark>").replace(HEADLINE_STOP, "</mark>")
+
+
+class PostSearchSerializer(ModelSerializer):
+    rank = FloatField(read_only=True)
+    headline = HeadlineField(read_only=True)
+
     class Meta:
         model = Post
-        fields = "__all__"
+        fields = ("id", "title", "created_at", "updated_at", "rank", "headline")
+
+
+class PostBulkDeleteSerializer(Serializer):
+    ids = ListField(child=IntegerField(min_value=1), allow_empty=False)
+
+    def validate_ids(self, value):
+        if len(value) > settings.POSTS_BULK_MAX_SIZE:
+            raise ValidationError(
+                f"Ensure this field has no more than "
+                f"{settings.POSTS_BULK_MAX_SIZE} elements."
+            )
+        return value
@@ -1,11 +1,71 @@
-from django.core.cache import cache
+from BlogApp.authentication import invalidate_users
+from .caching import invalidate_posts
 from .models import Post
-from django.db.models.signals import post_delete, post_save
+from .rendering import schedule_render
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 
 
+@receiver(post_save, sender=Post)
+def update_post_search_vector(sender, instance, update_fields=None, **kwargs):
+    # connected before the invalidation so nothing is cached in between
+    if update_fields is not None and not {"title", "content"} & set(update_fields):
+        return
+    Post.objects.filter(pk=instance.pk).update_search_vector()
+
+
+@receiver(post_save, sender=Post)
+def render_post_content(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and "content" not in update_fields:
+        return
+    schedule_render([instance.pk])
+
+
 @receiver(post_save, sender=Post)
 @receiver(post_delete, sender=Post)
 def on_posts_changes(sender, instance, **kwargs):
-    cache.delete("posts_list")
-    cache.delete(f"{instance.id}_retrieve")
+    invalidate_posts([instance.id])
+
+
+def invalidate_cached_users(user_ids):
+    user_ids = list(user_ids)
+    invalidate_users(user_ids)
+    # a request in between reads the rows as they were before the commit
+    transaction.on_commit(lambda: invalidate_users(user_ids))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def on_user_changes(sender, instance, **kwargs):
+    invalidate_cached_users([instance.pk])
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def on_user_relations_changes(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith("post_"):
+            invalidate_cached_users([instance.pk])
+        return
+
+    # changed from the permission or group side, pk_set holds user ids
+    if action == "pre_clear":
+        invalidate_cached_users(instance.user_set.values_list("pk", flat=True))
+    elif action in ("post_add", "post_remove"):
+        invalidate_cached_users(pk_set)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def on_group_permissions_changes(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("pre_clear", "post_add", "post_remove"):
+        return
+    if reverse:
+        # changed from the permission side, pk_set holds group ids
+        groups = instance.group_set.all() if action == "pre_clear" else pk_set
+    else:
+        groups = [instance.pk]
+    invalidate_cached_users(
+        User.objects.filter(groups__in=groups).values_list("pk", flat=True)
+    )
@@ -1,7 +1,91 @@
+import os
+
+from django.conf import settings
+from django.db import transaction
+
 from BlogApp.celery import app
+from BlogApp.db.routers import use_primary
+from . import caching, counters, imports, rendering, warming
+from .caching import invalidate_posts
+from .models import Post
 
 
 @app.task(bind=True)
 def add(self, a: int, b: int):
     print(a + b)
     return a + b
+
+
+@app.task
+def flush_render_queue():
+    # posts queued from here on schedule another flush
+    rendering.queue.clear_scheduled()
+    rendered = 0
+    while True:
+        pks = rendering.queue.pop(settings.POSTS_RENDER_BATCH_SIZE)
+        if not pks:
+            return rendered
+        rendered += render_post_ids(pks)
+
+
+@app.task
+def render_post_ids(pks):
+    # the content was just written, a replica may not have it yet
+    with use_primary():
+        posts = rendering.render_posts(
+            Post.objects.filter(id__in=pks).only("id", "content", "word_count")
+        )
+    # updated_at stays the time of the last edit, the incremental exports go
+    # by it; the etags follow the rendered bodies
+    Post.objects.bulk_update(posts, ["content_html", "reading_time", "toc"])
+    invalidate_posts(pks)
+    return len(posts)
+
+
+@app.task
+def warm_posts_cache():
+    # invalidations from here on schedule another run
+    caching.warm_queue.clear_scheduled()
+    warmed = warming.warm_list(settings.POSTS_CACHE_WARM_PAGES)
+    while True:
+        pks = caching.warm_queue.pop(settings.POSTS_CACHE_WARM_BATCH_SIZE)
+        if not pks:
+            return warmed
+        warmed += warming.warm_details(pks)
+
+
+@app.task
+def warm_popular_posts():
+    pks = warming.popular_or_recent(settings.POSTS_CACHE_WARM_TOP_K)
+    warmed = warming.warm_list(settings.POSTS_CACHE_WARM_PAGES)
+    warmed += warming.warm_details(pks)
+    caching.decay_popular(
+        settings.POSTS_POPULAR_DECAY, settings.POSTS_POPULAR_MAX_TRACKED
+    )
+    return warmed
+
+
+@app.task
+def delete_posts(pks):
+    # signals are batched and the generations bumped once, after the commit
+    with caching.batched_invalidation(), transaction.atomic():
+        deleted, _ = Post.objects.filter(id__in=pks).only("id").delete()
+        invalidate_posts(pks)
+    return deleted
+
+
+@app.task
+def flush_view_counts():
+    return counters.flush()
+
+
+@app.task(bind=True)
+def import_posts(self, path, format):
+    def progress(report):
+        self.update_state(state="PROGRESS", meta=report)
+
+    try:
+        with use_primary():
+            return imports.import_file(path, format, progress)
+    finally:
+        os.remove(path)
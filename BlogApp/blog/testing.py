@@ -0,0 +1,127 @@
+"""
+Query and cache operation budgets for tests.
+
+``budget`` counts the SQL queries and the round trips to the cache's redis
+made by the current thread inside its block, whatever issues them:
+authentication, permissions, serialization, the cache itself or the metrics.
+Going over either limit fails the test with the log of what was run:
+
+    make_cold(user_ids=[user.id], post_ids=[post.id])
+    with budget("posts-detail", "cold", queries=2, cache_ops=8):
+        self.client.get(f"/api/posts/{post.id}/")
+
+A pipeline is one round trip and is logged with the commands it sent. The
+messages sent to the celery broker are not cache operations.
+"""
+import threading
+from contextlib import contextmanager
+from unittest import mock
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django_redis import get_redis_connection
+from redis import Redis
+from redis.client import Pipeline
+
+from BlogApp.authentication import invalidate_users
+
+from .caching import invalidate_posts
+from .local_cache import local_cache
+
+
+def describe(args, width=80):
+    words = []
+    for arg in args:
+        if isinstance(arg, bytes):
+            try:
+                arg = arg.decode()
+            except UnicodeDecodeError:
+                arg = repr(arg)
+        # cached values are long pickles, the start is enough to tell them apart
+        words.append(str(arg)[:width])
+    return " ".join(words)
+
+
+class CacheOperations:
+    """The redis commands and pipelines sent by one thread."""
+
+    def __init__(self):
+        self.log = []
+        self.thread = threading.get_ident()
+        self.pool = get_redis_connection("default").connection_pool
+
+    def __len__(self):
+        return len(self.log)
+
+    @contextmanager
+    def capture(self):
+        operations = self
+        execute_command = Redis.execute_command
+        execute = Pipeline.execute
+
+        def logged_command(client, *args, **options):
+            if operations.counts(client):
+                operations.log.append(describe(args))
+            return execute_command(client, *args, **options)
+
+        def logged_pipeline(pipeline, *args, **kwargs):
+            if operations.counts(pipeline) and pipeline.command_stack:
+                commands = "; ".join(
+                    describe(args) for args, _ in pipeline.command_stack
+                )
+                operations.log.append(f"PIPELINE [{commands}]")
+            return execute(pipeline, *args, **kwargs)
+
+        with mock.patch.object(
+            Redis, "execute_command", logged_command
+        ), mock.patch.object(Pipeline, "execute", logged_pipeline):
+            yield self
+
+    def counts(self, client):
+        return (
+            threading.get_ident() == self.thread and client.connection_pool is self.pool
+        )
+
+
+def make_cold(user_ids=(), post_ids=()):
+    """Drop the cached users, the posts list and the details of ``post_ids``."""
+    invalidate_users(user_ids)
+    invalidate_posts(post_ids)
+    local_cache.clear()
+
+
+class BudgetExceeded(AssertionError):
+    pass
+
+
+def report(title, count, limit, entries):
+    lines = [f"{title}: {count}, budget {limit}"]
+    lines += [f"  {index}. {entry}" for index, entry in enumerate(entries, 1)]
+    return "\n".join(lines)
+
+
+@contextmanager
+def budget(endpoint, state, queries, cache_ops):
+    """Fail when the block runs more than ``queries`` or ``cache_ops``."""
+    operations = CacheOperations()
+    with CaptureQueriesContext(connection) as captured, operations.capture():
+        yield captured, operations
+
+    failures = []
+    if len(captured) > queries:
+        failures.append(
+            report(
+                "SQL queries",
+                len(captured),
+                queries,
+                [query["sql"] for query in captured.captured_queries],
+            )
+        )
+    if len(operations) > cache_ops:
+        failures.append(
+            report("cache operations", len(operations), cache_ops, operations.log)
+        )
+    if failures:
+        raise BudgetExceeded(
+            f"{endpoint} ({state}) is over its budget\n" + "\n".join(failures)
+        )
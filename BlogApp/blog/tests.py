@@ -1,25 +1,110 @@
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from unittest import mock, skipUnless
+import psycopg2
+from redis.exceptions import RedisError
+from django.db import OperationalError, connection, connections, router, transaction
+from django.test.utils import CaptureQueriesContext
+from asgiref.sync import async_to_sync, sync_to_async
 from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.http import QueryDict
+from django.utils import timezone
+from django_redis import get_redis_connection
+from BlogApp import authentication, boot, metrics, throttling
+from benchmarks import posts_api
+from benchmarks.content import PostFactory
+from BlogApp.authentication import user_cache_key
+from BlogApp.db.postgresql_pool.base import DatabaseWrapper as PooledDatabaseWrapper
+from BlogApp.db.postgresql_pool.base import close_pools, pool_stats
+from BlogApp.db import routers
+from BlogApp.db.postgresql_pool.pool import ConnectionPool, PoolTimeout
+from BlogApp.celery import app as celery_app
+from . import (
+    async_caching,
+    caching,
+    compression,
+    counters,
+    exports,
+    imports,
+    rendering,
+    row_serializers,
+    warming,
+)
+from .local_cache import INVALIDATION_CHANNEL, local_cache
 from .models import Post
-from rest_framework.test import APITestCase, APIClient
-from django.test import TestCase
-from rest_framework import status
-from django.contrib.auth.models import User, Permission
-from .serializers import PostSerializer
-from .tasks import add
+from rest_framework.test import APITestCase, APITransactionTestCase, APIClient
+from django.test import RequestFactory, TestCase, override_settings
+from rest_framework import serializers, status
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.request import Request
+from django.contrib.auth.models import Group, User, Permission
+from .serializers import PostSerializer, PostSummarySerializer
+from .testing import BudgetExceeded, budget, make_cold
+from .tasks import (
+    add,
+    delete_posts,
+    flush_render_queue,
+    flush_view_counts,
+    import_posts,
+    render_post_ids,
+    warm_popular_posts,
+    warm_posts_cache,
+)
+from .views import PostViewSet
 
 
-class PostPermissionsTest(APITestCase):
+class AuthenticatedClientMixin:
+    """
+    Signs the test client in as ``self.user``, on an empty cache.
+
+    The client is authenticated directly, without a token. Tests that need the
+    JWT flow itself (the cached users, the per-request costs, permissions
+    changed mid-test or headers for another client) set ``jwt`` and get
+    ``self.token``.
+    """
+
     client = APIClient(enforce_csrf_checks=True)
     base_url = "/api/"
+    superuser = True
+    jwt = False
 
     def setUp(self):
-        # create a simple user with no permission
-        self.user = User.objects.create_user(
-            username="test", password="test", is_superuser=False
-        )
+        super().setUp()
+        cache.clear()
+        self.user = self.create_user()
+        if not self.jwt:
+            self.client.force_authenticate(self.user)
+            return
         data = {"username": "test", "password": "test"}
         login_res = self.client.post(self.base_url + "token/", data, format="json")
-        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + login_res.data["access"])
+        self.token = login_res.data["access"]
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + self.token)
+
+    def create_user(self):
+        return User.objects.create_user(
+            username="test", password="test", is_superuser=self.superuser
+        )
+
+
+class PostPermissionsTest(AuthenticatedClientMixin, APITestCase):
+    # a simple user with no permission, read again on each request
+    superuser = False
+    jwt = True
 
     @staticmethod
     def create_post():
@@ -139,22 +224,15 @@ class PostSerializersTest(TestCase):
 
         # serialize the instance
         serialized = PostSerializer(instance=post)
-        all_fields = [field.name for field in Post._meta.get_fields()]
+        all_fields = [
+            field.name
+            for field in Post._meta.get_fields()
+            if field.name not in PostSerializer.Meta.exclude
+        ]
         self.assertEquals(list(serialized.data.keys()), all_fields)
 
 
-class PostEndpointsTest(APITestCase):
-    client = APIClient(enforce_csrf_checks=True)
-    base_url = "/api/"
-
-    def setUp(self):
-        self.user = User.objects.create_user(
-            username="test", password="test", is_superuser=True
-        )
-        data = {"username": "test", "password": "test"}
-        login_res = self.client.post(self.base_url + "token/", data, format="json")
-        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + login_res.data["access"])
-
+class PostEndpointsTest(AuthenticatedClientMixin, APITestCase):
     @staticmethod
     def create_post():
         return Post.objects.create(title="title", content="content")
@@ -189,9 +267,9 @@ class PostEndpointsTest(APITestCase):
         # get the posts list
         res = self.client.get(self.base_url + "posts/")
         self.assertEquals(res.status_code, status.HTTP_200_OK)
-        self.assertEquals(len(res.data), 1)
-        self.assertEquals(res.data[0]["title"], new_post.title)
-        self.assertEquals(res.data[0]["content"], new_post.content)
+        self.assertEquals(len(res.json()["results"]), 1)
+        self.assertEquals(res.json()["results"][0]["title"], new_post.title)
+        self.assertEquals(res.json()["results"][0]["excerpt"], new_post.content)
 
     def test_post_get(self):
         # create one post
@@ -200,8 +278,8 @@ class PostEndpointsTest(APITestCase):
         # get a specific post
         res = self.client.get(self.base_url + f"posts/{new_post.id}/")
         self.assertEquals(res.status_code, status.HTTP_200_OK)
-        self.assertEquals(res.data["title"], new_post.title)
-        self.assertEquals(res.data["content"], new_post.content)
+        self.assertEquals(res.json()["title"], new_post.title)
+        self.assertEquals(res.json()["content"], new_post.content)
 
     def test_post_delete(self):
         # create a post
@@ -222,18 +300,94 @@ class PostEndpointsTest(APITestCase):
         self.assertIn(res.data["task_status"], ["PENDING", "STARTED", "SUCCESS"])
 
 
-class PostCachesTest(APITestCase):
-    client = APIClient(enforce_csrf_checks=True)
-    base_url = "/api/"
+class PostPaginationTest(AuthenticatedClientMixin, APITestCase):
+    @staticmethod
+    def create_posts(count):
+        return [
+            Post.objects.create(title=f"title {i}", content="content")
+            for i in range(count)
+        ]
 
-    def setUp(self):
-        self.user = User.objects.create_user(
-            username="test", password="test", is_superuser=True
+    def collect_pages(self, url):
+        pages = []
+        while url:
+            res = self.client.get(url)
+            self.assertEquals(res.status_code, status.HTTP_200_OK)
+            pages.append(res.json())
+            url = res.json()["next"]
+        return pages
+
+    def test_walks_every_post_once_newest_first(self):
+        posts = self.create_posts(7)
+
+        pages = self.collect_pages(self.base_url + "posts/?page_size=3")
+        self.assertEquals([len(page["results"]) for page in pages], [3, 3, 1])
+        ids = [post["id"] for page in pages for post in page["results"]]
+        self.assertEquals(ids, [post.id for post in reversed(posts)])
+
+    def test_ties_on_created_at_are_broken_by_id(self):
+        posts = self.create_posts(5)
+        Post.objects.update(created_at=posts[0].created_at)
+
+        pages = self.collect_pages(self.base_url + "posts/?page_size=2")
+        ids = [post["id"] for page in pages for post in page["results"]]
+        self.assertEquals(ids, sorted((post.id for post in posts), reverse=True))
+
+    def test_previous_link_returns_the_same_page(self):
+        self.create_posts(5)
+
+        first = self.client.get(self.base_url + "posts/?page_size=2").json()
+        self.assertIsNone(first["previous"])
+        second = self.client.get(first["next"]).json()
+        back = self.client.get(second["previous"]).json()
+        self.assertEquals(back["results"], first["results"])
+        self.assertIsNone(back["previous"])
+
+    def test_page_boundaries_are_stable_under_inserts(self):
+        self.create_posts(4)
+
+        first = self.client.get(self.base_url + "posts/?page_size=2").json()
+        self.create_posts(3)
+        second = self.client.get(first["next"]).json()
+        seen = {post["id"] for post in first["results"]}
+        self.assertFalse(seen & {post["id"] for post in second["results"]})
+        self.assertEquals(len(second["results"]), 2)
+
+    def test_invalid_cursor(self):
+        res = self.client.get(self.base_url + "posts/?cursor=not-a-cursor")
+        self.assertEquals(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    @staticmethod
+    def cursor(payload):
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    def test_cursor_values_of_the_wrong_type(self):
+        self.create_posts(3)
+        for payload in (
+            {"v": ["abc", "x"], "r": 0},
+            {"v": [{"a": 1}, 1], "r": 0},
+            {"v": ["2020-01-01T00:00:00", "x"], "r": 0},
+            {"v": ["2020-13-01T00:00:00", 1], "r": 0},
+            {"v": [None, 1], "r": 1},
+            ["2020-01-01T00:00:00", "x"],
+        ):
+            res = self.client.get(
+                self.base_url + "posts/", {"cursor": self.cursor(payload)}
+            )
+            self.assertEquals(res.status_code, status.HTTP_404_NOT_FOUND, payload)
+
+        first = self.client.get(self.base_url + "posts/?page_size=2").json()
+        last = first["results"][-1]
+        payload = {"v": [last["created_at"], str(last["id"])], "r": 0}
+        res = self.client.get(
+            self.base_url + "posts/", {"cursor": self.cursor(payload), "page_size": 2}
+        )
+        self.assertEquals(
+            res.json()["results"], self.client.get(first["next"]).json()["results"]
         )
-        data = {"username": "test", "password": "test"}
-        login_res = self.client.post(self.base_url + "token/", data, format="json")
-        self.client.credentials(HTTP_AUTHORIZATION="Bearer " + login_res.data["access"])
 
+
+class PostCachesTest(AuthenticatedClientMixin, APITestCase):
     @staticmethod
     def create_post():
         return Post.objects.create(title="title", content="content")
@@ -244,7 +398,44 @@ class PostCachesTest(APITestCase):
 
         # get the posts list
         self.client.get(self.base_url + "posts/")
-        self.assertNotEquals(cache.get("posts_list"), None)
+        self.assertNotEquals(cache.get(caching.list_key(QueryDict())), None)
+
+    def test_post_list_caching_per_query(self):
+        self.create_post()
+
+        # every list variant gets its own entry
+        self.client.get(self.base_url + "posts/?page_size=5")
+        self.assertEquals(cache.get(caching.list_key(QueryDict())), None)
+        self.assertNotEquals(
+            cache.get(caching.list_key(QueryDict("page_size=5"))), None
+        )
+
+        # the parameters order does not matter
+        self.assertEquals(
+            caching.list_key(QueryDict("a=1&b=2")),
+            caching.list_key(QueryDict("b=2&a=1")),
+        )
+
+    def test_detail_entries_are_keyed_by_the_post_id(self):
+        post = self.create_post()
+        for pk in (post.id, f"0{post.id}"):
+            self.assertEquals(
+                self.client.get(self.base_url + f"posts/{pk}/").json()["title"],
+                "title",
+            )
+        payload = {"title": "new title", "content": "content"}
+        self.client.put(self.base_url + f"posts/{post.id}/", payload)
+        for pk in (post.id, f"0{post.id}"):
+            self.assertEquals(
+                self.client.get(self.base_url + f"posts/{pk}/").json()["title"],
+                "new title",
+            )
+
+        # no generation for what cannot be a post id
+        res = self.client.get(self.base_url + "posts/abc/")
+        self.assertEquals(res.status_code, status.HTTP_404_NOT_FOUND)
+        namespace = caching.detail_namespace("abc")
+        self.assertIsNone(cache.get(caching.generation_key(namespace)))
 
     def test_delete_post_list_caching_on_save(self):
         # create the post
@@ -252,12 +443,12 @@ class PostCachesTest(APITestCase):
 
         # get the posts list
         self.client.get(self.base_url + "posts/")
-        self.assertNotEquals(cache.get("posts_list"), None)
+        self.assertNotEquals(cache.get(caching.list_key(QueryDict())), None)
 
         # create a new posts to delete old cache
         payload = {"title": "title2", "content": "content2"}
         self.client.post(self.base_url + "posts/", payload)
-        self.assertEquals(cache.get("posts_list"), None)
+        self.assertEquals(cache.get(caching.list_key(QueryDict())), None)
 
     def test_delete_post_list_caching_on_delete(self):
         # create the post
@@ -265,11 +456,11 @@ class PostCachesTest(APITestCase):
 
         # check the posts cache
         self.client.get(self.base_url + "posts/")
-        self.assertNotEquals(cache.get("posts_list"), None)
+        self.assertNotEquals(cache.get(caching.list_key(QueryDict())), None)
 
         # delete the created post to check the data freshness
         self.client.delete(self.base_url + f"posts/{new_post.id}/")
-        self.assertEquals(cache.get("posts_list"), None)
+        self.assertEquals(cache.get(caching.list_key(QueryDict())), None)
 
     def test_post_retrieve_caching(self):
         # create the post
@@ -277,7 +468,9 @@ class PostCachesTest(APITestCase):
 
         # get the posts list
         self.client.get(self.base_url + f"posts/{new_post.id}/")
-        self.assertNotEquals(cache.get(f"{new_post.id}_retrieve"), None)
+        self.assertNotEquals(
+            cache.get(caching.detail_key(new_post.id, QueryDict())), None
+        )
 
     def test_delete_post_retrieve_caching_on_delete(self):
         # create the post
@@ -285,11 +478,13 @@ class PostCachesTest(APITestCase):
 
         # get the posts list
         self.client.get(self.base_url + f"posts/{new_post.id}/")
-        self.assertNotEquals(cache.get(f"{new_post.id}_retrieve"), None)
+        self.assertNotEquals(
+            cache.get(caching.detail_key(new_post.id, QueryDict())), None
+        )
 
         # delete the record to test if the cache has been deleted
         self.client.delete(self.base_url + f"posts/{new_post.id}/")
-        self.assertEquals(cache.get(f"{new_post.id}_retrieve"), None)
+        self.assertEquals(cache.get(caching.detail_key(new_post.id, QueryDict())), None)
 
     def test_delete_post_retrieve_caching_on_update(self):
         # create the post
@@ -297,9 +492,2151 @@ class PostCachesTest(APITestCase):
 
         # get the posts list
         self.client.get(self.base_url + f"posts/{new_post.id}/")
-        self.assertNotEquals(cache.get(f"{new_post.id}_retrieve"), None)
+        self.assertNotEquals(
+            cache.get(caching.detail_key(new_post.id, QueryDict())), None
+        )
 
         #  update to test if the cache has been deleted
         payload = {"title": "title", "content": "new content"}
         self.client.put(self.base_url + f"posts/{new_post.id}/", payload)
-        self.assertEquals(cache.get(f"{new_post.id}_retrieve"), None)
+        self.assertEquals(cache.get(caching.detail_key(new_post.id, QueryDict())), None)
+
+    def test_update_keeps_other_posts_cached(self):
+        first, second = self.create_post(), self.create_post()
+
+        self.client.get(self.base_url + f"posts/{second.id}/")
+        payload = {"title": "title", "content": "new content"}
+        self.client.put(self.base_url + f"posts/{first.id}/", payload)
+        self.assertNotEquals(
+            cache.get(caching.detail_key(second.id, QueryDict())), None
+        )
+
+    def test_lost_generation_does_not_revive_old_keys(self):
+        self.create_post()
+
+        self.client.get(self.base_url + "posts/")
+        old_key = caching.list_key(QueryDict())
+        cache.delete(caching.generation_key(caching.LIST_NAMESPACE))
+        self.assertNotEquals(caching.list_key(QueryDict()), old_key)
+
+
+class PostConditionalRequestsTest(AuthenticatedClientMixin, APITestCase):
+    @staticmethod
+    def create_post():
+        return Post.objects.create(title="title", content="content")
+
+    def test_hit_serves_cached_bytes(self):
+        new_post = self.create_post()
+        url = self.base_url + f"posts/{new_post.id}/"
+
+        first = self.client.get(url)
+        with mock.patch.object(PostSerializer, "to_representation") as serialize:
+            with CaptureQueriesContext(connection) as queries:
+                second = self.client.get(url)
+        serialize.assert_not_called()
+        self.assertFalse([q for q in queries if "blog_post" in q["sql"]])
+        self.assertEquals(second.content, first.content)
+        self.assertEquals(second["ETag"], first["ETag"])
+
+    def test_if_none_match_returns_not_modified(self):
+        new_post = self.create_post()
+        for url in [self.base_url + "posts/", self.base_url + f"posts/{new_post.id}/"]:
+            etag = self.client.get(url)["ETag"]
+            with mock.patch.object(PostSerializer, "to_representation") as serialize:
+                res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            serialize.assert_not_called()
+            self.assertEquals(res.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEquals(res["ETag"], etag)
+            self.assertEquals(res.content, b"")
+
+    def test_etag_changes_with_the_post(self):
+        new_post = self.create_post()
+        url = self.base_url + f"posts/{new_post.id}/"
+
+        etag = self.client.get(url)["ETag"]
+        payload = {"title": "title", "content": "new content"}
+        self.client.put(url, payload)
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        self.assertNotEquals(res["ETag"], etag)
+        self.assertEquals(res.json()["content"], "new content")
+
+    def test_media_type_parameters_do_not_change_the_body(self):
+        new_post = self.create_post()
+        url = self.base_url + f"posts/{new_post.id}/"
+        indented = self.client.get(url, HTTP_ACCEPT="application/json; indent=4")
+        self.assertEquals(indented.status_code, status.HTTP_200_OK)
+        self.assertNotIn(b"\n", indented.content)
+
+        plain = self.client.get(url)
+        self.assertEquals(plain.content, indented.content)
+        self.assertEquals(plain["ETag"], indented["ETag"])
+
+    def test_etag_changes_with_the_pagination_links(self):
+        posts = [self.create_post() for _ in range(3)]
+        url = self.base_url + "posts/?page_size=2"
+        first = self.client.get(url)
+        self.assertIsNotNone(first.json()["next"])
+
+        # the same two posts, but no page after them
+        Post.objects.filter(pk=posts[0].pk).delete()
+        caching.invalidate_posts([posts[0].pk])
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        self.assertIsNone(res.json()["next"])
+        self.assertNotEquals(res["ETag"], first["ETag"])
+
+    def test_browsable_api_is_not_cached(self):
+        new_post = self.create_post()
+
+        res = self.client.get(
+            self.base_url + f"posts/{new_post.id}/", HTTP_ACCEPT="text/html"
+        )
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn("ETag", res)
+
+
+class PostCacheStampedeTest(TestCase):
+    def setUp(self):
+        # a fresh parameter set per test keeps the keys isolated
+        self.params = QueryDict(f"test={uuid.uuid4().hex}")
+        self.calls = 0
+
+    def compute(self, value="fresh", delay=0):
+        def compute():
+            self.calls += 1
+            time.sleep(delay)
+            return value
+
+        return compute
+
+    def hold_lock(self):
+        key = caching.list_key(self.params)
+        lock = cache.lock(f"{key}:lock", timeout=5)
+        self.assertTrue(lock.acquire(blocking=False))
+        self.addCleanup(lock.release)
+
+    def test_concurrent_misses_compute_once(self):
+        results = []
+
+        def worker():
+            results.append(caching.list_value(self.params, self.compute(delay=0.3)))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(self.calls, 1)
+        self.assertEquals(results, ["fresh"] * 8)
+
+    def test_serves_stale_while_another_worker_rebuilds(self):
+        caching.list_value(self.params, self.compute("old"))
+        caching.invalidate_posts()
+
+        self.hold_lock()
+        value = caching.list_value(self.params, self.compute("new"))
+        self.assertEquals(value, "old")
+        self.assertEquals(self.calls, 1)
+
+    @override_settings(POSTS_CACHE_GRACE=0)
+    def test_stale_value_is_bounded_by_grace(self):
+        caching.list_value(self.params, self.compute("old"))
+        entry = cache.get(caching.stale_key(caching.LIST_NAMESPACE, self.params))
+        entry["expires"] = time.time() - 1
+        cache.set(caching.stale_key(caching.LIST_NAMESPACE, self.params), entry)
+        caching.invalidate_posts()
+
+        self.hold_lock()
+        with override_settings(POSTS_CACHE_LOCK_WAIT=0.1):
+            value = caching.list_value(self.params, self.compute("new"))
+        self.assertEquals(value, "new")
+
+    def test_refreshes_early_close_to_expiry(self):
+        caching.list_value(self.params, self.compute("old"))
+        key = caching.list_key(self.params)
+
+        # far from expiry: plain hit
+        self.assertEquals(caching.list_value(self.params, self.compute("new")), "old")
+
+        # an entry whose recompute time dwarfs its remaining lifetime
+        entry = cache.get(key)
+        entry.update(delta=3600, expires=time.time() + 1)
+        cache.set(key, entry)
+        self.assertEquals(caching.list_value(self.params, self.compute("new")), "new")
+        self.assertEquals(self.calls, 2)
+
+
+@override_settings(POSTS_LOCAL_CACHE=True)
+class PostLocalCacheTest(AuthenticatedClientMixin, APITestCase):
+    jwt = True
+
+    def setUp(self):
+        super().setUp()
+        local_cache.clear()
+
+    @staticmethod
+    def create_post():
+        return Post.objects.create(title="title", content="content")
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 2
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_hits_are_served_without_redis(self):
+        new_post = self.create_post()
+        url = self.base_url + f"posts/{new_post.id}/"
+
+        first = self.client.get(url)
+        hits = local_cache.hits
+        with mock.patch.object(cache, "get", wraps=cache.get) as redis_get:
+            second = self.client.get(url)
+        # only the authenticated user is read from redis
+        self.assertEquals(
+            [call.args[0] for call in redis_get.call_args_list],
+            [user_cache_key(self.user.pk)],
+        )
+        self.assertEquals(second.content, first.content)
+        self.assertGreater(local_cache.hits, hits)
+
+    def test_invalidation_reaches_other_processes(self):
+        key = caching.generation_key(caching.LIST_NAMESPACE)
+        caching.get_generation(caching.LIST_NAMESPACE)
+        self.assertIsNotNone(local_cache.get(key))
+
+        # what another worker publishes when it bumps the generation
+        cache.incr(key)
+        get_redis_connection("default").publish(INVALIDATION_CHANNEL, json.dumps([key]))
+        self.wait_for(lambda: local_cache.get(key) is None)
+        self.assertEquals(
+            caching.get_generation(caching.LIST_NAMESPACE), cache.get(key)
+        )
+
+    def test_listener_subscribes_before_the_tier_is_used(self):
+        # as in a freshly forked worker
+        local_cache._pid = None
+        with mock.patch.object(
+            local_cache, "_subscribe", wraps=local_cache._subscribe
+        ) as subscribe:
+            local_cache.ensure_listener()
+            subscribe.assert_called_once_with()
+
+        # nothing clears what is cached once the listener runs
+        local_cache.set("key", "value")
+        time.sleep(0.1)
+        self.assertEquals(local_cache.get("key"), "value")
+
+    async def test_async_reads_subscribe_off_the_event_loop(self):
+        local_cache._pid = None
+        threads = []
+        subscribe = local_cache._subscribe
+
+        def record():
+            threads.append(threading.get_ident())
+            return subscribe()
+
+        with mock.patch.object(local_cache, "_subscribe", side_effect=record):
+            await async_caching.aget_generation(caching.LIST_NAMESPACE)
+            await async_caching.aget_generation(caching.LIST_NAMESPACE)
+        self.assertEquals(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+        self.assertTrue(local_cache.listening)
+
+    def test_writes_are_visible_immediately(self):
+        new_post = self.create_post()
+        url = self.base_url + f"posts/{new_post.id}/"
+
+        self.client.get(url)
+        payload = {"title": "title", "content": "new content"}
+        self.client.put(url, payload)
+        self.assertEquals(self.client.get(url).json()["content"], "new content")
+
+    @override_settings(POSTS_LOCAL_CACHE_MAX_ENTRIES=3)
+    def test_size_is_bounded(self):
+        for index in range(10):
+            local_cache.set(f"key-{index}", index)
+        self.assertEquals(len(local_cache), 3)
+        self.assertIsNone(local_cache.get("key-0"))
+        self.assertEquals(local_cache.get("key-9"), 9)
+
+    @override_settings(POSTS_LOCAL_CACHE_TTL=0.05)
+    def test_entries_expire(self):
+        local_cache.set("key", "value")
+        time.sleep(0.1)
+        self.assertIsNone(local_cache.get("key"))
+
+    def test_stats_endpoint(self):
+        new_post = self.create_post()
+        self.client.get(self.base_url + f"posts/{new_post.id}/")
+
+        # only staff can read them
+        res = self.client.get(self.base_url + "posts/cache_stats/")
+        self.assertEquals(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        res = self.client.get(self.base_url + "posts/cache_stats/")
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        self.assertEquals(set(res.data), {"local", "redis"})
+        self.assertIn("hits", res.data["local"])
+        self.assertIn("misses", res.data["redis"])
+
+
+class PostBulkEndpointsTest(AuthenticatedClientMixin, APITestCase):
+    @staticmethod
+    def create_posts(count):
+        return [
+            Post.objects.create(title=f"title {i}", content="content")
+            for i in range(count)
+        ]
+
+    def bulk(self, method, payload):
+        with mock.patch.object(
+            caching, "bump_generations", wraps=caching.bump_generations
+        ) as bump:
+            with CaptureQueriesContext(connection) as queries:
+                res = getattr(self.client, method)(
+                    self.base_url + "posts/bulk/", payload, format="json"
+                )
+        return res, bump, queries
+
+    def test_bulk_create(self):
+        self.client.get(self.base_url + "posts/")
+        payload = [{"title": f"title {i}", "content": "content"} for i in range(50)]
+
+        res, bump, queries = self.bulk("post", payload)
+        self.assertEquals(res.status_code, status.HTTP_201_CREATED)
+        self.assertEquals(len(res.data), 50)
+        self.assertEquals(Post.objects.count(), 50)
+        self.assertEquals(bump.call_count, 1)
+        inserts = [q for q in queries if q["sql"].startswith("INSERT")]
+        self.assertEquals(len(inserts), 1)
+
+        # the cached list has been invalidated
+        res = self.client.get(self.base_url + "posts/?page_size=100")
+        self.assertEquals(len(res.json()["results"]), 50)
+
+    def test_bulk_create_is_atomic(self):
+        payload = [
+            {"title": "title", "content": "content"},
+            {"title": "", "content": "content"},
+        ]
+        res, _, _ = self.bulk("post", payload)
+        self.assertEquals(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(POSTS_BULK_MAX_SIZE=2)
+    def test_bulk_size_is_limited(self):
+        payload = [{"title": "title", "content": "content"}] * 3
+        res, _, _ = self.bulk("post", payload)
+        self.assertEquals(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res, _, _ = self.bulk("delete", {"ids": [1, 2, 3]})
+        self.assertEquals(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_update(self):
+        posts = self.create_posts(3)
+        self.client.get(self.base_url + f"posts/{posts[0].id}/")
+        payload = [
+            {"id": post.id, "title": f"new {post.id}", "content": "new content"}
+            for post in posts
+        ]
+
+        res, bump, queries = self.bulk("put", payload)
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        self.assertEquals(bump.call_count, 1)
+        # one statement for the rows, one to refresh their search vectors
+        updates = [q for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertEquals(len(updates), 2)
+        for post in posts:
+            updated = Post.objects.get(pk=post.id)
+            self.assertEquals(updated.title, f"new {post.id}")
+            self.assertGreater(updated.updated_at, post.updated_at)
+
+        res = self.client.get(self.base_url + f"posts/{posts[0].id}/")
+        self.assertEquals(res.json()["content"], "new content")
+
+    def test_bulk_update_unknown_post(self):
+        post = self.create_posts(1)[0]
+        payload = [
+            {"id": post.id, "title": "new", "content": "new content"},
+            {"id": post.id + 1000, "title": "new", "content": "new content"},
+        ]
+
+        res, _, _ = self.bulk("put", payload)
+        self.assertEquals(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEquals(Post.objects.get(pk=post.id).title, post.title)
+
+    def test_bulk_delete(self):
+        posts = self.create_posts(4)
+        ids = [post.id for post in posts[:3]]
+
+        res, bump, _ = self.bulk("delete", {"ids": ids})
+        self.assertEquals(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEquals(bump.call_count, 1)
+        self.assertEquals(
+            list(Post.objects.values_list("id", flat=True)), [posts[3].id]
+        )
+
+    def test_bulk_requires_permissions(self):
+        # the client is signed in with this very instance
+        self.user.is_superuser = False
+        self.user.save()
+        payload = [{"title": "title", "content": "content"}]
+
+        res, _, _ = self.bulk("post", payload)
+        self.assertEquals(res.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class PostSearchTest(AuthenticatedClientMixin, APITestCase):
+    def search(self, terms, **params):
+        return self.client.get(self.base_url + "posts/search/", {"q": terms, **params})
+
+    def test_title_matches_rank_first(self):
+        in_content = Post.objects.create(
+            title="Weekly notes", content="Some thoughts about django migrations."
+        )
+        in_title = Post.objects.create(title="Django tips", content="Short post.")
+        Post.objects.create(title="Gardening", content="Tomatoes and basil.")
+
+        res = self.search("django")
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        results = res.json()["results"]
+        self.assertEquals(
+            [post["id"] for post in results], [in_title.id, in_content.id]
+        )
+        self.assertGreater(results[0]["rank"], results[1]["rank"])
+        self.assertIn("<mark>django</mark>", results[1]["headline"])
+        self.assertNotIn("content", results[0])
+
+    def test_headline_is_escaped(self):
+        # the parser drops well formed tags itself, not this one
+        Post.objects.create(
+            title="title",
+            content="django is great and <svg/onload=alert(1)> more words",
+        )
+        headline = self.search("django").json()["results"][0]["headline"]
+        self.assertIn("<mark>django</mark>", headline)
+        self.assertIn("&lt;svg", headline)
+        self.assertNotIn("<svg", headline)
+
+    def test_websearch_syntax(self):
+        Post.objects.create(title="Django and celery", content="content")
+        only_django = Post.objects.create(title="Django alone", content="content")
+
+        results = self.search("django -celery").json()["results"]
+        self.assertEquals([post["id"] for post in results], [only_django.id])
+
+    def test_results_are_paginated(self):
+        posts = [
+            Post.objects.create(title=f"Django {'tips ' * i}", content="django")
+            for i in range(5)
+        ]
+
+        url, seen = self.base_url + "posts/search/?q=django&page_size=2", []
+        while url:
+            page = self.client.get(url).json()
+            seen += [post["id"] for post in page["results"]]
+            url = page["next"]
+        self.assertEquals(sorted(seen), sorted(post.id for post in posts))
+
+    def test_vector_follows_updates(self):
+        post = Post.objects.create(title="Gardening", content="content")
+        self.assertEquals(self.search("django").json()["results"], [])
+
+        payload = {"title": "Django gardening", "content": "content"}
+        self.client.put(self.base_url + f"posts/{post.id}/", payload)
+        self.assertEquals(len(self.search("django").json()["results"]), 1)
+
+    def test_bulk_created_posts_are_searchable(self):
+        payload = [{"title": f"Django {i}", "content": "content"} for i in range(3)]
+        self.client.post(self.base_url + "posts/bulk/", payload, format="json")
+        self.assertEquals(len(self.search("django").json()["results"]), 3)
+
+    def test_query_is_required(self):
+        res = self.client.get(self.base_url + "posts/search/")
+        self.assertEquals(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_values_of_the_wrong_type(self):
+        Post.objects.create(title="Django", content="content")
+        for values in (["high", 1], [0.5, [1]], [{"rank": 1}, 1]):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps({"v": values, "r": 0}).encode()
+            ).decode()
+            res = self.search("django", cursor=cursor)
+            self.assertEquals(res.status_code, status.HTTP_404_NOT_FOUND, values)
+
+    def test_backfill_command(self):
+        for i in range(5):
+            Post.objects.create(title=f"Django {i}", content="content")
+        Post.objects.update(search_vector=None)
+
+        call_command("backfill_search_vectors", chunk_size=2, stdout=io.StringIO())
+        self.assertFalse(Post.objects.filter(search_vector__isnull=True).exists())
+        self.assertEquals(len(self.search("django").json()["results"]), 5)
+
+
+class PostSummaryTest(AuthenticatedClientMixin, APITestCase):
+    @override_settings(POSTS_EXCERPT_LENGTH=20)
+    def test_summary_is_computed_on_write(self):
+        post = Post.objects.create(title="title", content="one  two\nthree " * 10)
+        self.assertEquals(post.word_count, 30)
+        self.assertEquals(post.excerpt, "one two three one t…")
+
+        post.content = "short"
+        post.save(update_fields=["content"])
+        post.refresh_from_db()
+        self.assertEquals((post.excerpt, post.word_count), ("short", 1))
+
+    @override_settings(POSTS_EXCERPT_LENGTH=400)
+    def test_excerpt_fits_its_column(self):
+        post = Post.objects.create(title="title", content="word " * 200)
+        self.assertEquals(len(post.excerpt), 300)
+        Post.objects.bulk_create([Post(title="title", content="word " * 200)])
+        post.content = "other " * 200
+        Post.objects.bulk_update([post], ["content"])
+        post.refresh_from_db()
+        self.assertEquals(len(post.excerpt), 300)
+
+    def test_bulk_writes_compute_the_summary(self):
+        payload = [{"title": "title", "content": "one two three"}]
+        res = self.client.post(self.base_url + "posts/bulk/", payload, format="json")
+        post = Post.objects.get(pk=res.data[0]["id"])
+        self.assertEquals(post.word_count, 3)
+
+        payload = [{"id": post.id, "title": "title", "content": "four"}]
+        self.client.put(self.base_url + "posts/bulk/", payload, format="json")
+        post.refresh_from_db()
+        self.assertEquals((post.excerpt, post.word_count), ("four", 1))
+
+    def test_list_returns_the_summary_without_loading_content(self):
+        Post.objects.create(title="title", content="some content")
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(self.base_url + "posts/")
+        self.assertEquals(
+            set(res.json()["results"][0]),
+            {"id", "title", "excerpt", "word_count", "created_at", "updated_at"},
+        )
+        selects = [q["sql"] for q in queries if "blog_post" in q["sql"]]
+        self.assertTrue(selects)
+        self.assertFalse([sql for sql in selects if '"content"' in sql])
+
+    def test_sparse_fieldsets(self):
+        post = Post.objects.create(title="title", content="some content")
+
+        res = self.client.get(self.base_url + "posts/?fields=id,title")
+        self.assertEquals(res.json()["results"], [{"id": post.id, "title": "title"}])
+
+        res = self.client.get(self.base_url + f"posts/{post.id}/?fields=content")
+        self.assertEquals(res.json(), {"content": "some content"})
+
+
+class PostAsyncEndpointsTest(AuthenticatedClientMixin, APITestCase):
+    jwt = True
+
+    async def get(self, url, token=None, **headers):
+        if token is None:
+            token = self.token
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        return await self.async_client.get(self.base_url + url, headers=headers)
+
+    async def test_detail_matches_the_sync_endpoint(self):
+        post = await Post.objects.acreate(title="title", content="content")
+
+        res = await self.get(f"async/posts/{post.id}/")
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        await sync_to_async(caching.invalidate_posts)([post.id])
+        sync_res = await sync_to_async(self.client.get)(
+            self.base_url + f"posts/{post.id}/"
+        )
+        self.assertEquals(res.content, sync_res.content)
+        self.assertEquals(res["ETag"], sync_res["ETag"])
+
+    async def test_detail_entries_are_keyed_by_the_post_id(self):
+        post = await Post.objects.acreate(title="title", content="content")
+        await self.get(f"async/posts/0{post.id}/")
+        post.title = "new title"
+        await sync_to_async(post.save)()
+        await sync_to_async(caching.invalidate_posts)([post.id])
+        res = await self.get(f"async/posts/0{post.id}/")
+        self.assertEquals(res.json()["title"], "new title")
+
+        res = await self.get("async/posts/abc/")
+        self.assertEquals(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_list_pages(self):
+        for i in range(5):
+            await Post.objects.acreate(title=f"title {i}", content="content")
+
+        url, ids = "async/posts/?page_size=2", []
+        while url:
+            page = (await self.get(url)).json()
+            ids += [post["id"] for post in page["results"]]
+            url = page["next"] and page["next"][len(self.base_url) :]
+        self.assertEquals(len(set(ids)), 5)
+        self.assertNotIn("content", page["results"][0])
+
+    async def test_conditional_get(self):
+        post = await Post.objects.acreate(title="title", content="content")
+
+        etag = (await self.get(f"async/posts/{post.id}/"))["ETag"]
+        res = await self.get(f"async/posts/{post.id}/", **{"If-None-Match": etag})
+        self.assertEquals(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_authentication_and_permissions(self):
+        res = await self.get("async/posts/", token="")
+        self.assertEquals(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn("WWW-Authenticate", res)
+
+        res = await self.get("async/posts/", token="not-a-token")
+        self.assertEquals(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        await User.objects.filter(pk=self.user.pk).aupdate(is_superuser=False)
+        res = await self.get("async/posts/")
+        self.assertEquals(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        permission = await Permission.objects.aget(codename="view_post")
+        await sync_to_async(self.user.user_permissions.add)(permission)
+        res = await self.get("async/posts/")
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+
+    async def test_errors(self):
+        res = await self.get("async/posts/12345678/")
+        self.assertEquals(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEquals(res.json(), {"detail": "Not found."})
+
+        res = await self.get("async/posts/not-an-id/")
+        self.assertEquals(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        res = await self.async_client.post(
+            self.base_url + "async/posts/",
+            headers={"Authorization": f"Bearer {self.token}"},
+        )
+        self.assertEquals(res.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class BootTest(TestCase):
+    def setUp(self):
+        self.sources = tempfile.mkdtemp()
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.sources)
+        self.addCleanup(shutil.rmtree, self.static_root)
+        with open(os.path.join(self.sources, "site.css"), "w") as file:
+            file.write("body {}")
+
+    def test_migrate_is_skipped_without_pending_migrations(self):
+        with mock.patch("BlogApp.boot.call_command") as command:
+            self.assertFalse(boot.migrate())
+        command.assert_not_called()
+
+    def test_collectstatic_only_runs_when_sources_change(self):
+        with override_settings(
+            STATIC_ROOT=self.static_root, STATICFILES_DIRS=[self.sources]
+        ):
+            self.assertTrue(boot.collect_static())
+            self.assertTrue(os.path.exists(os.path.join(self.static_root, "site.css")))
+            self.assertFalse(boot.collect_static())
+
+            with open(os.path.join(self.sources, "site.css"), "w") as file:
+                file.write("body { margin: 0 }")
+            self.assertTrue(boot.collect_static())
+
+    def test_web_process_does_not_import_celery(self):
+        code = (
+            "import sys, django; django.setup(); import BlogApp.urls, BlogApp.wsgi; "
+            "print('celery' in sys.modules)"
+        )
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": "BlogApp.settings"}
+        output = subprocess.check_output([sys.executable, "-c", code], env=env)
+        self.assertEqual(output.strip(), b"False")
+
+
+class DatabasePoolTest(TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_size=2, timeout=0.1, check_after=0)
+        self.addCleanup(self.pool.close)
+
+    @staticmethod
+    def connect():
+        return psycopg2.connect(**connection.get_connection_params())
+
+    def test_connections_are_reused(self):
+        first = self.pool.getconn(self.connect)
+        self.pool.putconn(first)
+        second = self.pool.getconn(self.connect)
+        self.pool.putconn(second)
+
+        self.assertIs(first, second)
+        stats = self.pool.stats()
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["connections_opened"], 1)
+        self.assertEqual(stats["idle"], 1)
+
+    def test_checkout_times_out_when_the_pool_is_full(self):
+        held = [self.pool.getconn(self.connect) for _ in range(2)]
+        with self.assertRaises(PoolTimeout):
+            self.pool.getconn(self.connect)
+        self.assertEqual(self.pool.stats()["timeouts"], 1)
+        for pooled in held:
+            self.pool.putconn(pooled)
+
+    def test_broken_connections_are_replaced_on_checkout(self):
+        broken = self.pool.getconn(self.connect)
+        backend_pid = broken.get_backend_pid()
+        self.pool.putconn(broken)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", [backend_pid])
+
+        replacement = self.pool.getconn(self.connect)
+        with replacement.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        self.assertIsNot(replacement, broken)
+        self.assertEqual(self.pool.stats()["failed_checks"], 1)
+        self.pool.putconn(replacement)
+
+    def test_child_does_not_touch_inherited_connections(self):
+        inherited = self.pool.getconn(self.connect)
+        self.pool._after_fork()
+
+        self.assertEqual(self.pool.stats()["size"], 0)
+        self.pool.putconn(inherited)
+        self.assertFalse(inherited.closed)
+        self.assertEqual(self.pool.stats()["idle"], 0)
+        inherited.close()
+
+    def test_backend_returns_connections_to_the_pool(self):
+        settings_dict = {
+            **connection.settings_dict,
+            "ENGINE": "BlogApp.db.postgresql_pool",
+            "POOL": {"MAX_SIZE": 1},
+        }
+        key = f"default:{settings_dict['NAME']}"
+        # the default connection shares the pool when PG_POOL is on
+        before = pool_stats().get(key, {"connections_opened": 0, "checkouts": 0})
+        pooled = PooledDatabaseWrapper(settings_dict)
+        self.addCleanup(close_pools, settings_dict["NAME"])
+        self.addCleanup(pooled.close)
+
+        pooled.ensure_connection()
+        first = pooled.connection
+        pooled.close()
+        with pooled.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        self.assertIs(pooled.connection, first)
+        pooled.close()
+
+        stats = pool_stats()[key]
+        self.assertEqual(stats["connections_opened"] - before["connections_opened"], 1)
+        self.assertEqual(stats["checkouts"] - before["checkouts"], 2)
+
+
+class UserCacheTest(AuthenticatedClientMixin, APITestCase):
+    superuser = False
+    jwt = True
+
+    def create_user(self):
+        user = super().create_user()
+        user.user_permissions.add(Permission.objects.get(codename="view_post"))
+        return user
+
+    def setUp(self):
+        super().setUp()
+        Post.objects.create(title="title", content="content")
+
+    def test_cached_list_runs_no_queries(self):
+        self.client.get(self.base_url + "posts/")
+        with self.assertNumQueries(0):
+            res = self.client.get(self.base_url + "posts/")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_removed_permission_applies_right_away(self):
+        self.assertEqual(
+            self.client.get(self.base_url + "posts/").status_code, status.HTTP_200_OK
+        )
+        self.user.user_permissions.clear()
+        self.assertEqual(
+            self.client.get(self.base_url + "posts/").status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+
+    def test_group_permissions_are_invalidated(self):
+        self.user.user_permissions.clear()
+        group = Group.objects.create(name="readers")
+        self.user.groups.add(group)
+        self.assertEqual(
+            self.client.get(self.base_url + "posts/").status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+
+        group.permissions.add(Permission.objects.get(codename="view_post"))
+        self.assertEqual(
+            self.client.get(self.base_url + "posts/").status_code, status.HTTP_200_OK
+        )
+
+        Permission.objects.get(codename="view_post").group_set.clear()
+        self.assertEqual(
+            self.client.get(self.base_url + "posts/").status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+
+    def test_users_are_invalidated_again_after_the_commit(self):
+        stale = authentication.snapshot(User.objects.get(pk=self.user.pk))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.is_active = False
+            self.user.save()
+            # what a request reading the row before the commit caches
+            cache.set(user_cache_key(self.user.pk), stale)
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        self.assertEqual(
+            self.client.get(self.base_url + "posts/").status_code,
+            status.HTTP_401_UNAUTHORIZED,
+        )
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get(self.base_url + "posts/")
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(
+            self.client.get(self.base_url + "posts/").status_code,
+            status.HTTP_401_UNAUTHORIZED,
+        )
+
+
+class PostRenderingTest(TestCase):
+    def setUp(self):
+        rendering.queue.clear()
+        self.addCleanup(rendering.queue.clear)
+
+    def test_markdown_is_rendered_with_a_toc(self):
+        html, toc = rendering.render_markdown(
+            "# Intro\n\ntext <script>alert(1)</script> [x](javascript:alert(1))"
+            "\n\n## Intro\n\n## `code` part"
+        )
+        self.assertIn('<h1 id="intro">Intro</h1>', html)
+        self.assertIn('<h2 id="intro-2">Intro</h2>', html)
+        self.assertNotIn("<script>", html)
+        self.assertNotIn('href="javascript', html)
+        self.assertEquals(
+            toc,
+            [
+                {"level": 1, "title": "Intro", "id": "intro"},
+                {"level": 2, "title": "Intro", "id": "intro-2"},
+                {"level": 2, "title": "code part", "id": "code-part"},
+            ],
+        )
+
+    def test_edits_are_rendered_once_in_a_batch(self):
+        with mock.patch.object(flush_render_queue, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                post = Post.objects.create(title="title", content="# Draft")
+            with self.captureOnCommitCallbacks(execute=True):
+                post.content = "# Final\n\n" + "word " * 450
+                post.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                other = Post.objects.bulk_create([Post(title="other", content="*hi*")])
+        apply_async.assert_called_once()
+
+        self.assertEquals(flush_render_queue(), 2)
+        post.refresh_from_db()
+        self.assertIn('<h1 id="final">Final</h1>', post.content_html)
+        self.assertEquals(post.toc, [{"level": 1, "title": "Final", "id": "final"}])
+        self.assertEquals(post.reading_time, 3)
+        other[0].refresh_from_db()
+        self.assertEquals(other[0].content_html, "<p><em>hi</em></p>\n")
+        self.assertEquals(rendering.queue.pop(10), [])
+
+    def test_rendering_keeps_the_edit_time(self):
+        post = Post.objects.create(title="title", content="*hi*")
+        self.assertEquals(render_post_ids([post.id]), 1)
+        rendered = Post.objects.get(pk=post.pk)
+        self.assertEquals(rendered.content_html, "<p><em>hi</em></p>\n")
+        self.assertEquals(rendered.updated_at, post.updated_at)
+
+    def test_title_changes_are_not_rendered(self):
+        post = Post.objects.create(title="title", content="content")
+        with mock.patch.object(flush_render_queue, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                post.title = "new title"
+                post.save(update_fields=["title"])
+        apply_async.assert_not_called()
+
+    def test_backfill_command(self):
+        Post.objects.bulk_create(
+            [Post(title=f"title {index}", content=f"# {index}") for index in range(5)]
+        )
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, "task_always_eager", False)
+
+        out = io.StringIO()
+        call_command("render_posts", chunk_size=2, wait=True, stdout=out)
+        self.assertIn("3 chunks queued", out.getvalue())
+        self.assertIn("5 posts rendered", out.getvalue())
+        self.assertFalse(Post.objects.filter(content_html="").exists())
+
+
+class PostCacheWarmingTest(AuthenticatedClientMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        caching.warm_queue.clear()
+        self.addCleanup(caching.warm_queue.clear)
+        self.posts = Post.objects.bulk_create(
+            [Post(title=f"title {index}", content="content") for index in range(30)]
+        )
+        caching.invalidate_posts()
+
+    def test_warmed_pages_are_served_as_built(self):
+        self.assertEquals(warming.warm_list(3), 2)
+
+        with mock.patch.object(PostViewSet, "render_list") as render_list:
+            first = self.client.get(self.base_url + "posts/")
+            second = self.client.get(first.json()["next"])
+        render_list.assert_not_called()
+        self.assertEquals(len(first.json()["results"]), 20)
+        self.assertEquals(len(second.json()["results"]), 10)
+
+        # the same bytes and etag as a page rendered for a reader
+        caching.invalidate_posts()
+        fresh = self.client.get(self.base_url + "posts/")
+        self.assertEquals(fresh.content, first.content)
+        self.assertEquals(fresh["ETag"], first["ETag"])
+
+    def test_details_of_deleted_posts_are_skipped(self):
+        post = self.posts[0]
+        self.assertEquals(warming.warm_details([post.id, 0]), 1)
+        with mock.patch.object(PostViewSet, "render_detail") as render_detail:
+            res = self.client.get(self.base_url + f"posts/{post.id}/")
+        render_detail.assert_not_called()
+        self.assertEquals(res.json()["id"], post.id)
+
+    def test_invalidations_queue_a_single_warming(self):
+        post = self.posts[0]
+        with mock.patch.object(warm_posts_cache, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                post.title = "new title"
+                post.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                caching.invalidate_posts([self.posts[1].id])
+        apply_async.assert_called_once()
+
+        self.assertEquals(warm_posts_cache(), 2 + 2)
+        with mock.patch.object(PostViewSet, "render_detail") as render_detail:
+            res = self.client.get(self.base_url + f"posts/{post.id}/")
+        render_detail.assert_not_called()
+        self.assertEquals(res.json()["title"], "new title")
+
+    @override_settings(POSTS_POPULAR_SAMPLE_RATE=1.0, POSTS_CACHE_WARM_TOP_K=2)
+    def test_popular_posts_are_warmed(self):
+        for post, hits in zip(self.posts, (1, 3, 2)):
+            for _ in range(hits):
+                self.client.get(self.base_url + f"posts/{post.id}/")
+        ranking = [self.posts[1].id, self.posts[2].id]
+        self.assertEquals(caching.popular_posts(2), ranking)
+
+        caching.invalidate_posts([post.id for post in self.posts])
+        self.assertEquals(warm_popular_posts(), 2 + 2)
+        score = get_redis_connection("default").zscore(
+            cache.make_key(caching.POPULAR_KEY), self.posts[1].id
+        )
+        self.assertEquals(score, 1.5)
+
+    @override_settings(POSTS_CACHE_WARM_TOP_K=2)
+    def test_recent_posts_are_warmed_without_a_ranking(self):
+        self.assertEquals(
+            warming.popular_or_recent(2), [self.posts[-1].id, self.posts[-2].id]
+        )
+
+
+class PostImportTest(AuthenticatedClientMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        # run the import in the request, against the test database
+        for setting in ("task_always_eager", "task_store_eager_result"):
+            setattr(celery_app.conf, setting, True)
+            self.addCleanup(setattr, celery_app.conf, setting, False)
+        self.import_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.import_dir)
+        settings_override = override_settings(
+            POSTS_IMPORT_DIR=self.import_dir, POSTS_IMPORT_CHUNK_SIZE=2
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, body, content_type):
+        return self.client.post(
+            self.base_url + "posts/import/", data=body, content_type=content_type
+        )
+
+    def test_ndjson_import(self):
+        lines = [
+            json.dumps({"title": f"title {index}", "content": "content"})
+            for index in range(5)
+        ]
+        lines[1] = json.dumps({"content": "no title"})
+        lines.insert(3, "{not json")
+        with mock.patch("BlogApp.blog.imports.invalidate_posts") as invalidate:
+            res = self.upload("\n".join(lines) + "\n", "application/x-ndjson")
+        self.assertEquals(res.status_code, status.HTTP_202_ACCEPTED)
+        invalidate.assert_called_once_with()
+
+        self.assertEquals(Post.objects.count(), 4)
+        self.assertEquals(os.listdir(self.import_dir), [])
+
+        res = self.client.get(self.base_url + f"posts/import/{res.data['task_id']}/")
+        self.assertEquals(res.data["task_status"], "SUCCESS")
+        report = res.data["report"]
+        self.assertEquals(
+            (report["processed"], report["created"], report["failed"]), (6, 4, 2)
+        )
+        self.assertEquals([error["line"] for error in report["errors"]], [2, 4])
+        self.assertIn("title", report["errors"][0]["errors"])
+
+    def test_csv_import(self):
+        body = 'title,content\nfirst,one\nsecond,"two, with a comma"\n'
+        res = self.upload(body, "text/csv; charset=utf-8")
+        self.assertEquals(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEquals(Post.objects.get(title="second").content, "two, with a comma")
+
+    def test_unsupported_uploads(self):
+        res = self.upload("title: x", "text/plain")
+        self.assertEquals(res.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        res = self.upload("", "application/x-ndjson")
+        self.assertEquals(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_progress_is_reported(self):
+        task = mock.Mock()
+        with mock.patch("BlogApp.blog.imports.invalidate_posts"):
+            path = os.path.join(self.import_dir, "posts.ndjson")
+            with open(path, "w") as file:
+                for index in range(5):
+                    file.write(json.dumps({"title": f"{index}", "content": "x"}) + "\n")
+            imports.import_file(path, "ndjson", task)
+        self.assertEquals(
+            [call.args[0]["created"] for call in task.call_args_list], [2, 4, 5]
+        )
+
+
+class PostExportTest(AuthenticatedClientMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.posts = [
+            Post.objects.create(title=f"title {index}", content=f"line\n{index}")
+            for index in range(3)
+        ]
+
+    def test_ndjson_export(self):
+        with override_settings(POSTS_EXPORT_CHUNK_SIZE=2):
+            res = self.client.get(self.base_url + "posts/export/")
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        self.assertEquals(res["Content-Type"], "application/x-ndjson; charset=utf-8")
+
+        rows = [
+            json.loads(line) for line in b"".join(res.streaming_content).splitlines()
+        ]
+        self.assertEquals([row["id"] for row in rows], [post.id for post in self.posts])
+        self.assertEquals(rows[0]["content"], "line\n0")
+        self.assertEquals(set(rows[0]), set(exports.FIELDS))
+
+    def test_csv_export(self):
+        res = self.client.get(self.base_url + "posts/export/?format=csv")
+        self.assertEquals(res["Content-Type"], "text/csv; charset=utf-8")
+        body = b"".join(res.streaming_content).decode()
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEquals(len(rows), 3)
+        self.assertEquals(rows[2]["content"], "line\n2")
+
+        # round trip through the import
+        path = os.path.join(tempfile.mkdtemp(), "posts.csv")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, "w") as file:
+            file.write(body)
+        with mock.patch("BlogApp.blog.imports.invalidate_posts"):
+            self.assertEquals(imports.import_file(path, "csv")["created"], 3)
+
+    def test_export_runs_in_a_transaction(self):
+        # a cursor opened in autocommit is held, its whole result copied first
+        depths = []
+        ndjson_lines = exports.ndjson_lines
+
+        def lines(rows):
+            for line in ndjson_lines(rows):
+                depths.append(len(connection.atomic_blocks))
+                yield line
+
+        outside = len(connection.atomic_blocks)
+        with mock.patch.object(exports, "ndjson_lines", lines):
+            res = self.client.get(self.base_url + "posts/export/")
+            b"".join(res.streaming_content)
+        self.assertEquals(len(depths), 3)
+        self.assertTrue(all(depth == outside + 1 for depth in depths))
+        self.assertEquals(len(connection.atomic_blocks), outside)
+
+    def test_updated_since(self):
+        Post.objects.filter(pk=self.posts[1].pk).update(
+            updated_at=self.posts[1].updated_at + timedelta(days=1)
+        )
+        since = (self.posts[1].updated_at + timedelta(hours=1)).isoformat()
+        res = self.client.get(self.base_url + "posts/export/", {"updated_since": since})
+        rows = b"".join(res.streaming_content).splitlines()
+        self.assertEquals([json.loads(row)["id"] for row in rows], [self.posts[1].id])
+
+        res = self.client.get(self.base_url + "posts/export/?updated_since=yesterday")
+        self.assertEquals(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(b"updated_since", res.content)
+
+
+@override_settings(METRICS_PUBLIC=True)
+class MetricsTest(AuthenticatedClientMixin, APITestCase):
+    jwt = True
+
+    def setUp(self):
+        super().setUp()
+        Post.objects.create(title="title", content="content")
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    @staticmethod
+    def timings(response):
+        entries = {}
+        for entry in response["Server-Timing"].split(", "):
+            name, *params = entry.split(";")
+            entries[name] = dict(param.split("=", 1) for param in params)
+        return entries
+
+    def test_server_timing(self):
+        timings = self.timings(self.client.get(self.base_url + "posts/"))
+        self.assertEquals(timings["cache-list"]["desc"], '"0 hit / 1 miss"')
+        self.assertEquals(timings["cache-auth"]["desc"], '"0 hit / 1 miss"')
+        for name in ("sql", "redis", "auth", "permissions", "serialize", "render"):
+            self.assertIn(name, timings)
+        self.assertGreater(float(timings["total"]["dur"]), 0)
+
+        # served from the cache, nothing is serialized or queried
+        timings = self.timings(self.client.get(self.base_url + "posts/"))
+        self.assertEquals(timings["cache-list"]["desc"], '"1 hit / 0 miss"')
+        self.assertEquals(timings["cache-auth"]["desc"], '"1 hit / 0 miss"')
+        self.assertNotIn("serialize", timings)
+        self.assertNotIn("sql", timings)
+
+    def test_search_and_detail_families(self):
+        post = Post.objects.get()
+        self.client.get(self.base_url + f"posts/{post.id}/")
+        timings = self.timings(self.client.get(self.base_url + "posts/search/?q=title"))
+        self.assertEquals(timings["cache-list-search"]["desc"], '"0 hit / 1 miss"')
+
+        body = self.client.get("/metrics").content.decode()
+        self.assertIn('cache_requests_total{family="detail",result="miss"} 1', body)
+        self.assertIn(
+            'cache_requests_total{family="list:search",result="miss"} 1', body
+        )
+
+    def test_prometheus_endpoint(self):
+        for _ in range(3):
+            self.client.get(self.base_url + "posts/")
+        res = self.client.get("/metrics")
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res["Content-Type"].startswith("text/plain; version=0.0.4"))
+
+        lines = res.content.decode().splitlines()
+        route = 'method="GET",route="posts-list"'
+        buckets = [
+            int(line.rsplit(" ", 1)[1])
+            for line in lines
+            if line.startswith("http_request_duration_seconds_bucket{" + route)
+        ]
+        self.assertEquals(len(buckets), len(metrics.BUCKETS) + 1)
+        self.assertEquals(buckets, sorted(buckets))
+        self.assertEquals(buckets[-1], 3)
+        self.assertIn(f"http_request_duration_seconds_count{{{route}}} 3", lines)
+        self.assertIn(f'http_requests_total{{{route},status="200"}} 3', lines)
+        self.assertIn('cache_requests_total{family="list",result="hit"} 2', lines)
+        self.assertTrue(
+            any(
+                line.startswith('db_queries_total{route="posts-list"}')
+                for line in lines
+            )
+        )
+        self.assertTrue(
+            any(
+                line.startswith(
+                    'request_phase_seconds_total{route="posts-list",phase="render"}'
+                )
+                for line in lines
+            )
+        )
+        # the scrapes themselves are not recorded
+        self.assertFalse(any('route="metrics"' in line for line in lines))
+
+    async def test_async_endpoints(self):
+        login = await sync_to_async(self.client.post)(
+            self.base_url + "token/",
+            {"username": "test", "password": "test"},
+            format="json",
+        )
+        headers = {"Authorization": "Bearer " + login.data["access"]}
+        res = await self.async_client.get(
+            self.base_url + "async/posts/", headers=headers
+        )
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        timings = self.timings(res)
+        self.assertEquals(timings["cache-list-async"]["desc"], '"0 hit / 1 miss"')
+        self.assertIn("sql", timings)
+
+        res = await sync_to_async(self.client.get)("/metrics")
+        self.assertIn('route="async-posts-list"', res.content.decode())
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_token(self):
+        client = APIClient()
+        self.assertEquals(client.get("/metrics").status_code, 403)
+        res = client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN="", METRICS_PUBLIC=False)
+    def test_metrics_are_closed_without_a_token(self):
+        self.assertEquals(APIClient().get("/metrics").status_code, 403)
+
+    @override_settings(METRICS_SERVER_TIMING=False)
+    def test_server_timing_disabled(self):
+        res = self.client.get(self.base_url + "posts/")
+        self.assertNotIn("Server-Timing", res)
+        self.assertIn("posts-list", self.client.get("/metrics").content.decode())
+
+    def test_redis_errors_are_ignored(self):
+        with mock.patch.object(
+            metrics, "record", side_effect=metrics.RedisError
+        ), self.assertLogs("BlogApp.metrics", "WARNING"):
+            res = self.client.get(self.base_url + "posts/")
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+
+    def test_nothing_recorded_outside_requests(self):
+        self.assertIsNone(metrics.current())
+        with metrics.timer("sql"):
+            list(Post.objects.all())
+        metrics.record_cache("list", True)
+        self.assertNotIn("posts-list", self.client.get("/metrics").content.decode())
+
+
+class BenchmarkTest(TestCase):
+    def setUp(self):
+        rendering.queue.clear()
+        self.addCleanup(rendering.queue.clear)
+
+    def test_seed_posts(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("seed_posts", count=5, batch_size=2, stdout=io.StringIO())
+        posts = list(Post.objects.order_by("id"))
+        self.assertEquals(len(posts), 5)
+        for post in posts:
+            self.assertTrue(post.content_html)
+            self.assertGreater(post.word_count, 0)
+            self.assertIsNotNone(post.search_vector)
+        # rendered here, nothing left for the workers
+        self.assertEquals(rendering.queue.pop(10), [])
+
+        # the same seed makes the same posts
+        self.assertEquals(PostFactory(0).post()["title"], posts[0].title)
+
+    def test_seed_posts_defer_render(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                "seed_posts",
+                count=2,
+                clear=True,
+                defer_render=True,
+                stdout=io.StringIO(),
+            )
+        self.assertEquals(
+            sorted(rendering.queue.pop(10)),
+            list(Post.objects.values_list("id", flat=True)),
+        )
+
+    def test_content_sizes(self):
+        factory = PostFactory(1)
+        counts = sorted(len(factory.content().split()) for _ in range(200))
+        self.assertTrue(300 < counts[100] < 1000)
+        self.assertGreater(counts[-1], 2 * counts[100])
+
+    def test_workload(self):
+        workload = posts_api.Workload(
+            "retrieve",
+            True,
+            ["/api/posts/"],
+            [1],
+            [2, 3],
+            PostFactory(),
+            random.Random(0),
+            0.1,
+        )
+        self.assertEquals(workload(), ("GET", "/api/posts/1/?nocache=0", None))
+        self.assertEquals(workload(), ("GET", "/api/posts/1/?nocache=1", None))
+
+        workload.scenario = "delete"
+        self.assertEquals(workload()[:2], ("DELETE", "/api/posts/3/"))
+        self.assertEquals(workload()[:2], ("DELETE", "/api/posts/2/"))
+        self.assertIsNone(workload())
+
+    def test_compare_with_baseline(self):
+        def result(p95, rps, errors=0):
+            return {
+                "scenario": "list",
+                "cache": "warm",
+                "p95_ms": p95,
+                "rps": rps,
+                "errors": errors,
+            }
+
+        baseline = {"results": [result(10.0, 1000.0)]}
+        self.assertEquals(posts_api.compare([result(11.0, 900.0)], baseline, 0.2), [])
+        regressions = posts_api.compare([result(13.0, 700.0, 2)], baseline, 0.2)
+        self.assertEquals(len(regressions), 3)
+        self.assertIn("p95 13.0 ms, was 10.0 ms", regressions[1])
+
+
+@override_settings(POSTS_POPULAR_SAMPLE_RATE=0)
+class PostBudgetsTest(AuthenticatedClientMixin, APITestCase):
+    jwt = True
+
+    # the most SQL queries and cache operations each endpoint may run, with
+    # the user and the responses it reads dropped from the cache (cold) or
+    # cached by an earlier request (warm)
+    BUDGETS = {
+        # the user and their permissions, then the page
+        ("list", "cold"): (4, 9),
+        # user, generation, entry and the metrics
+        ("list", "warm"): (0, 4),
+        # and the view count
+        ("retrieve", "cold"): (4, 10),
+        ("retrieve", "warm"): (0, 5),
+        ("search", "cold"): (4, 9),
+        ("search", "warm"): (0, 4),
+        # insert and search vector, then the invalidation and the metrics
+        ("create", "cold"): (5, 4),
+        ("create", "warm"): (2, 3),
+        ("update", "cold"): (6, 4),
+        ("update", "warm"): (3, 3),
+        ("destroy", "cold"): (5, 4),
+        ("destroy", "warm"): (2, 3),
+        ("bulk", "cold"): (7, 4),
+        ("bulk", "warm"): (4, 3),
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.posts = [
+            Post.objects.create(title=f"title {index}", content="content")
+            for index in range(3)
+        ]
+
+    def requests(self):
+        post = self.posts[0]
+        detail = self.base_url + f"posts/{post.id}/"
+        payload = {"title": "title", "content": "content"}
+        return {
+            "list": ("get", self.base_url + "posts/", None),
+            "retrieve": ("get", detail, None),
+            "search": ("get", self.base_url + "posts/search/?q=title", None),
+            "create": ("post", self.base_url + "posts/", payload),
+            "update": ("put", detail, payload),
+            "destroy": ("delete", detail, None),
+            "bulk": ("post", self.base_url + "posts/bulk/", [payload, payload]),
+        }
+
+    def measure(self, endpoint, state):
+        method, path, payload = self.requests()[endpoint]
+        make_cold([self.user.id], [post.id for post in self.posts])
+        if state == "warm":
+            # reads warm their own entry, writes the user and the detail
+            self.client.get(path if method == "get" else self.requests()["retrieve"][1])
+
+        queries, cache_ops = self.BUDGETS[endpoint, state]
+        with budget(endpoint, state, queries, cache_ops):
+            res = getattr(self.client, method)(path, payload, format="json")
+        self.assertLess(res.status_code, 300)
+
+    def test_budgets(self):
+        for endpoint, state in self.BUDGETS:
+            with self.subTest(endpoint=endpoint, state=state):
+                try:
+                    self.measure(endpoint, state)
+                finally:
+                    # destroy removes the post the others work on
+                    if not Post.objects.filter(pk=self.posts[0].pk).exists():
+                        self.posts[0] = Post.objects.create(title="title", content="c")
+
+    def test_report(self):
+        with self.assertRaises(BudgetExceeded) as raised:
+            with budget("retrieve", "cold", queries=1, cache_ops=1):
+                make_cold([self.user.id], [self.posts[0].id])
+                self.client.get(self.base_url + f"posts/{self.posts[0].id}/")
+        message = str(raised.exception)
+        self.assertIn("retrieve (cold) is over its budget", message)
+        self.assertIn('FROM "blog_post"', message)
+        self.assertIn("GET :1:auth:user:", message)
+
+        # the broker is not the cache
+        with budget("celery", "-", queries=0, cache_ops=0):
+            add.delay(1, 1)
+
+
+class PostCompressionTest(AuthenticatedClientMixin, APITestCase):
+    jwt = True
+
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(title="title", content="word " * 1000)
+        self.url = self.base_url + f"posts/{self.post.id}/"
+        self.identity = self.client.get(self.url)
+
+    def test_gzip(self):
+        res = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        self.assertEquals(res["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", res["Vary"])
+        self.assertEquals(gzip.decompress(res.content), self.identity.content)
+        self.assertLess(len(res.content), len(self.identity.content) / 5)
+        self.assertEquals(res["ETag"], self.identity["ETag"][:-1] + '-gzip"')
+
+        res = self.client.get(
+            self.url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=res["ETag"]
+        )
+        self.assertEquals(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertTrue(res["ETag"].endswith('-gzip"'))
+        # the identity etag does not match the gzip representation
+        res = self.client.get(
+            self.url,
+            HTTP_ACCEPT_ENCODING="gzip",
+            HTTP_IF_NONE_MATCH=self.identity["ETag"],
+        )
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+
+    @skipUnless(compression.brotli, "brotli is not installed")
+    def test_brotli(self):
+        res = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+        self.assertEquals(res["Content-Encoding"], "br")
+        self.assertEquals(
+            compression.brotli.decompress(res.content), self.identity.content
+        )
+
+        # weights win over the server's preference
+        res = self.client.get(self.url, HTTP_ACCEPT_ENCODING="br;q=0.5, gzip")
+        self.assertEquals(res["Content-Encoding"], "gzip")
+
+    def test_identity(self):
+        self.assertNotIn("Content-Encoding", self.identity)
+        self.assertIn("Accept-Encoding", self.identity["Vary"])
+        for header in ("identity", "gzip;q=0, br;q=0", "compress"):
+            res = self.client.get(self.url, HTTP_ACCEPT_ENCODING=header)
+            self.assertNotIn("Content-Encoding", res)
+            self.assertEquals(res.content, self.identity.content)
+
+        res = self.client.get(self.url, HTTP_ACCEPT_ENCODING="*")
+        self.assertIn(res["Content-Encoding"], compression.PREFERENCE)
+
+    def test_identity_weight(self):
+        available = {"gzip": b""}
+        self.assertIsNone(compression.negotiate("gzip;q=0.5, identity", available))
+        self.assertIsNone(compression.negotiate("gzip;q=0.5, *", available))
+        self.assertEquals(compression.negotiate("gzip;q=0.5", available), "gzip")
+        self.assertEquals(
+            compression.negotiate("gzip;q=0.1, identity;q=0", available), "gzip"
+        )
+        for header in ("identity;q=0", "br, *;q=0", "gzip;q=0, identity;q=0"):
+            with self.assertRaises(NotAcceptable):
+                compression.negotiate(header, available)
+        self.assertIsNone(compression.negotiate("br, *;q=0, identity", available))
+
+        res = self.client.get(self.url, HTTP_ACCEPT_ENCODING="identity;q=0")
+        self.assertEquals(res["Content-Encoding"], "gzip")
+        with override_settings(POSTS_COMPRESS_MIN_SIZE=10**6):
+            caching.invalidate_posts([self.post.id])
+            res = self.client.get(self.url, HTTP_ACCEPT_ENCODING="identity;q=0")
+        self.assertEquals(res.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+
+    @override_settings(POSTS_COMPRESS_MIN_SIZE=10)
+    def test_variants_are_built_once(self):
+        self.client.get(self.base_url + "posts/")
+        with mock.patch.object(compression, "compress") as compress:
+            res = self.client.get(self.base_url + "posts/", HTTP_ACCEPT_ENCODING="gzip")
+        compress.assert_not_called()
+        self.assertEquals(res["Content-Encoding"], "gzip")
+
+    def test_small_bodies_are_not_compressed(self):
+        with override_settings(POSTS_COMPRESS_MIN_SIZE=10**6):
+            self.assertEquals(compression.compress(b"{}"), {})
+            caching.invalidate_posts([self.post.id])
+            res = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertNotIn("Content-Encoding", res)
+        self.assertIn("Accept-Encoding", res["Vary"])
+
+    def test_entries_without_variants(self):
+        rendered = caching.rendered(b"{}", "application/json")
+        del rendered["encodings"]
+        request = mock.Mock(headers={"Accept-Encoding": "gzip"})
+        res = PostViewSet.cached_response(request, rendered)
+        self.assertEquals(res.content, b"{}")
+
+    async def test_async_endpoints(self):
+        res = await self.async_client.get(
+            self.url.replace("/api/", "/api/async/"),
+            headers={
+                "Authorization": f"Bearer {self.token}",
+                "Accept-Encoding": "gzip",
+            },
+        )
+        self.assertEquals(res["Content-Encoding"], "gzip")
+
+
+class PostViewCountsTest(AuthenticatedClientMixin, APITestCase):
+    jwt = True
+
+    def setUp(self):
+        super().setUp()
+        self.redis = get_redis_connection("default")
+        self.clear()
+        self.addCleanup(self.clear)
+        self.posts = [
+            Post.objects.create(title=f"title {index}", content="content")
+            for index in range(3)
+        ]
+
+    def clear(self):
+        self.redis.delete(
+            *(
+                cache.make_key(key)
+                for key in (
+                    counters.PENDING_KEY,
+                    counters.FLUSHING_KEY,
+                    counters.RANKING_KEY,
+                    counters.SEEDED_KEY,
+                    counters.FLUSH_LOCK_KEY,
+                )
+            )
+        )
+
+    def view(self, post, times=1):
+        for _ in range(times):
+            res = self.client.get(self.base_url + f"posts/{post.id}/")
+            self.assertEquals(res.status_code, status.HTTP_200_OK)
+
+    def test_views_are_counted_on_cache_hits(self):
+        self.view(self.posts[0], 3)
+        self.client.get(self.base_url + "posts/0/")
+
+        pending = self.redis.hgetall(cache.make_key(counters.PENDING_KEY))
+        self.assertEquals(pending, {str(self.posts[0].id).encode(): b"3"})
+        # nothing is written until the flush
+        self.posts[0].refresh_from_db()
+        self.assertEquals(self.posts[0].views, 0)
+
+    def test_views_are_counted_by_post_id(self):
+        self.view(self.posts[0])
+        self.client.get(self.base_url + f"posts/0{self.posts[0].id}/")
+        self.client.get(self.base_url + f"posts/0{self.posts[0].id}/?format=api")
+
+        res = self.client.get(self.base_url + "posts/most_viewed/")
+        self.assertEquals(
+            [(post["id"], post["views"]) for post in res.json()],
+            [(self.posts[0].id, 3)],
+        )
+
+    def test_flush_adds_the_counts_in_one_update(self):
+        self.view(self.posts[0], 2)
+        self.view(self.posts[1])
+        etag = self.client.get(self.base_url + f"posts/{self.posts[0].id}/")["ETag"]
+
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEquals(flush_view_counts(), 2)
+        updates = [q for q in captured if q["sql"].startswith("UPDATE")]
+        self.assertEquals(len(updates), 1)
+
+        views = dict(Post.objects.values_list("id", "views"))
+        self.assertEquals(views[self.posts[0].id], 3)
+        self.assertEquals(views[self.posts[1].id], 1)
+        self.assertFalse(self.redis.exists(cache.make_key(counters.PENDING_KEY)))
+        self.assertEquals(flush_view_counts(), 0)
+
+        # the counts do not change the representation
+        res = self.client.get(self.base_url + f"posts/{self.posts[0].id}/")
+        self.assertEquals(res["ETag"], etag)
+        self.assertNotIn("views", res.json())
+
+    def test_an_unfinished_flush_is_applied_first(self):
+        self.view(self.posts[0], 2)
+        # the worker died after taking the counts
+        with mock.patch.object(counters, "apply_deltas", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                counters.flush()
+        self.view(self.posts[0])
+
+        self.assertEquals(counters.flush(), 1)
+        self.assertEquals(Post.objects.get(pk=self.posts[0].pk).views, 2)
+        self.assertEquals(counters.flush(), 1)
+        self.assertEquals(Post.objects.get(pk=self.posts[0].pk).views, 3)
+
+    def test_deleted_posts_are_skipped(self):
+        self.view(self.posts[0])
+        self.view(self.posts[1])
+        self.posts[1].delete()
+        self.assertEquals(counters.flush(), 1)
+        self.assertFalse(self.redis.exists(cache.make_key(counters.FLUSHING_KEY)))
+
+    def test_most_viewed(self):
+        for post, times in zip(self.posts, (1, 3, 2)):
+            self.view(post, times)
+
+        res = self.client.get(self.base_url + "posts/most_viewed/?limit=2")
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        self.assertEquals(
+            [(post["id"], post["views"]) for post in res.json()],
+            [(self.posts[1].id, 3), (self.posts[2].id, 2)],
+        )
+        res = self.client.get(self.base_url + "posts/most_viewed/?limit=0")
+        self.assertEquals(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ranking_is_rebuilt_from_the_stored_counts(self):
+        self.view(self.posts[0], 2)
+        self.view(self.posts[2])
+        counters.flush()
+
+        # redis lost everything
+        self.clear()
+        self.assertEquals(counters.most_viewed(3), [])
+        counters.flush()
+        self.assertEquals(
+            counters.most_viewed(3), [(self.posts[0].id, 2), (self.posts[2].id, 1)]
+        )
+
+        # a score behind the stored count is raised by the next flush
+        self.clear()
+        self.view(self.posts[2])
+        counters.flush()
+        self.assertEquals(counters.most_viewed(1), [(self.posts[2].id, 2)])
+        self.assertEquals(counters.most_viewed(3)[1], (self.posts[0].id, 2))
+
+    async def test_async_detail_counts_views(self):
+        await self.async_client.get(
+            self.base_url + f"async/posts/{self.posts[0].id}/",
+            headers={"Authorization": f"Bearer {self.token}"},
+        )
+        self.assertEquals(
+            await sync_to_async(counters.most_viewed)(1), [(self.posts[0].id, 1)]
+        )
+
+
+class PostAdminTest(TestCase):
+    url = "/admin/blog/post/"
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(username="admin", password="admin")
+        self.client.force_login(self.user)
+        self.posts = Post.objects.bulk_create(
+            [
+                Post(title=f"title {index}", content=f"secret content {index}")
+                for index in range(5)
+            ]
+        )
+        # spread over two years, three months and four days
+        for post, created_at in zip(
+            self.posts,
+            (
+                "2024-12-31T23:00:00+00:00",
+                "2025-01-01T10:00:00+00:00",
+                "2025-01-01T11:00:00+00:00",
+                "2025-01-02T10:00:00+00:00",
+                "2025-03-15T10:00:00+00:00",
+            ),
+        ):
+            Post.objects.filter(pk=post.pk).update(created_at=created_at)
+
+    def test_changelist_skips_the_content(self):
+        with CaptureQueriesContext(connection) as captured:
+            res = self.client.get(self.url)
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        self.assertContains(res, "title 4")
+        for query in captured:
+            self.assertNotRegex(query["sql"], r'"blog_post"\."content"[^_]')
+
+    @override_settings(POSTS_ADMIN_EXACT_COUNT_LIMIT=0)
+    def test_counts_are_estimated(self):
+        from . import admin as post_admin
+
+        with mock.patch.object(
+            post_admin, "estimated_count", return_value=1000000
+        ), CaptureQueriesContext(connection) as captured:
+            res = self.client.get(self.url + "?p=2")
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        self.assertContains(res, "1000000 posts")
+        self.assertFalse(any("COUNT(" in query["sql"] for query in captured))
+
+        # the planner's estimates, from the statistics or the plan
+        self.assertIsInstance(post_admin.estimated_count(Post.objects.all()), int)
+        self.assertGreaterEqual(
+            post_admin.estimated_count(Post.objects.filter(title="title 1")), 0
+        )
+
+    def test_pages_are_loaded_by_key(self):
+        from .admin import EstimatedCountPaginator
+
+        queryset = Post.objects.order_by("-created_at", "-id").defer("content")
+        paginator = EstimatedCountPaginator(queryset, 2)
+        self.assertEquals(paginator.count, 5)
+        pages = [
+            [post.id for post in paginator.page(number)]
+            for number in paginator.page_range
+        ]
+        ids = [post.id for post in queryset]
+        self.assertEquals(pages, [ids[0:2], ids[2:4], ids[4:]])
+
+    def test_date_hierarchy_matches_the_database(self):
+        from .admin import IndexedDatesQuerySet
+
+        queryset = IndexedDatesQuerySet(Post)
+        for kind in ("year", "month", "day"):
+            with self.subTest(kind=kind):
+                self.assertEquals(
+                    queryset.datetimes("created_at", kind),
+                    list(Post.objects.datetimes("created_at", kind)),
+                )
+        days = queryset.datetimes("created_at", "day", order="DESC")
+        self.assertEquals(days[0].date(), date(2025, 3, 15))
+
+        res = self.client.get(self.url + "?created_at__year=2025")
+        self.assertContains(res, "March")
+
+    def test_search_uses_the_search_vector(self):
+        res = self.client.get(self.url, {"q": "title"})
+        self.assertEquals(len(res.context["cl"].result_list), 5)
+        res = self.client.get(self.url, {"q": "missing"})
+        self.assertEquals(len(res.context["cl"].result_list), 0)
+
+    @override_settings(POSTS_ADMIN_ACTION_CHUNK_SIZE=2)
+    def test_bulk_actions_are_queued(self):
+        data = {
+            "action": "delete_in_background",
+            "_selected_action": [post.id for post in self.posts],
+        }
+        with mock.patch.object(delete_posts, "delay") as delay:
+            res = self.client.post(self.url, data, follow=True)
+        self.assertContains(res, "Queued the deletion of 5 posts.")
+        self.assertEquals(
+            sorted(pk for call in delay.call_args_list for pk in call.args[0]),
+            sorted(post.id for post in self.posts),
+        )
+        self.assertEquals(
+            [len(call.args[0]) for call in delay.call_args_list], [2, 2, 1]
+        )
+        self.assertEquals(Post.objects.count(), 5)
+
+        self.assertEquals(delete_posts([self.posts[0].id, self.posts[1].id]), 2)
+        self.assertEquals(Post.objects.count(), 3)
+
+        # the synchronous deletion is not offered
+        res = self.client.get(self.url)
+        choices = res.context["action_form"].fields["action"].choices
+        self.assertNotIn("delete_selected", [name for name, _ in choices])
+
+
+class PostRowSerializationTest(AuthenticatedClientMixin, APITestCase):
+    jwt = True
+
+    def setUp(self):
+        super().setUp()
+        self.posts = [
+            Post.objects.create(title="title", content="content"),
+            Post.objects.create(title="تیتر ✓", content="# Heading\n\nbody " * 50),
+            Post.objects.create(title="x" * 200, content="`code` <b>html</b>"),
+        ]
+        Post.objects.filter(pk=self.posts[1].pk).update(
+            toc=[{"level": 1, "title": "Heading", "id": "heading"}],
+            content_html="<h1>Heading</h1>",
+            reading_time=3,
+        )
+        # whole seconds format without microseconds
+        Post.objects.filter(pk=self.posts[2].pk).update(
+            created_at="2025-01-01T00:00:00+00:00"
+        )
+
+    def assertSameOutput(self, serializer_class, queryset, request=None):
+        queryset = queryset.order_by("id")
+        expected = serializer_class(queryset, many=True, context={"request": request})
+        layout = row_serializers.layout_for(serializer_class, request)
+        rows = layout.rows(queryset, "id")
+        self.assertEquals(
+            json.dumps(layout.serialize_many(rows)), json.dumps(expected.data)
+        )
+
+    def test_serializers(self):
+        self.assertSameOutput(PostSerializer, Post.objects.defer("search_vector"))
+        self.assertSameOutput(PostSummarySerializer, Post.objects.all())
+        with timezone.override("Asia/Tehran"):
+            self.assertSameOutput(PostSerializer, Post.objects.all())
+
+    def test_sparse_fieldsets(self):
+        for fields in ("id,title", "updated_at,excerpt", "missing"):
+            request = Request(RequestFactory().get("/", {"fields": fields}))
+            with self.subTest(fields=fields):
+                self.assertSameOutput(
+                    PostSummarySerializer, Post.objects.all(), request
+                )
+
+    def test_converters(self):
+        value = timezone.now()
+        for field in (
+            serializers.DateTimeField(),
+            serializers.DateTimeField(format="%Y-%m-%d %H:%M"),
+            serializers.DateTimeField(format=None),
+        ):
+            with self.subTest(format=getattr(field, "format", None)):
+                self.assertEquals(
+                    row_serializers.converter(field)(value),
+                    field.to_representation(value),
+                )
+
+        field = serializers.EmailField()
+        self.assertEquals(row_serializers.converter(field), field.to_representation)
+
+    def test_only_columns_compile(self):
+        class MethodSerializer(serializers.ModelSerializer):
+            upper = serializers.SerializerMethodField()
+
+            class Meta:
+                model = Post
+                fields = ("id", "upper")
+
+            def get_upper(self, post):
+                return post.title.upper()
+
+        with self.assertRaises(ImproperlyConfigured):
+            row_serializers.layout_for(MethodSerializer)
+
+    def responses(self, urls):
+        responses = []
+        for url in urls:
+            caching.invalidate_posts([post.id for post in self.posts])
+            if url.startswith("async/"):
+                res = async_to_sync(self.async_client.get)(
+                    self.base_url + url,
+                    headers={"Authorization": f"Bearer {self.token}"},
+                )
+            else:
+                res = self.client.get(self.base_url + url)
+            responses.append((res.status_code, res.content, res.get("ETag")))
+        return responses
+
+    def test_endpoints_match(self):
+        post = self.posts[1]
+        first = self.client.get(self.base_url + "posts/?page_size=1").json()
+        urls = [
+            "posts/",
+            "posts/?page_size=1",
+            first["next"][len(self.base_url) :],
+            "posts/?fields=id,title",
+            f"posts/{post.id}/",
+            f"posts/{post.id}/?fields=title,toc",
+            "posts/0/",
+            "posts/abc/",
+            "async/posts/",
+            f"async/posts/{post.id}/",
+            "async/posts/0/",
+        ]
+        expected = self.responses(urls)
+        with override_settings(POSTS_FAST_SERIALIZATION=True):
+            self.assertEquals(self.responses(urls), expected)
+
+    def test_benchmark(self):
+        out = io.StringIO()
+        call_command("bench_serialization", rows=3, repeat=1, stdout=out)
+        self.assertIn("summary:", out.getvalue())
+        self.assertIn("detail:", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command("bench_serialization", rows=4, stdout=out)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTest(AuthenticatedClientMixin, APITransactionTestCase):
+    jwt = True
+    # the replica alias only exists once the class is set up
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        # a second connection to the test database stands in for the replica
+        connections.settings["replica"] = {
+            **connections["default"].settings_dict,
+            "TEST": {
+                **connections["default"].settings_dict["TEST"],
+                "MIRROR": "default",
+            },
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(title="title", content="content")
+        self.url = self.base_url + f"posts/{self.post.id}/"
+        routers.health.reset()
+        self.addCleanup(routers.health.reset)
+        cache.delete(routers.RECENT_WRITE_KEY)
+
+    def read(self, client=None, **headers):
+        """The aliases the post was read from."""
+        caching.invalidate_posts([self.post.id])
+        cache.delete(routers.RECENT_WRITE_KEY)
+        with CaptureQueriesContext(connections["default"]) as primary:
+            with CaptureQueriesContext(connections["replica"]) as replica:
+                res = (client or self.client).get(self.url, **headers)
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        return {
+            alias
+            for alias, captured in (("default", primary), ("replica", replica))
+            if any('FROM "blog_post"' in query["sql"] for query in captured)
+        }
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEquals(self.read(), {"replica"})
+        # the user is not a blog model
+        self.assertEquals(router.db_for_read(User), "default")
+        self.assertEquals(router.db_for_write(Post), "default")
+        self.assertFalse(router.allow_migrate("replica", "blog"))
+
+    def test_primary_after_a_write(self):
+        res = self.client.put(
+            self.url, {"title": "new", "content": "content"}, format="json"
+        )
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+        until = float(res[routers.PIN_HEADER])
+        self.assertGreater(until, time.time())
+        self.assertEquals(
+            res.cookies[routers.PIN_COOKIE].value, res[routers.PIN_HEADER]
+        )
+
+        # the cookie keeps the client on the primary
+        self.assertEquals(self.read(), {"default"})
+
+        # or the header, for clients without cookies
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="Bearer " + self.token)
+        self.assertEquals(
+            self.read(client, HTTP_X_PIN_PRIMARY_UNTIL=str(until)), {"default"}
+        )
+        self.assertEquals(
+            self.read(client, HTTP_X_PIN_PRIMARY_UNTIL=str(time.time() - 1)),
+            {"replica"},
+        )
+        # reads do not pin
+        self.assertNotIn(routers.PIN_HEADER, client.get(self.url))
+
+    def test_cache_fills_after_a_write_read_the_primary(self):
+        caching.invalidate_posts([self.post.id])
+        with CaptureQueriesContext(connections["replica"]) as replica:
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION="Bearer " + self.token)
+            client.get(self.url)
+        self.assertFalse(any('FROM "blog_post"' in q["sql"] for q in replica))
+
+    def test_transactions_read_the_primary(self):
+        with transaction.atomic():
+            self.assertEquals(router.db_for_read(Post), "default")
+        with routers.use_primary():
+            self.assertEquals(router.db_for_read(Post), "default")
+        self.assertEquals(router.db_for_read(Post), "replica")
+
+    def test_unhealthy_replicas_are_left_out(self):
+        with mock.patch.object(
+            routers, "replica_lag", side_effect=OperationalError
+        ), self.assertLogs("BlogApp.db.routers", "WARNING"):
+            self.assertEquals(self.read(), {"default"})
+
+        routers.health.reset()
+        with mock.patch.object(
+            routers, "replica_lag", return_value=60.0
+        ), self.assertLogs("BlogApp.db.routers", "WARNING"):
+            self.assertEquals(self.read(), {"default"})
+
+        # the result is kept until the next check is due
+        with mock.patch.object(routers, "replica_lag", return_value=0.0) as lag:
+            self.assertEquals(self.read(), {"default"})
+            lag.assert_not_called()
+            with override_settings(DATABASE_REPLICA_CHECK_INTERVAL=0):
+                self.assertEquals(self.read(), {"replica"})
+            lag.assert_called_with("replica")
+
+    def test_tasks_read_what_they_rewrite_from_the_primary(self):
+        with CaptureQueriesContext(connections["replica"]) as replica:
+            self.assertEquals(render_post_ids([self.post.id]), 1)
+            directory = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, directory)
+            path = os.path.join(directory, "posts.ndjson")
+            with open(path, "w") as file:
+                file.write(json.dumps({"title": "title", "content": "x"}) + "\n")
+            with mock.patch.object(celery_app.Task, "update_state"):
+                self.assertEquals(import_posts(path, "ndjson")["created"], 1)
+        self.assertFalse(any('FROM "blog_post"' in q["sql"] for q in replica))
+
+        # outside of them the same reads go to the replica
+        with CaptureQueriesContext(connections["replica"]) as replica:
+            list(Post.objects.filter(id=self.post.id).only("content"))
+        self.assertTrue(any('FROM "blog_post"' in q["sql"] for q in replica))
+
+    def test_replica_lag(self):
+        # the stand-in is a primary, which is never behind
+        self.assertEquals(routers.replica_lag("replica"), 0.0)
+
+
+class ThrottlingTest(APITestCase):
+    client = APIClient(enforce_csrf_checks=True)
+    base_url = "/api/"
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="test", password="test", is_superuser=True
+        )
+        self.other = User.objects.create_user(
+            username="other", password="other", is_superuser=True
+        )
+        self.access = self.login("test").data["access"]
+        self.redis = get_redis_connection("default")
+        self.clear()
+        self.addCleanup(self.clear)
+
+    def clear(self):
+        keys = self.redis.keys(cache.make_key("ratelimit:*"))
+        self.redis.delete(cache.make_key(throttling.RUNNING_KEY), *keys)
+
+    def login(self, username, **extra):
+        data = {"username": username, "password": username}
+        return self.client.post(self.base_url + "token/", data, format="json", **extra)
+
+    def get(self, url, token=None, **extra):
+        token = token or self.access
+        return self.client.get(
+            self.base_url + url, HTTP_AUTHORIZATION=f"Bearer {token}", **extra
+        )
+
+    def test_parse_rate(self):
+        self.assertEquals(throttling.parse_rate("10/min"), (10 / 60, 10))
+        self.assertEquals(throttling.parse_rate("20/s"), (20, 20))
+        self.assertEquals(throttling.parse_rate("1/day"), (1 / 86400, 1))
+
+    @override_settings(RATE_LIMITS_ENABLED=True, RATE_LIMITS={"token": {"ip": "2/min"}})
+    def test_token_is_limited_per_address(self):
+        self.assertEquals(self.login("test").status_code, status.HTTP_200_OK)
+        self.assertEquals(self.login("test").status_code, status.HTTP_200_OK)
+        # turned away before the password is hashed
+        with mock.patch(
+            "django.contrib.auth.backends.ModelBackend.authenticate"
+        ) as authenticate:
+            res = self.login("test")
+        authenticate.assert_not_called()
+        self.assertEquals(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertTrue(25 <= int(res["Retry-After"]) <= 30)
+        self.assertIn("throttled", res.json()["detail"])
+
+        # the other routes and addresses have buckets of their own
+        self.assertEquals(self.get("posts/").status_code, status.HTTP_200_OK)
+        res = self.login("test", REMOTE_ADDR="10.0.0.2")
+        self.assertEquals(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(
+        RATE_LIMITS_ENABLED=True,
+        RATE_LIMITS={"posts": {"user": "2/min", "ip": "100/min"}},
+    )
+    def test_posts_are_limited_per_user(self):
+        other = self.login("other").data["access"]
+        self.assertEquals(self.get("posts/").status_code, status.HTTP_200_OK)
+        self.assertEquals(
+            self.get("async/posts/0/").status_code, status.HTTP_404_NOT_FOUND
+        )
+        self.assertEquals(
+            self.get("posts/").status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertEquals(self.get("posts/", other).status_code, status.HTTP_200_OK)
+
+        # an invalid token only counts against the address
+        res = self.get("posts/", "invalid")
+        self.assertEquals(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(
+        RATE_LIMITS_ENABLED=True,
+        RATE_LIMITS={"posts": {"ip": "1/s"}},
+        RATE_LIMIT_CLIENT_IP_HEADER="X-Real-IP",
+    )
+    def test_buckets_refill(self):
+        self.assertEquals(
+            self.get("posts/", HTTP_X_REAL_IP="10.0.0.1").status_code,
+            status.HTTP_200_OK,
+        )
+        res = self.get("posts/", HTTP_X_REAL_IP="10.0.0.1")
+        self.assertEquals(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEquals(res["Retry-After"], "1")
+        self.assertEquals(
+            self.get("posts/", HTTP_X_REAL_IP="10.0.0.2").status_code,
+            status.HTTP_200_OK,
+        )
+
+        time.sleep(1.05)
+        self.assertEquals(
+            self.get("posts/", HTTP_X_REAL_IP="10.0.0.1").status_code,
+            status.HTTP_200_OK,
+        )
+
+    @override_settings(RATE_LIMITS_ENABLED=True, RATE_LIMITS={"posts": {"ip": "1/min"}})
+    def test_rate_limits_fail_open(self):
+        with mock.patch.object(
+            throttling, "take_tokens", side_effect=RedisError
+        ), self.assertLogs("BlogApp.throttling", "WARNING"):
+            self.assertEquals(self.get("posts/").status_code, status.HTTP_200_OK)
+
+    @override_settings(ADMISSION_MAX_CONCURRENCY=1)
+    def test_concurrency_limit(self):
+        request = RequestFactory().get("/")
+        admitted, slot = throttling.AdmissionMiddleware.admit(request)
+        self.assertTrue(admitted)
+
+        res = self.get("posts/")
+        self.assertEquals(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEquals(res["Retry-After"], "1")
+
+        throttling.AdmissionMiddleware.release(slot)
+        self.assertEquals(self.get("posts/").status_code, status.HTTP_200_OK)
+        # every request gives its slot back
+        self.assertEquals(self.redis.zcard(cache.make_key(throttling.RUNNING_KEY)), 0)
+
+        # the slot of a request whose worker died expires
+        self.redis.zadd(cache.make_key(throttling.RUNNING_KEY), {"lost": 1})
+        self.assertEquals(self.get("posts/").status_code, status.HTTP_200_OK)
+
+    @override_settings(ADMISSION_MAX_CONCURRENCY=5)
+    def test_streamed_responses_hold_their_slot(self):
+        running = cache.make_key(throttling.RUNNING_KEY)
+        res = self.get("posts/export/")
+        self.assertTrue(res.streaming)
+        self.assertEquals(self.redis.zcard(running), 1)
+        b"".join(res.streaming_content)
+        self.assertEquals(self.redis.zcard(running), 0)
+
+    @override_settings(ADMISSION_MAX_QUEUE_DELAY=0.5)
+    def test_queue_delay(self):
+        res = self.get("posts/", HTTP_X_REQUEST_START=f"t={time.time() - 2:.3f}")
+        self.assertEquals(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn("Retry-After", res)
+
+        for start in (f"t={time.time():.3f}", str(int(time.time() * 1000)), "junk"):
+            with self.subTest(start=start):
+                res = self.get("posts/", HTTP_X_REQUEST_START=start)
+                self.assertEquals(res.status_code, status.HTTP_200_OK)
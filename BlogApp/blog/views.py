@@ -1,38 +1,366 @@
-from django.core.cache import cache
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db import transaction
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.generics import get_object_or_404
+from . import caching, compression, counters, exports, imports, row_serializers
 from .models import Post
+from .pagination import KeysetPagination, SearchPagination
+from rest_framework.permissions import IsAdminUser
 from rest_framework.viewsets import ModelViewSet
-from .serializers import PostSerializer
-from .tasks import add
+from BlogApp import metrics
+from BlogApp.db.postgresql_pool.base import pool_stats
+from .serializers import (
+    HEADLINE_START,
+    HEADLINE_STOP,
+    PostBulkDeleteSerializer,
+    PostBulkUpdateSerializer,
+    PostSearchSerializer,
+    PostSerializer,
+    PostSummarySerializer,
+    PostViewsSerializer,
+)
 from rest_framework.response import Response
 
 
 class PostViewSet(ModelViewSet):
     queryset = Post.objects.all()
     serializer_class = PostSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset().defer("search_vector")
+        if self.action != "list":
+            return queryset
+
+        return queryset.only(*PostSummarySerializer.columns(self.request))
+
+    def get_serializer_class(self):
+        if self.action == "list":
+            return PostSummarySerializer
+        return super().get_serializer_class()
+
+    def perform_authentication(self, request):
+        with metrics.timer("auth"):
+            super().perform_authentication(request)
+
+    def check_permissions(self, request):
+        with metrics.timer("permissions"):
+            super().check_permissions(request)
 
     def list(self, request, *args, **kwargs):
-        cached_posts_list = cache.get("posts_list")
-        if cached_posts_list:
-            return Response(cached_posts_list)
+        if not self.is_cacheable(request):
+            return super().list(request, *args, **kwargs)
 
-        cached_posts_list = super().list(request, *args, **kwargs)
-        cache.set("posts_list", cached_posts_list.data)
-        return cached_posts_list
+        rendered = caching.list_value(
+            request.query_params, lambda: self.render_list(request)
+        )
+        return self.cached_response(request, rendered)
 
     def retrieve(self, request, *args, **kwargs):
-        item_id = kwargs.get("pk")
-        cache_key = f"{item_id}_retrieve"
-        cached_post = cache.get(cache_key)
+        if not self.is_cacheable(request):
+            response = super().retrieve(request, *args, **kwargs)
+            counters.record_view(self.detail_pk(kwargs.get("pk")))
+            return response
+
+        pk = self.detail_pk(kwargs.get("pk"))
+        rendered = caching.detail_value(
+            pk, request.query_params, lambda: self.render_detail(request)
+        )
+        caching.record_hit(pk)
+        counters.record_view(pk)
+        return self.cached_response(request, rendered)
+
+    @staticmethod
+    def detail_pk(value):
+        # "01" is post 1, whose entries the invalidations bump
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise NotFound()
+
+    @staticmethod
+    def is_cacheable(request):
+        # the browsable API and any other renderer take the regular path
+        return request.accepted_renderer.format == "json"
+
+    def render_list(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        if settings.POSTS_FAST_SERIALIZATION:
+            layout = row_serializers.layout_for(self.get_serializer_class(), request)
+            # the pagination reads these from the rows
+            page = self.paginate_queryset(layout.rows(queryset, "id", "created_at"))
+            with metrics.timer("serialize"):
+                data = self.get_paginated_response(layout.serialize_many(page)).data
+            return self.render(request, data)
+
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        with metrics.timer("serialize"):
+            data = self.get_paginated_response(serializer.data).data
+        return self.render(request, data)
+
+    def render_detail(self, request):
+        if settings.POSTS_FAST_SERIALIZATION:
+            layout = row_serializers.layout_for(self.get_serializer_class(), request)
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            row = get_object_or_404(
+                layout.rows(self.filter_queryset(self.get_queryset()), "id"),
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]},
+            )
+            self.check_object_permissions(request, row)
+            with metrics.timer("serialize"):
+                data = layout.serialize(row)
+            return self.render(request, data)
+
+        instance = self.get_object()
+        serializer = self.get_serializer(instance)
+        with metrics.timer("serialize"):
+            data = serializer.data
+        return self.render(request, data)
+
+    def render(self, request, data):
+        renderer = request.accepted_renderer
+        # cache keys only cover the query, so the parameters of the accepted
+        # media type (e.g. indent=4) must not change the body
+        with metrics.timer("render"):
+            body = renderer.render(
+                data, renderer.media_type, self.get_renderer_context()
+            )
+        return caching.rendered(body, renderer.media_type)
+
+    @staticmethod
+    def cached_response(request, rendered):
+        # entries cached before the variants were added have none
+        encodings = rendered.get("encodings", {})
+        coding = compression.negotiate(
+            request.headers.get("Accept-Encoding"), encodings
+        )
+        # every representation has its own strong etag
+        etag = rendered["etag"]
+        if coding:
+            etag = f'{etag[:-1]}-{coding}"'
+
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            if "*" in etags or etag in etags:
+                response = HttpResponseNotModified()
+                response["ETag"] = etag
+                patch_vary_headers(response, ("Accept-Encoding",))
+                return response
+
+        if coding:
+            response = HttpResponse(
+                encodings[coding], content_type=rendered["content_type"]
+            )
+            response["Content-Encoding"] = coding
+        else:
+            response = HttpResponse(
+                rendered["body"], content_type=rendered["content_type"]
+            )
+        response["ETag"] = etag
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+    @action(methods=["get"], detail=False)
+    def search(self, request):
+        terms = request.query_params.get("q", "").strip()
+        if not terms:
+            raise ValidationError({"q": ["This query parameter is required."]})
+        if not self.is_cacheable(request):
+            return Response(self.search_page(request, terms))
+
+        rendered = caching.list_value(
+            request.query_params,
+            lambda: self.render(request, self.search_page(request, terms)),
+            variant="search",
+        )
+        return self.cached_response(request, rendered)
 
-        if cached_post:
-            return Response(cached_post)
+    def search_page(self, request, terms):
+        config = settings.POSTS_SEARCH_CONFIG
+        query = SearchQuery(terms, search_type="websearch", config=config)
+        queryset = (
+            Post.objects.filter(search_vector=query)
+            .annotate(
+                # double precision so the rank survives the cursor round trip
+                rank=Cast(SearchRank(F("search_vector"), query), FloatField()),
+                headline=SearchHeadline(
+                    "content",
+                    query,
+                    config=config,
+                    start_sel=HEADLINE_START,
+                    stop_sel=HEADLINE_STOP,
+                    max_fragments=2,
+                ),
+            )
+            .defer("content", "search_vector")
+        )
 
-        cached_post = super().retrieve(request, *args, **kwargs)
-        cache.set(cache_key, cached_post.data)
-        return cached_post
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = PostSearchSerializer(page, many=True)
+        with metrics.timer("serialize"):
+            data = paginator.get_paginated_response(serializer.data).data
+        return data
+
+    @action(methods=["get"], detail=False)
+    def most_viewed(self, request):
+        try:
+            limit = int(request.query_params.get("limit", 10))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= settings.POSTS_MOST_VIEWED_MAX_LIMIT:
+            raise ValidationError(
+                {
+                    "limit": [
+                        f"Enter a number from 1 to "
+                        f"{settings.POSTS_MOST_VIEWED_MAX_LIMIT}."
+                    ]
+                }
+            )
+
+        # the ranking comes from redis, the posts from a single query
+        ranked = counters.most_viewed(limit)
+        posts = self.get_queryset().only(*PostSummarySerializer.columns(request))
+        posts = posts.in_bulk([pk for pk, _ in ranked])
+        page = []
+        for pk, views in ranked:
+            if pk in posts:
+                posts[pk].views = views
+                page.append(posts[pk])
+        serializer = PostViewsSerializer(page, many=True, context={"request": request})
+        return Response(serializer.data)
+
+    @action(methods=["post", "put", "delete"], detail=False)
+    def bulk(self, request):
+        # signals are batched and the generations bumped once, after the commit
+        with caching.batched_invalidation(), transaction.atomic():
+            if request.method == "POST":
+                return self.bulk_create(request)
+            if request.method == "PUT":
+                return self.bulk_update(request)
+            return self.bulk_destroy(request)
+
+    def bulk_create(self, request):
+        serializer = self.get_serializer(
+            data=request.data, many=True, max_length=settings.POSTS_BULK_MAX_SIZE
+        )
+        serializer.is_valid(raise_exception=True)
+        posts = serializer.save()
+        caching.invalidate_posts([post.id for post in posts])
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def bulk_update(self, request):
+        serializer = PostBulkUpdateSerializer(
+            data=request.data, many=True, max_length=settings.POSTS_BULK_MAX_SIZE
+        )
+        serializer.is_valid(raise_exception=True)
+
+        ids = [item["id"] for item in serializer.validated_data]
+        if len(set(ids)) != len(ids):
+            raise ValidationError({"id": ["Each post can only be updated once."]})
+        posts = Post.objects.select_for_update().in_bulk(ids)
+        missing = sorted(set(ids) - set(posts))
+        if missing:
+            raise NotFound(f"Posts not found: {missing}")
+
+        serializer.instance = [posts[pk] for pk in ids]
+        serializer.save()
+        caching.invalidate_posts(ids)
+        return Response(serializer.data)
+
+    def bulk_destroy(self, request):
+        serializer = PostBulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        ids = serializer.validated_data["ids"]
+        Post.objects.filter(id__in=ids).delete()
+        caching.invalidate_posts(ids)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(
+        methods=["get"],
+        detail=False,
+        renderer_classes=[exports.NDJSONRenderer, exports.CSVRenderer],
+    )
+    def export(self, request):
+        queryset = Post.objects.order_by("updated_at", "id")
+        updated_since = request.query_params.get("updated_since")
+        if updated_since:
+            try:
+                since = parse_datetime(updated_since)
+            except ValueError:
+                since = None
+            if since is None:
+                raise ValidationError(
+                    {"updated_since": ["Enter a valid ISO 8601 date and time."]}
+                )
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            queryset = queryset.filter(updated_at__gte=since)
+
+        rows = exports.iterate(
+            queryset.values(*exports.FIELDS), settings.POSTS_EXPORT_CHUNK_SIZE
+        )
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            exports.stream(rows, renderer.format),
+            content_type=f"{renderer.media_type}; charset={renderer.charset}",
+        )
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="posts.{renderer.format}"'
+        # let the rows through nginx as they are produced
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    @action(methods=["get"], detail=False, permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        return Response(caching.tier_stats())
+
+    @action(methods=["get"], detail=False, permission_classes=[IsAdminUser])
+    def pool_stats(self, request):
+        return Response(pool_stats())
+
+    @action(methods=["post"], detail=False, url_path="import")
+    def import_posts(self, request):
+        from .tasks import import_posts
+
+        format = imports.upload_format(request.content_type)
+        path = imports.save_upload(request, format)
+        task_result = import_posts.delay(path, format)
+        return Response(
+            {"task_id": task_result.id, "task_status": task_result.status},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(methods=["get"], detail=False, url_path=r"import/(?P<task_id>[0-9a-f-]+)")
+    def import_status(self, request, task_id):
+        from .tasks import import_posts
+
+        task_result = import_posts.AsyncResult(task_id)
+        report = task_result.info
+        if isinstance(report, Exception):
+            report = {"detail": str(report)}
+        return Response(
+            {"task_id": task_id, "task_status": task_result.status, "report": report}
+        )
 
     @action(methods=["get"], detail=False)
     def run_celery_task(self, request):
+        # celery is only imported once a task is dispatched
+        from .tasks import add
+
         task_result = add.delay(4, 4)
         return Response({"task_status": task_result.status})
@@ -0,0 +1,80 @@
+"""
+Rebuilding the posts cache entries outside of a request.
+
+Entries are rendered by ``PostViewSet`` itself for the request a reader would
+send for the default list pages or a detail, so their bodies and ETags are the
+same as if the reader had built them.
+"""
+import json
+from urllib.parse import urlsplit
+
+from django.http import Http404
+from django.test import RequestFactory
+from django.urls import reverse
+from rest_framework.request import Request
+
+from . import caching
+from .models import Post
+from .views import PostViewSet
+
+
+def make_view(action, query="", **kwargs):
+    path = reverse(f"posts-{action if action == 'list' else 'detail'}", kwargs=kwargs)
+    request = Request(RequestFactory().get(f"{path}?{query}" if query else path))
+    view = PostViewSet(
+        action=action,
+        args=(),
+        kwargs=kwargs,
+        format_kwarg=None,
+        request=request,
+        headers={},
+    )
+    (
+        request.accepted_renderer,
+        request.accepted_media_type,
+    ) = view.perform_content_negotiation(request)
+    return view
+
+
+def warm_list(pages):
+    """Fill the first ``pages`` list pages, returns how many are cached."""
+    query, warmed = "", 0
+    for _ in range(pages):
+        view = make_view("list", query)
+        value = caching.warm(
+            caching.LIST_NAMESPACE,
+            view.request.query_params,
+            lambda: view.render_list(view.request),
+        )
+        if value is None:
+            break
+        warmed += 1
+        next_link = json.loads(value["body"])["next"]
+        if not next_link:
+            break
+        query = urlsplit(next_link).query
+    return warmed
+
+
+def warm_details(pks):
+    """Fill the details of the posts in ``pks`` that still exist."""
+    warmed = 0
+    for pk in pks:
+        view = make_view("retrieve", pk=str(pk))
+        try:
+            value = caching.warm(
+                caching.detail_namespace(pk),
+                view.request.query_params,
+                lambda: view.render_detail(view.request),
+            )
+        except Http404:
+            continue
+        warmed += value is not None
+    return warmed
+
+
+def popular_or_recent(count):
+    # the ranking is lost along with the rest of the cache on a flush
+    return caching.popular_posts(count) or list(
+        Post.objects.order_by("-created_at", "-id").values_list("id", flat=True)[:count]
+    )
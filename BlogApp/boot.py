@@ -0,0 +1,106 @@
+"""
+Container startup steps.
+
+``migrate`` and ``collectstatic`` only run when there is something for them to
+do: pending migrations are found by comparing the migration graph on disk with
+the ``django_migrations`` table, and static files are collected only when the
+fingerprint of the sources differs from the one written next to the last
+collection. Both run in the calling process, which is expected to go on to
+serve the application, so nothing is imported twice.
+"""
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import call_command
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+
+from BlogApp.db.postgresql_pool.base import close_pools
+
+STATIC_FINGERPRINT_FILE = ".fingerprint"
+
+# the patterns collectstatic ignores by default
+STATIC_IGNORE_PATTERNS = ["CVS", ".*", "*~"]
+
+
+class BootTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        phase = {"name": name}
+        try:
+            yield phase
+        finally:
+            self.phases.append((phase["name"], time.perf_counter() - started))
+
+    def report(self):
+        lines = [f"{name}: {duration * 1000:.1f}ms" for name, duration in self.phases]
+        lines.append(f"total: {(time.perf_counter() - self.started) * 1000:.1f}ms")
+        return "boot phases: " + ", ".join(lines)
+
+
+def pending_migrations(database="default"):
+    executor = MigrationExecutor(connections[database])
+    return executor.migration_plan(executor.loader.graph.leaf_nodes())
+
+
+def migrate(database="default"):
+    """Apply pending migrations, returns whether there were any."""
+    if not pending_migrations(database):
+        return False
+    call_command("migrate", database=database, interactive=False, skip_checks=True)
+    return True
+
+
+def static_fingerprint():
+    # paths, sizes and modification times of every file collectstatic would
+    # copy; cheap enough to compute on each start without reading the files
+    digest = hashlib.sha256()
+    entries = []
+    for finder in get_finders():
+        for path, storage in finder.list(STATIC_IGNORE_PATTERNS):
+            prefix = getattr(storage, "prefix", None) or ""
+            stat = os.stat(storage.path(path))
+            entries.append(f"{prefix}/{path}:{stat.st_size}:{stat.st_mtime_ns}")
+    for entry in sorted(entries):
+        digest.update(entry.encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def collect_static():
+    """Collect static files if the sources changed, returns whether it did."""
+    fingerprint = static_fingerprint()
+    path = os.path.join(settings.STATIC_ROOT, STATIC_FINGERPRINT_FILE)
+    try:
+        with open(path) as file:
+            if file.read().strip() == fingerprint:
+                return False
+    except FileNotFoundError:
+        pass
+
+    call_command("collectstatic", interactive=False, verbosity=0, skip_checks=True)
+    os.makedirs(settings.STATIC_ROOT, exist_ok=True)
+    with open(path, "w") as file:
+        file.write(fingerprint)
+    return True
+
+
+def run_setup(timer):
+    with timer.phase("migrate") as phase:
+        if not migrate():
+            phase["name"] += " (skipped)"
+    with timer.phase("collectstatic") as phase:
+        if not collect_static():
+            phase["name"] += " (skipped)"
+    # the serving process forks its workers next, they must not share sockets
+    connections.close_all()
+    close_pools()
@@ -1,9 +1,17 @@
 import os
 
 from celery import Celery
+from celery.signals import worker_ready
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "BlogApp.settings")
 app = Celery("blog")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 
 app.autodiscover_tasks()
+
+
+@worker_ready.connect
+def warm_posts_cache(sender, **kwargs):
+    # a deploy restarts the workers, the cache is warmed before the first
+    # scheduled run
+    sender.app.send_task("BlogApp.blog.tasks.warm_popular_posts")
@@ -0,0 +1,85 @@
+"""
+The postgresql backend with connections borrowed from a per-process pool.
+
+Closing a connection, which Django does at the end of every request with the
+default ``CONN_MAX_AGE`` of 0, gives it back to the pool instead, so requests
+skip the connection setup. Pool options are read from the ``POOL`` entry of the
+database settings.
+"""
+import threading
+
+from django.db.backends.postgresql import base
+from django.db.backends.base.base import NO_DB_ALIAS
+
+from .creation import DatabaseCreation
+from .pool import ConnectionPool
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, conn_params, options):
+    key = (
+        alias,
+        tuple(sorted((name, str(value)) for name, value in conn_params.items())),
+    )
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(
+                min_size=options.get("MIN_SIZE", 1),
+                max_size=options.get("MAX_SIZE", 10),
+                timeout=options.get("TIMEOUT", 10.0),
+                max_lifetime=options.get("MAX_LIFETIME", 3600.0),
+                max_idle=options.get("MAX_IDLE", 600.0),
+                check_after=options.get("CHECK_AFTER", 30.0),
+            )
+        return pool
+
+
+def close_pools(database=None):
+    """Close and forget the pools, or only those connected to ``database``."""
+    with _pools_lock:
+        keys = [
+            key for key in _pools if database is None or ("dbname", database) in key[1]
+        ]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.close()
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {
+        f"{alias}:{dict(params).get('dbname')}": pool.stats()
+        for (alias, params), pool in pools
+    }
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    pool = None
+
+    def get_new_connection(self, conn_params):
+        # the connections django opens to create and drop databases are not
+        # worth keeping
+        if self.alias == NO_DB_ALIAS:
+            return super().get_new_connection(conn_params)
+        self.pool = get_pool(
+            self.alias, conn_params, self.settings_dict.get("POOL", {})
+        )
+        return self.pool.getconn(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+        )
+
+    def _close(self):
+        if self.connection is None or self.pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            if self.in_atomic_block:
+                # django keeps the object until the block is rolled back, it
+                # must not be handed to anybody else before that
+                return self.pool.discard(self.connection)
+            return self.pool.putconn(self.connection)
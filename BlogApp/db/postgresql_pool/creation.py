@@ -0,0 +1,12 @@
+from django.db.backends.postgresql.creation import (
+    DatabaseCreation as PostgresDatabaseCreation,
+)
+
+
+class DatabaseCreation(PostgresDatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        from .base import close_pools
+
+        # postgres refuses to drop a database with open sessions
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
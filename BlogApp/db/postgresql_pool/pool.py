@@ -0,0 +1,205 @@
+"""
+A thread-safe pool of psycopg2 connections.
+
+Connections are handed out most recently used first and checked before being
+reused: one that is closed or past ``max_lifetime`` is replaced, and one that
+sat idle for longer than ``check_after`` seconds is pinged first. Idle
+connections above ``min_size`` are closed after ``max_idle`` seconds.
+
+A forked child starts with an empty pool. The connections it inherited are
+kept referenced but never used or closed, since closing them would terminate
+the sessions the parent is still using.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        min_size=1,
+        max_size=10,
+        timeout=10.0,
+        max_lifetime=3600.0,
+        max_idle=600.0,
+        check_after=30.0,
+    ):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_after = check_after
+
+        self._inherited = []
+        self._reset()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _reset(self):
+        self._closed = False
+        self._condition = threading.Condition()
+        # (connection, returned at) of the connections waiting to be reused
+        self._idle = deque()
+        # every connection owned by the pool and its opening time, by id;
+        # holding them also keeps their ids from being reused
+        self._opened = {}
+        self._size = 0
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.failed_checks = 0
+
+    def _after_fork(self):
+        self._inherited.extend(connection for connection, _ in self._opened.values())
+        self._reset()
+
+    def getconn(self, connect):
+        """
+        Check a connection out, opening one with ``connect`` if none is idle
+        and the pool is not full. Waits up to ``timeout`` seconds otherwise.
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            connection = None
+            with self._condition:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(
+                            f"no database connection available after {self.timeout}s"
+                        )
+                    self._condition.wait(remaining)
+                if self._idle:
+                    connection, returned = self._idle.pop()
+                else:
+                    # reserve the slot before connecting outside the lock
+                    self._size += 1
+
+            if connection is None:
+                try:
+                    connection = connect()
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+                with self._condition:
+                    self._opened[id(connection)] = (connection, time.monotonic())
+                    self.connections_opened += 1
+            elif not self._healthy(connection, returned):
+                self.failed_checks += 1
+                self.discard(connection)
+                continue
+
+            with self._condition:
+                waited = time.monotonic() - started
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            return connection
+
+    def _healthy(self, connection, returned):
+        if connection.closed:
+            return False
+        now = time.monotonic()
+        _, opened = self._opened.get(id(connection), (connection, now))
+        if now - opened > self.max_lifetime:
+            return False
+        if now - returned > self.check_after:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def putconn(self, connection):
+        """Give a connection back, rolling back whatever it left open."""
+        if id(connection) not in self._opened:
+            # checked out before a fork, it belongs to the parent
+            self._inherited.append(connection)
+            return
+        if not connection.closed:
+            try:
+                if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except psycopg2.Error:
+                pass
+        if connection.closed or self._closed:
+            self.discard(connection)
+            return
+
+        expired = []
+        with self._condition:
+            now = time.monotonic()
+            self._idle.append((connection, now))
+            # the least recently used connections are at the left
+            while (
+                len(self._idle) > 1
+                and self._size - len(expired) > self.min_size
+                and now - self._idle[0][1] > self.max_idle
+            ):
+                expired.append(self._idle.popleft()[0])
+            self._condition.notify()
+        for connection in expired:
+            self.discard(connection)
+
+    def discard(self, connection):
+        """Close a connection checked out from the pool and free its slot."""
+        with self._condition:
+            if self._opened.pop(id(connection), None) is None:
+                return
+            self._size -= 1
+            self.connections_closed += 1
+            self._condition.notify()
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def close(self):
+        """Close the idle connections, the ones in use are closed on return."""
+        with self._condition:
+            self._closed = True
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+        for connection in idle:
+            self.discard(connection)
+
+    def stats(self):
+        with self._condition:
+            now = time.monotonic()
+            ages = [now - opened for _, opened in self._opened.values()]
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "checkouts": self.checkouts,
+                "wait_total": self.wait_total,
+                "wait_max": self.wait_max,
+                "wait_avg": self.wait_total / self.checkouts if self.checkouts else 0.0,
+                "timeouts": self.timeouts,
+                "connections_opened": self.connections_opened,
+                "connections_closed": self.connections_closed,
+                "failed_checks": self.failed_checks,
+                "connection_age_max": max(ages, default=0.0),
+                "connection_age_avg": sum(ages) / len(ages) if ages else 0.0,
+            }
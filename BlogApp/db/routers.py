@@ -0,0 +1,237 @@
+"""
+Read replica routing.
+
+Reads of the models in ``DATABASE_REPLICA_APPS`` go to one of the aliases in
+``DATABASE_REPLICAS`` and everything else to the primary. A read stays on the
+primary when
+
+- it runs in a transaction, or in a ``use_primary()`` block,
+- the request it belongs to has written, or is not a safe method,
+- the client wrote less than ``DATABASE_REPLICA_PIN_SECONDS`` ago: responses
+  to writes set a cookie and an ``X-Pin-Primary-Until`` header with the end
+  of that window, clients without cookies send the header back,
+- no replica is healthy.
+
+Every process checks the replicas every ``DATABASE_REPLICA_CHECK_INTERVAL``
+seconds and leaves out those it cannot query or that replay the primary more
+than ``DATABASE_REPLICA_MAX_LAG`` seconds behind.
+"""
+import logging
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = "default"
+PIN_COOKIE = "pin_primary"
+PIN_HEADER = "X-Pin-Primary-Until"
+RECENT_WRITE_KEY = "db:recent_write"
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# seconds the replica has yet to replay, 0 when it has everything it received
+LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery()
+        OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+_primary = ContextVar("db_use_primary", default=False)
+_request = ContextVar("db_request_state", default=None)
+
+
+class RequestState:
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+
+
+@contextmanager
+def use_primary():
+    token = _primary.set(True)
+    try:
+        yield
+    finally:
+        _primary.reset(token)
+
+
+def pinned():
+    if _primary.get():
+        return True
+    state = _request.get()
+    return state is not None and (state.pinned or state.wrote)
+
+
+def replica_lag(alias):
+    with connections[alias].cursor() as cursor:
+        cursor.execute(LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+class ReplicaHealth:
+    """The replicas of this process that answer and keep up."""
+
+    def __init__(self):
+        self.healthy = set()
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def available(self):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas:
+            return []
+        due = (
+            self.checked_at is None
+            or time.monotonic() - self.checked_at
+            >= settings.DATABASE_REPLICA_CHECK_INTERVAL
+        )
+        # one thread checks, the others keep the last result meanwhile
+        if due and self.lock.acquire(blocking=False):
+            try:
+                self.check(replicas)
+            finally:
+                self.lock.release()
+        return [alias for alias in replicas if alias in self.healthy]
+
+    def check(self, replicas):
+        healthy = set()
+        for alias in replicas:
+            try:
+                lag = replica_lag(alias)
+            except DatabaseError:
+                logger.warning("replica %s is unavailable", alias, exc_info=True)
+                continue
+            if lag > settings.DATABASE_REPLICA_MAX_LAG:
+                logger.warning("replica %s is %.1f seconds behind", alias, lag)
+                continue
+            healthy.add(alias)
+        self.healthy = healthy
+        self.checked_at = time.monotonic()
+
+    def reset(self):
+        self.healthy = set()
+        self.checked_at = None
+
+
+health = ReplicaHealth()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in settings.DATABASE_REPLICA_APPS:
+            return None
+        if pinned() or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        replicas = health.available()
+        return random.choice(replicas) if replicas else PRIMARY
+
+    def db_for_write(self, model, **hints):
+        state = _request.get()
+        if state is not None:
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = {PRIMARY, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+def record_write():
+    """Note that the replicas may be missing a write for a while."""
+    if settings.DATABASE_REPLICAS:
+        cache.set(RECENT_WRITE_KEY, 1, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+@contextmanager
+def primary_after_writes():
+    """
+    Read from the primary in the block if there was a write in the last
+    ``DATABASE_REPLICA_PIN_SECONDS``, so what is built from the reads, such as
+    a cache entry, never misses it.
+    """
+    if settings.DATABASE_REPLICAS and cache.get(RECENT_WRITE_KEY):
+        with use_primary():
+            yield
+    else:
+        yield
+
+
+async def arecent_write():
+    return bool(settings.DATABASE_REPLICAS and await cache.aget(RECENT_WRITE_KEY))
+
+
+def pinned_until(request):
+    value = request.COOKIES.get(PIN_COOKIE) or request.headers.get(PIN_HEADER)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class ReplicaPinningMiddleware:
+    """Keep a client's reads on the primary for a while after it writes."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = self.state(request)
+        token = _request.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        return self.pin(state, response)
+
+    async def __acall__(self, request):
+        state = self.state(request)
+        token = _request.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request.reset(token)
+        return self.pin(state, response)
+
+    @staticmethod
+    def state(request):
+        return RequestState(
+            request.method not in SAFE_METHODS or pinned_until(request) > time.time()
+        )
+
+    @staticmethod
+    def pin(state, response):
+        if state.wrote:
+            window = settings.DATABASE_REPLICA_PIN_SECONDS
+            until = str(math.ceil(time.time() + window))
+            response.set_cookie(
+                PIN_COOKIE, until, max_age=window, httponly=True, samesite="Lax"
+            )
+            response[PIN_HEADER] = until
+        return response
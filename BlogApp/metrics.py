@@ -0,0 +1,315 @@
+"""
+Per-request timings, emitted as a ``Server-Timing`` header and aggregated in
+redis for a Prometheus scrape of ``/metrics``.
+
+``MetricsMiddleware`` opens a ``RequestMetrics`` for every request in a
+context variable. The database wrapper, the redis client and the code timed
+with ``timer`` add to it while the request runs; nothing is recorded outside
+of a request. When the response leaves, its timings and the request latency
+are added to a redis hash in a single round trip, labelled with the name of
+the route that served it, so every process reports into the same histograms.
+"""
+import logging
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django_redis import get_redis_connection
+from redis import Redis
+from redis.client import Pipeline
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = "metrics"
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.counts = Counter()
+        self.cache = Counter()
+
+    def add(self, name, seconds):
+        self.durations[name] += seconds
+        self.counts[name] += 1
+
+    def server_timing(self, total):
+        entries = []
+        for name, seconds in self.durations.items():
+            entry = f"{name};dur={seconds * 1000:.1f}"
+            if name in ("sql", "redis"):
+                entry += f';desc="{self.counts[name]} calls"'
+            entries.append(entry)
+        for family in sorted({family for family, _ in self.cache}):
+            hits, misses = self.cache[family, "hit"], self.cache[family, "miss"]
+            name = "cache-" + family.replace(":", "-")
+            entries.append(f'{name};desc="{hits} hit / {misses} miss"')
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def timer(name):
+    """Add the time spent in the block to the current request as ``name``."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(name, time.perf_counter() - started)
+
+
+def record_cache(family, hit):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cache[family, "hit" if hit else "miss"] += 1
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    with timer("sql"):
+        return execute(sql, params, many, context)
+
+
+def install_sql_wrapper(sender, connection, **kwargs):
+    # wrappers live on the DatabaseWrapper, which outlives its connections
+    if sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_wrapper)
+
+
+connection_created.connect(install_sql_wrapper)
+
+
+class InstrumentedPipeline(Pipeline):
+    def execute(self, *args, **kwargs):
+        with timer("redis"):
+            return super().execute(*args, **kwargs)
+
+
+class InstrumentedRedis(Redis):
+    """The redis client of the cache, timing every command and pipeline."""
+
+    def execute_command(self, *args, **options):
+        with timer("redis"):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+def route_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    # the fields of the aggregates are separated by pipes
+    return (match.view_name or match.route).replace("|", "/")
+
+
+def bucket(seconds):
+    for bound in BUCKETS:
+        if seconds <= bound:
+            return str(bound)
+    return "+Inf"
+
+
+def record(route, method, status, seconds, metrics):
+    """Add a finished request to the shared aggregates."""
+    pipeline = get_redis_connection("default").pipeline(transaction=False)
+    key = cache.make_key(METRICS_KEY)
+    # buckets are stored as they are hit and summed up when scraped
+    pipeline.hincrby(key, f"bucket|{method}|{route}|{bucket(seconds)}", 1)
+    pipeline.hincrbyfloat(key, f"sum|{method}|{route}", seconds)
+    pipeline.hincrby(key, f"requests|{method}|{route}|{status}", 1)
+    for name, spent in metrics.durations.items():
+        pipeline.hincrbyfloat(key, f"phase|{route}|{name}", spent)
+    if metrics.counts["sql"]:
+        pipeline.hincrby(key, f"queries|{route}", metrics.counts["sql"])
+    for (family, result), count in metrics.cache.items():
+        pipeline.hincrby(key, f"cache|{family}|{result}", count)
+    pipeline.execute()
+
+
+class MetricsMiddleware:
+    """
+    Time every request, add a ``Server-Timing`` header to its response and
+    record it for ``/metrics``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        metrics, started = RequestMetrics(), time.perf_counter()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        metrics, started = RequestMetrics(), time.perf_counter()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        await sync_to_async(self.finish, thread_sensitive=False)(
+            request, response, metrics, time.perf_counter() - started
+        )
+        return response
+
+    @staticmethod
+    def finish(request, response, metrics, seconds):
+        if settings.METRICS_SERVER_TIMING:
+            response["Server-Timing"] = metrics.server_timing(seconds)
+        route = route_name(request)
+        if route == "metrics":
+            return
+        try:
+            record(route, request.method, response.status_code, seconds, metrics)
+        except RedisError:
+            # losing a sample is better than failing the request
+            logger.warning("could not record the request metrics", exc_info=True)
+
+
+def label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def labels(**values):
+    return "{" + ",".join(f'{name}="{label(v)}"' for name, v in values.items()) + "}"
+
+
+def exposition(fields):
+    """The Prometheus text format of the aggregates in ``fields``."""
+    buckets, sums, requests = defaultdict(Counter), {}, {}
+    phases, queries, caches = {}, {}, {}
+    for field, value in fields.items():
+        kind, *parts = field.split("|")
+        if kind == "bucket":
+            method, route, bound = parts
+            buckets[method, route][bound] += int(value)
+        elif kind == "sum":
+            sums[tuple(parts)] = float(value)
+        elif kind == "requests":
+            requests[tuple(parts)] = int(value)
+        elif kind == "phase":
+            phases[tuple(parts)] = float(value)
+        elif kind == "queries":
+            queries[parts[0]] = int(value)
+        elif kind == "cache":
+            caches[tuple(parts)] = int(value)
+
+    lines = [
+        "# HELP http_request_duration_seconds Request latency by route.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (method, route), counts in sorted(buckets.items()):
+        total = 0
+        for bound in (*map(str, BUCKETS), "+Inf"):
+            total += counts[bound]
+            lines.append(
+                "http_request_duration_seconds_bucket"
+                f"{labels(method=method, route=route, le=bound)} {total}"
+            )
+        lines.append(
+            "http_request_duration_seconds_sum"
+            f"{labels(method=method, route=route)} {sums.get((method, route), 0.0)}"
+        )
+        lines.append(
+            "http_request_duration_seconds_count"
+            f"{labels(method=method, route=route)} {total}"
+        )
+
+    lines += [
+        "# HELP http_requests_total Requests by route and status.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (method, route, status), count in sorted(requests.items()):
+        lines.append(
+            f"http_requests_total{labels(method=method, route=route, status=status)}"
+            f" {count}"
+        )
+
+    lines += [
+        "# HELP request_phase_seconds_total Time spent in each phase by route.",
+        "# TYPE request_phase_seconds_total counter",
+    ]
+    for (route, phase), seconds in sorted(phases.items()):
+        lines.append(
+            f"request_phase_seconds_total{labels(route=route, phase=phase)} {seconds}"
+        )
+
+    lines += [
+        "# HELP db_queries_total SQL queries by route.",
+        "# TYPE db_queries_total counter",
+    ]
+    for route, count in sorted(queries.items()):
+        lines.append(f"db_queries_total{labels(route=route)} {count}")
+
+    lines += [
+        "# HELP cache_requests_total Cache reads by key family and result.",
+        "# TYPE cache_requests_total counter",
+    ]
+    for (family, result), count in sorted(caches.items()):
+        lines.append(
+            f"cache_requests_total{labels(family=family, result=result)} {count}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if not token:
+        # without a token the figures are only served when asked for
+        if not settings.METRICS_PUBLIC:
+            return HttpResponseForbidden()
+    elif not constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return HttpResponseForbidden()
+
+    fields = get_redis_connection("default").hgetall(cache.make_key(METRICS_KEY))
+    body = exposition({key.decode(): value for key, value in fields.items()})
+    return HttpResponse(body, content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def reset():
+    cache.delete(METRICS_KEY)
@@ -31,10 +31,21 @@ ALLOWED_HOSTS = ["*"]
 # Celery settings
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379")
+CELERY_BEAT_SCHEDULE = {
+    # also rebuilds the cache after a redis flush
+    "warm-popular-posts": {
+        "task": "BlogApp.blog.tasks.warm_popular_posts",
+        "schedule": int(os.getenv("POSTS_CACHE_WARM_INTERVAL", 300)),
+    },
+    "flush-view-counts": {
+        "task": "BlogApp.blog.tasks.flush_view_counts",
+        "schedule": int(os.getenv("POSTS_VIEWS_FLUSH_INTERVAL", 60)),
+    },
+}
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "BlogApp.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticated",
@@ -42,6 +53,9 @@ REST_FRAMEWORK = {
     ),
 }
 
+# seconds a user and their resolved permissions are cached for
+AUTH_USER_CACHE_TTL = int(os.getenv("AUTH_USER_CACHE_TTL", 300))
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -51,11 +65,18 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "BlogApp.blog",
 ]
 
 MIDDLEWARE = [
+    # first, so its timings cover the rest of the stack
+    "BlogApp.metrics.MetricsMiddleware",
+    # right after the metrics, so shed requests are counted but cost little
+    "BlogApp.throttling.AdmissionMiddleware",
+    "BlogApp.throttling.RateLimitMiddleware",
+    "BlogApp.db.routers.ReplicaPinningMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -90,24 +111,154 @@ WSGI_APPLICATION = "BlogApp.wsgi.application"
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        # the pooled backend keeps connections open across requests
+        "ENGINE": "BlogApp.db.postgresql_pool"
+        if os.getenv("PG_POOL") == "1"
+        else "django.db.backends.postgresql",
         "NAME": os.getenv("PG_NAME", "blog"),
         "USER": os.getenv("PG_USERNAME", "postgres"),
         "PASSWORD": os.getenv("PG_PASSWORD", "postgres"),
         "HOST": os.getenv("PG_HOST", "db"),
         "PORT": os.getenv("PG_PORT", "5432"),
+        "POOL": {
+            "MIN_SIZE": int(os.getenv("PG_POOL_MIN_SIZE", 1)),
+            "MAX_SIZE": int(os.getenv("PG_POOL_MAX_SIZE", 10)),
+            # seconds to wait for a free connection
+            "TIMEOUT": float(os.getenv("PG_POOL_TIMEOUT", 10)),
+            "MAX_LIFETIME": float(os.getenv("PG_POOL_MAX_LIFETIME", 3600)),
+            "MAX_IDLE": float(os.getenv("PG_POOL_MAX_IDLE", 600)),
+            # ping connections idle for longer than this before reusing them
+            "CHECK_AFTER": float(os.getenv("PG_POOL_CHECK_AFTER", 30)),
+        },
     }
 }
 
+# read replicas of the default database, e.g. PG_REPLICAS=replica1,replica2:5433
+DATABASE_REPLICAS = []
+for index, address in enumerate(filter(None, os.getenv("PG_REPLICAS", "").split(","))):
+    host, _, port = address.strip().partition(":")
+    alias = f"replica_{index + 1}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        # an unreachable replica is left out of rotation instead of hanging
+        "OPTIONS": {"connect_timeout": int(os.getenv("PG_REPLICA_CONNECT_TIMEOUT", 2))},
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["BlogApp.db.routers.ReplicaRouter"]
+# the apps whose reads may go to the replicas
+DATABASE_REPLICA_APPS = ("blog",)
+# seconds a client reads from the primary after writing
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv("PG_REPLICA_PIN_SECONDS", 5))
+DATABASE_REPLICA_MAX_LAG = float(os.getenv("PG_REPLICA_MAX_LAG", 2))
+DATABASE_REPLICA_CHECK_INTERVAL = float(os.getenv("PG_REPLICA_CHECK_INTERVAL", 5))
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
         "LOCATION": os.getenv("REDIS_ADDRESS", "redis://redis:6379"),
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # times the commands of a request for its metrics
+            "REDIS_CLIENT_CLASS": "BlogApp.metrics.InstrumentedRedis",
         },
     }
 }
+
+# Posts cache settings
+POSTS_CACHE_TTL = int(os.getenv("POSTS_CACHE_TTL", 300))
+POSTS_CACHE_GENERATION_TTL = int(os.getenv("POSTS_CACHE_GENERATION_TTL", 86400))
+POSTS_CACHE_GRACE = int(os.getenv("POSTS_CACHE_GRACE", 30))
+POSTS_CACHE_LOCK_TIMEOUT = int(os.getenv("POSTS_CACHE_LOCK_TIMEOUT", 10))
+POSTS_CACHE_LOCK_WAIT = float(os.getenv("POSTS_CACHE_LOCK_WAIT", 2))
+POSTS_CACHE_EARLY_REFRESH_BETA = float(os.getenv("POSTS_CACHE_EARLY_REFRESH_BETA", 1))
+POSTS_LOCAL_CACHE = True if os.getenv("POSTS_LOCAL_CACHE") == "1" else False
+POSTS_LOCAL_CACHE_TTL = float(os.getenv("POSTS_LOCAL_CACHE_TTL", 5))
+POSTS_LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("POSTS_LOCAL_CACHE_MAX_ENTRIES", 1024))
+# rebuild the entries dropped by an invalidation in the background
+POSTS_CACHE_WARM = True if os.getenv("POSTS_CACHE_WARM", "1") == "1" else False
+POSTS_CACHE_WARM_DEBOUNCE = int(os.getenv("POSTS_CACHE_WARM_DEBOUNCE", 1))
+POSTS_CACHE_WARM_PAGES = int(os.getenv("POSTS_CACHE_WARM_PAGES", 3))
+POSTS_CACHE_WARM_BATCH_SIZE = int(os.getenv("POSTS_CACHE_WARM_BATCH_SIZE", 100))
+POSTS_CACHE_WARM_TOP_K = int(os.getenv("POSTS_CACHE_WARM_TOP_K", 100))
+# share of detail requests counted towards the popular posts ranking
+POSTS_POPULAR_SAMPLE_RATE = float(os.getenv("POSTS_POPULAR_SAMPLE_RATE", 0.1))
+# weight kept by the past requests after each warming run
+POSTS_POPULAR_DECAY = float(os.getenv("POSTS_POPULAR_DECAY", 0.5))
+POSTS_POPULAR_MAX_TRACKED = int(os.getenv("POSTS_POPULAR_MAX_TRACKED", 10000))
+# posts kept in the most viewed ranking
+POSTS_VIEWS_MAX_RANKED = int(os.getenv("POSTS_VIEWS_MAX_RANKED", 10000))
+POSTS_VIEWS_FLUSH_LOCK_TIMEOUT = int(os.getenv("POSTS_VIEWS_FLUSH_LOCK_TIMEOUT", 300))
+POSTS_MOST_VIEWED_MAX_LIMIT = int(os.getenv("POSTS_MOST_VIEWED_MAX_LIMIT", 100))
+
+# cached bodies from this size on are also stored gzip and brotli encoded
+POSTS_COMPRESS_MIN_SIZE = int(os.getenv("POSTS_COMPRESS_MIN_SIZE", 1024))
+POSTS_GZIP_LEVEL = int(os.getenv("POSTS_GZIP_LEVEL", 6))
+POSTS_BROTLI_QUALITY = int(os.getenv("POSTS_BROTLI_QUALITY", 5))
+
+# Posts API settings
+POSTS_BULK_MAX_SIZE = int(os.getenv("POSTS_BULK_MAX_SIZE", 1000))
+POSTS_SEARCH_CONFIG = os.getenv("POSTS_SEARCH_CONFIG", "english")
+# capped at the 300 characters of the excerpt column
+POSTS_EXCERPT_LENGTH = int(os.getenv("POSTS_EXCERPT_LENGTH", 200))
+POSTS_WORDS_PER_MINUTE = int(os.getenv("POSTS_WORDS_PER_MINUTE", 200))
+# seconds a write waits for others to be rendered in the same batch
+POSTS_RENDER_DEBOUNCE = int(os.getenv("POSTS_RENDER_DEBOUNCE", 2))
+POSTS_RENDER_BATCH_SIZE = int(os.getenv("POSTS_RENDER_BATCH_SIZE", 100))
+# shared by the web processes and the celery workers
+POSTS_IMPORT_DIR = os.getenv("POSTS_IMPORT_DIR", BASE_DIR / "imports")
+POSTS_IMPORT_CHUNK_SIZE = int(os.getenv("POSTS_IMPORT_CHUNK_SIZE", 1000))
+# serialize list and detail pages straight from database rows
+POSTS_FAST_SERIALIZATION = os.getenv("POSTS_FAST_SERIALIZATION") == "1"
+# rows fetched from the server-side cursor at a time
+POSTS_EXPORT_CHUNK_SIZE = int(os.getenv("POSTS_EXPORT_CHUNK_SIZE", 2000))
+# the admin counts the posts exactly below this estimate
+POSTS_ADMIN_EXACT_COUNT_LIMIT = int(os.getenv("POSTS_ADMIN_EXACT_COUNT_LIMIT", 10000))
+# posts per celery task queued by the admin bulk actions
+POSTS_ADMIN_ACTION_CHUNK_SIZE = int(os.getenv("POSTS_ADMIN_ACTION_CHUNK_SIZE", 1000))
+
+# Request metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# adds the timings of each request to its response
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "1") == "1"
+# /metrics requires "Authorization: Bearer <token>", and is closed without a
+# token unless METRICS_PUBLIC=1
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC") == "1"
+
+# Rate limits and admission control
+RATE_LIMITS_ENABLED = os.getenv("RATE_LIMITS_ENABLED") == "1"
+# token buckets per route group and client, "10/min" holds 10 tokens refilled
+# at 10 a minute
+RATE_LIMITS = {
+    # every attempt hashes a password
+    "token": {"ip": os.getenv("RATE_LIMIT_TOKEN_IP", "10/min")},
+    "refresh": {"ip": os.getenv("RATE_LIMIT_REFRESH_IP", "60/min")},
+    "posts": {
+        "user": os.getenv("RATE_LIMIT_POSTS_USER", "20/s"),
+        "ip": os.getenv("RATE_LIMIT_POSTS_IP", "50/s"),
+    },
+}
+# the group of each url name, names ending with a dash match as prefixes
+RATE_LIMIT_ROUTES = {
+    "token_obtain_pair": "token",
+    "token_refresh": "refresh",
+    "posts-": "posts",
+    "async-posts-": "posts",
+}
+# only set it to a header the proxy in front always overwrites
+RATE_LIMIT_CLIENT_IP_HEADER = os.getenv("RATE_LIMIT_CLIENT_IP_HEADER", "")
+# requests running at once across all the workers, 0 for no limit
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", 0))
+# seconds a request may have waited in front of the workers, 0 for no limit
+ADMISSION_MAX_QUEUE_DELAY = float(os.getenv("ADMISSION_MAX_QUEUE_DELAY", 0))
+# a running request frees its slot after this long even if its worker died
+ADMISSION_REQUEST_TIMEOUT = int(os.getenv("ADMISSION_REQUEST_TIMEOUT", 60))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 1))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
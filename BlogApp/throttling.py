@@ -0,0 +1,303 @@
+"""
+Admission control and per-client rate limits, shared by every process through
+redis.
+
+``AdmissionMiddleware`` sheds a request with a 503 before it runs when
+
+- it already waited longer than ``ADMISSION_MAX_QUEUE_DELAY`` seconds in front
+  of the workers, going by the ``X-Request-Start`` header set by nginx, or
+- ``ADMISSION_MAX_CONCURRENCY`` requests are running across all the workers.
+  The running requests are kept in a sorted set used as a semaphore; entries
+  older than ``ADMISSION_REQUEST_TIMEOUT`` seconds are dropped, so a killed
+  worker does not hold its slot.
+
+``RateLimitMiddleware`` answers 429 when the client has no token left in the
+buckets of the route's group in ``RATE_LIMITS``, one per user and one per
+address. Rates read like DRF's: "10/min" is a bucket of 10 tokens refilled at
+10 a minute. A Lua script refills and takes from all the buckets of a request
+at once, so concurrent requests never share the last token.
+
+Both set ``Retry-After`` and let requests through when redis is unreachable.
+"""
+import logging
+import math
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+logger = logging.getLogger(__name__)
+
+RUNNING_KEY = "admission:running"
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# KEYS are the buckets, ARGV their rate and capacity in pairs. Returns the
+# seconds to wait for a token in every bucket, 0 when they were taken.
+TAKE_TOKENS = """
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local levels, wait = {}, 0
+for i, key in ipairs(KEYS) do
+    local rate, capacity = tonumber(ARGV[i * 2 - 1]), tonumber(ARGV[i * 2])
+    local state = redis.call("HMGET", key, "tokens", "at")
+    local tokens = tonumber(state[1]) or capacity
+    local at = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - at) * rate)
+    levels[i] = tokens
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate, capacity = tonumber(ARGV[i * 2 - 1]), tonumber(ARGV[i * 2])
+    redis.call("HSET", key, "tokens", tostring(levels[i] - 1), "at", tostring(now))
+    redis.call("PEXPIRE", key, math.ceil(capacity / rate * 1000))
+end
+return "0"
+"""
+
+# KEYS[1] is the set of running requests, ARGV the id of this one, the limit
+# and the timeout. Returns 1 when the request was admitted.
+ACQUIRE = """
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local timeout = tonumber(ARGV[3])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now - timeout)
+if redis.call("ZCARD", KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call("ZADD", KEYS[1], now, ARGV[1])
+redis.call("EXPIRE", KEYS[1], math.ceil(timeout))
+return 1
+"""
+
+_scripts = {}
+
+
+def script(source):
+    if source not in _scripts:
+        _scripts[source] = get_redis_connection("default").register_script(source)
+    return _scripts[source]
+
+
+def parse_rate(rate):
+    """Parse a rate like "10/min" into (tokens per second, capacity)."""
+    count, _, period = rate.partition("/")
+    count = int(count)
+    return count / PERIODS[period.strip()[0]], count
+
+
+def route_group(view_name):
+    for name, group in settings.RATE_LIMIT_ROUTES.items():
+        if view_name == name or (name.endswith("-") and view_name.startswith(name)):
+            return group
+    return None
+
+
+def client_ip(request):
+    header = settings.RATE_LIMIT_CLIENT_IP_HEADER
+    if header:
+        value = request.headers.get(header)
+        if value:
+            return value.split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def user_id(request):
+    """The user of a valid access token in the request, if any."""
+    authorization = request.headers.get("Authorization", "").split()
+    if (
+        len(authorization) != 2
+        or authorization[0] not in api_settings.AUTH_HEADER_TYPES
+    ):
+        return None
+    try:
+        return AccessToken(authorization[1]).get(api_settings.USER_ID_CLAIM)
+    except TokenError:
+        return None
+
+
+def take_tokens(group, request):
+    """Seconds the client has to wait for the route group, 0 if it may go."""
+    keys, args = [], []
+    for scope, rate in settings.RATE_LIMITS.get(group, {}).items():
+        ident = user_id(request) if scope == "user" else client_ip(request)
+        if ident is None:
+            continue
+        keys.append(cache.make_key(f"ratelimit:{group}:{scope}:{ident}"))
+        args += parse_rate(rate)
+    if not keys:
+        return 0.0
+    return float(script(TAKE_TOKENS)(keys=keys, args=args))
+
+
+def retry_after(response, seconds):
+    response["Retry-After"] = str(max(1, math.ceil(seconds)))
+    return response
+
+
+def throttled(wait):
+    seconds = max(1, math.ceil(wait))
+    detail = f"Request was throttled. Expected available in {seconds} seconds."
+    return retry_after(JsonResponse({"detail": detail}, status=429), seconds)
+
+
+def overloaded():
+    return retry_after(
+        JsonResponse(
+            {"detail": "The server is overloaded, try again later."}, status=503
+        ),
+        settings.ADMISSION_RETRY_AFTER,
+    )
+
+
+class RateLimitMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # keeps the redis round trip off the thread the sync code runs on
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        return self.check(request)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.RATE_LIMITS_ENABLED:
+            return None
+        return await sync_to_async(self.check, thread_sensitive=False)(request)
+
+    @staticmethod
+    def check(request):
+        if not settings.RATE_LIMITS_ENABLED:
+            return None
+        group = route_group(request.resolver_match.view_name or "")
+        if group is None:
+            return None
+        try:
+            wait = take_tokens(group, request)
+        except RedisError:
+            logger.warning("could not check the rate limits", exc_info=True)
+            return None
+        return throttled(wait) if wait else None
+
+
+def queue_delay(request):
+    """Seconds since the proxy received the request, None if it did not say."""
+    value = request.headers.get("X-Request-Start", "").removeprefix("t=")
+    try:
+        started = float(value)
+    except ValueError:
+        return None
+    # nginx sends seconds, other proxies milli or microseconds
+    while started > 1e11:
+        started /= 1000
+    return max(0.0, time.time() - started)
+
+
+class AdmissionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        admitted, slot = self.admit(request)
+        if not admitted:
+            return overloaded()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.release(slot)
+            raise
+        if not self.hold(response, slot):
+            self.release(slot)
+        return response
+
+    async def __acall__(self, request):
+        if settings.ADMISSION_MAX_CONCURRENCY:
+            admit = sync_to_async(self.admit, thread_sensitive=False)
+            admitted, slot = await admit(request)
+        else:
+            # nothing to ask redis
+            admitted, slot = self.admit(request)
+        if not admitted:
+            return overloaded()
+        release = sync_to_async(self.release, thread_sensitive=False)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            if slot is not None:
+                await release(slot)
+            raise
+        if slot is not None and not self.hold(response, slot):
+            await release(slot)
+        return response
+
+    @classmethod
+    def hold(cls, response, slot):
+        """Keep the slot of a streamed response until its body is sent."""
+        if slot is None or not response.streaming:
+            return False
+        # the server closes the response once the last chunk is out
+        response._resource_closers.append(lambda: cls.release(slot))
+        return True
+
+    @staticmethod
+    def admit(request):
+        """Whether to run the request, and the slot it holds while it runs."""
+        max_delay = settings.ADMISSION_MAX_QUEUE_DELAY
+        if max_delay:
+            delay = queue_delay(request)
+            if delay is not None and delay > max_delay:
+                # its client has likely given up, the others are waiting on it
+                return False, None
+
+        limit = settings.ADMISSION_MAX_CONCURRENCY
+        if not limit:
+            return True, None
+        slot = uuid.uuid4().hex
+        try:
+            admitted = script(ACQUIRE)(
+                keys=[cache.make_key(RUNNING_KEY)],
+                args=[slot, limit, settings.ADMISSION_REQUEST_TIMEOUT],
+            )
+        except RedisError:
+            logger.warning("could not check the running requests", exc_info=True)
+            return True, None
+        return bool(admitted), slot if admitted else None
+
+    @staticmethod
+    def release(slot):
+        if slot is None:
+            return
+        try:
+            get_redis_connection("default").zrem(cache.make_key(RUNNING_KEY), slot)
+        except RedisError:
+            # the slot expires with the request timeout
+            logger.warning("could not release a running request", exc_info=True)
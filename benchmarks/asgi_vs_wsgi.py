@@ -0,0 +1,70 @@
+"""
+Compare the posts read path served by WSGI and by ASGI workers.
+
+Start both servers against the same database and cache, for example:
+
+    gunicorn BlogApp.wsgi:application --bind 0.0.0.0:8000 --workers 4
+    gunicorn BlogApp.asgi:application --bind 0.0.0.0:8001 --workers 4 \\
+        --worker-class uvicorn.workers.UvicornWorker
+
+then run:
+
+    python -m benchmarks.asgi_vs_wsgi --username admin --password admin \\
+        --wsgi http://localhost:8000 --asgi http://localhost:8001 \\
+        --connections 10 100 1000 --duration 15
+"""
+import argparse
+import asyncio
+import json
+import resource
+
+from .http import obtain_token, run_load
+
+PATHS = {
+    "wsgi": "/api/posts/{suffix}",
+    "asgi": "/api/async/posts/{suffix}",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--wsgi", default="http://localhost:8000")
+    parser.add_argument("--asgi", default="http://localhost:8001")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--connections", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument(
+        "--post", type=int, help="benchmark this post's detail instead of the list"
+    )
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    # thousands of sockets need a matching descriptor limit
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    suffix = f"{args.post}/" if args.post else ""
+    results = []
+    for mode, base_url in (("wsgi", args.wsgi), ("asgi", args.asgi)):
+        token = obtain_token(base_url, args.username, args.password)
+        url = base_url.rstrip("/") + PATHS[mode].format(suffix=suffix)
+        for connections in args.connections:
+            summary = asyncio.run(
+                run_load(
+                    url,
+                    connections,
+                    args.duration,
+                    headers={"Authorization": f"Bearer {token}"},
+                )
+            )
+            results.append({"mode": mode, "connections": connections, **summary})
+            print(json.dumps(results[-1]))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
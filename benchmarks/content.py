@@ -0,0 +1,74 @@
+"""
+Reproducible post content for the benchmarks.
+
+Bodies are markdown with headings, paragraphs, lists and code blocks. Their
+length follows a log-normal distribution around ``MEDIAN_WORDS`` words,
+roughly what blog posts look like: most are a few hundred words and a few run
+to several thousand.
+"""
+import math
+import random
+
+MEDIAN_WORDS = 600
+SPREAD = 0.8
+MIN_WORDS, MAX_WORDS = 30, 12000
+
+SYLLABLES = (
+    "ka", "lo", "mi", "ne", "ru", "sa", "te", "vo", "da", "fi",
+    "go", "ha", "ji", "pu", "re", "si", "to", "za", "an", "el",
+)  # fmt: skip
+
+
+def vocabulary(rng, size=5000):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))))
+    return sorted(words)
+
+
+class PostFactory:
+    """Titles and markdown bodies drawn from a seeded random generator."""
+
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.words = vocabulary(self.rng)
+
+    def sentence(self, low=6, high=18):
+        words = self.rng.choices(self.words, k=self.rng.randint(low, high))
+        return " ".join(words).capitalize() + "."
+
+    def title(self):
+        return self.sentence(3, 10)[:-1][:200]
+
+    def word_count(self):
+        count = self.rng.lognormvariate(math.log(MEDIAN_WORDS), SPREAD)
+        return int(min(max(count, MIN_WORDS), MAX_WORDS))
+
+    def content(self, words=None):
+        target = words or self.word_count()
+        blocks, written = [], 0
+        while written < target:
+            kind = self.rng.random()
+            if kind < 0.08:
+                block = "## " + self.sentence(2, 6)[:-1]
+            elif kind < 0.16:
+                block = "\n".join(
+                    "- " + self.sentence(3, 10) for _ in range(self.rng.randint(2, 5))
+                )
+            elif kind < 0.2:
+                block = (
+                    "```\n"
+                    + "\n".join(
+                        " ".join(self.rng.choices(self.words, k=self.rng.randint(2, 8)))
+                        for _ in range(self.rng.randint(2, 6))
+                    )
+                    + "\n```"
+                )
+            else:
+                block = " ".join(self.sentence() for _ in range(self.rng.randint(2, 6)))
+            blocks.append(block)
+            written += len(block.split())
+        return "\n\n".join(blocks)
+
+    def post(self):
+        return {"title": self.title(), "content": self.content()}
@@ -0,0 +1,157 @@
+"""
+A small asyncio HTTP/1.1 load generator.
+
+Every simulated client holds one keep-alive connection and sends requests back
+to back, so the number of clients is the number of concurrent connections the
+server has to hold.
+"""
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+
+def obtain_token(base_url, username, password):
+    request = Request(
+        base_url.rstrip("/") + "/api/token/",
+        data=json.dumps({"username": username, "password": password}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urlopen(request) as response:
+        return json.load(response)["access"]
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, errors, elapsed):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+        "p50_ms": _ms(percentile(latencies, 0.50)),
+        "p95_ms": _ms(percentile(latencies, 0.95)),
+        "p99_ms": _ms(percentile(latencies, 0.99)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed by the server")
+    status = int(status_line.split()[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    return status, headers
+
+
+class Client:
+    def __init__(self, url, headers=None):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.headers = {"Host": parts.netloc, "Connection": "keep-alive"}
+        self.headers.update(headers or {})
+        self.reader = self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, body=None, headers=None):
+        if self.writer is None:
+            await self.connect()
+
+        all_headers = {**self.headers, **(headers or {})}
+        if body is not None:
+            all_headers["Content-Type"] = "application/json"
+            all_headers["Content-Length"] = str(len(body))
+        head = f"{method} {path} HTTP/1.1\r\n" + "".join(
+            f"{name}: {value}\r\n" for name, value in all_headers.items()
+        )
+        self.writer.write(head.encode("latin-1") + b"\r\n" + (body or b""))
+        await self.writer.drain()
+
+        status, headers = await read_response(self.reader)
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        self.reader = self.writer = None
+
+
+async def run_load(url, connections, duration, headers=None, next_request=None):
+    """
+    Drive ``url`` (or the requests produced by ``next_request()``, as
+    ``(method, path, body)`` tuples) from ``connections`` keep-alive clients
+    for ``duration`` seconds and summarize the latencies. A client stops
+    early once ``next_request()`` returns None.
+    """
+    path = urlsplit(url).path + (
+        f"?{urlsplit(url).query}" if urlsplit(url).query else ""
+    )
+    if next_request is None:
+        next_request = lambda: ("GET", path, None)  # noqa: E731
+
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        nonlocal errors
+        client = Client(url, headers)
+        try:
+            while time.monotonic() < deadline:
+                request = next_request()
+                if request is None:
+                    break
+                method, request_path, body = request
+                started = time.perf_counter()
+                try:
+                    status = await client.request(method, request_path, body)
+                except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                    errors += 1
+                    await client.close()
+                    continue
+                if status >= 400:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - started)
+        finally:
+            await client.close()
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(connections)))
+    return summarize(latencies, errors, time.monotonic() - started)
@@ -0,0 +1,298 @@
+"""
+Latency and throughput of the posts API under list, retrieve, create, update,
+delete and mixed workloads.
+
+Seed a dataset and start the server, for example:
+
+    python manage.py seed_posts --clear --count 100000
+    python entrypoint.py
+
+then run every scenario and compare it with the stored baseline:
+
+    python -m benchmarks.posts_api --username admin --password admin \\
+        --url http://localhost:8000 --connections 20 --duration 15 \\
+        --output results.json --baseline benchmarks/baseline.json
+
+The reads run twice, against a warm cache (every path requested once before
+measuring) and a cold one (every request carries a unique query parameter,
+so it misses and builds its entry). The run exits with status 1 when a
+p95 latency or the throughput of a scenario is more than ``--tolerance``
+worse than the baseline. ``--save-baseline`` stores the results as the new
+baseline instead.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+from .content import PostFactory
+from .http import obtain_token, run_load
+
+SCENARIOS = ("list", "retrieve", "create", "update", "delete", "mixed")
+# the scenarios measured with both cache states, writes do not read the cache
+READS = ("list", "retrieve", "mixed")
+
+API = "/api/posts/"
+
+
+def call(base_url, token, method, path, payload=None):
+    request = Request(
+        base_url.rstrip("/") + path,
+        data=None if payload is None else json.dumps(payload).encode(),
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        },
+        method=method,
+    )
+    with urlopen(request) as response:
+        body = response.read()
+    return json.loads(body) if body else None
+
+
+def crawl(base_url, token, pages):
+    """The paths of the first ``pages`` list pages and the ids on them."""
+    paths, ids, path = [], [], f"{API}?page_size=100"
+    while path and len(paths) < pages:
+        paths.append(path)
+        page = call(base_url, token, "GET", path)
+        ids += [post["id"] for post in page["results"]]
+        path = page["next"] and _relative(page["next"])
+    return paths, ids
+
+
+def _relative(link):
+    parts = urlsplit(link)
+    return f"{parts.path}?{parts.query}" if parts.query else parts.path
+
+
+def create_posts(base_url, token, factory, count, chunk_size=1000):
+    ids = []
+    while len(ids) < count:
+        posts = [factory.post() for _ in range(min(chunk_size, count - len(ids)))]
+        created = call(base_url, token, "POST", f"{API}bulk/", posts)
+        ids += [post["id"] for post in created]
+    return ids
+
+
+def delete_posts(base_url, token, ids, chunk_size=1000):
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start : start + chunk_size]
+        call(base_url, token, "DELETE", f"{API}bulk/", {"ids": chunk})
+
+
+class Workload:
+    """The requests of one scenario, as ``(method, path, body)`` tuples."""
+
+    def __init__(self, scenario, cold, pages, ids, owned, factory, rng, write_ratio):
+        self.scenario = scenario
+        self.cold = cold
+        self.pages = pages
+        self.ids = ids
+        # posts made by the benchmark, the only ones it changes or deletes
+        self.owned = owned
+        self.factory = factory
+        self.rng = rng
+        self.write_ratio = write_ratio
+        self.nonce = itertools.count()
+        # the bodies are generated up front to keep the client out of the way
+        self.bodies = [json.dumps(factory.post()).encode() for _ in range(200)]
+
+    def bust(self, path):
+        if not self.cold:
+            return path
+        separator = "&" if "?" in path else "?"
+        return f"{path}{separator}nocache={next(self.nonce)}"
+
+    def body(self):
+        return self.rng.choice(self.bodies)
+
+    def list(self):
+        return "GET", self.bust(self.rng.choice(self.pages)), None
+
+    def retrieve(self):
+        return "GET", self.bust(f"{API}{self.rng.choice(self.ids)}/"), None
+
+    def create(self):
+        return "POST", API, self.body()
+
+    def update(self):
+        return "PUT", f"{API}{self.rng.choice(self.owned)}/", self.body()
+
+    def delete(self):
+        if not self.owned:
+            return None
+        return "DELETE", f"{API}{self.owned.pop()}/", None
+
+    def mixed(self):
+        # mostly detail reads, a few list pages and writes
+        if self.rng.random() < self.write_ratio:
+            return self.rng.choice((self.create, self.update))()
+        if self.rng.random() < 0.2:
+            return self.list()
+        return self.retrieve()
+
+    def __call__(self):
+        return getattr(self, self.scenario)()
+
+
+def warm_up(base_url, token, workload):
+    for path in workload.pages:
+        call(base_url, token, "GET", path)
+    for pk in workload.ids:
+        call(base_url, token, "GET", f"{API}{pk}/")
+
+
+def compare(results, baseline, tolerance):
+    """The descriptions of the results worse than ``baseline``."""
+    previous = {(item["scenario"], item["cache"]): item for item in baseline["results"]}
+    regressions = []
+    for item in results:
+        before = previous.get((item["scenario"], item["cache"]))
+        if before is None:
+            continue
+        name = f"{item['scenario']} ({item['cache']})"
+        if item["errors"] > before["errors"]:
+            regressions.append(
+                f"{name}: {item['errors']} errors, was {before['errors']}"
+            )
+        if (
+            before["p95_ms"]
+            and item["p95_ms"]
+            and item["p95_ms"] > before["p95_ms"] * (1 + tolerance)
+        ):
+            regressions.append(
+                f"{name}: p95 {item['p95_ms']} ms, was {before['p95_ms']} ms"
+            )
+        if item["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {item['rps']} rps, was {before['rps']} rps")
+    return regressions
+
+
+def revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument(
+        "--caches", nargs="+", choices=("warm", "cold"), default=("warm", "cold")
+    )
+    parser.add_argument("--connections", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument(
+        "--pages", type=int, default=10, help="list pages read, and warmed"
+    )
+    parser.add_argument(
+        "--sample", type=int, default=500, help="posts read by retrieve, at most"
+    )
+    parser.add_argument(
+        "--owned", type=int, default=2000, help="posts created for update and delete"
+    )
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", default="benchmarks/baseline.json")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="the share a result may be worse than the baseline by",
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    factory = PostFactory(args.seed)
+    token = obtain_token(args.url, args.username, args.password)
+    pages, ids = crawl(args.url, token, args.pages)
+    ids = rng.sample(ids, min(args.sample, len(ids)))
+    if not ids:
+        sys.exit("No posts to read, seed some with `manage.py seed_posts` first.")
+
+    results = []
+    for scenario in args.scenarios:
+        for cache in args.caches if scenario in READS else ("-",):
+            # a fresh token and set of posts for every run
+            token = obtain_token(args.url, args.username, args.password)
+            owned = []
+            if scenario in ("update", "delete", "mixed"):
+                owned = create_posts(args.url, token, factory, args.owned)
+            workload = Workload(
+                scenario,
+                cache == "cold",
+                pages,
+                ids,
+                owned,
+                factory,
+                rng,
+                args.write_ratio,
+            )
+            if cache == "warm":
+                warm_up(args.url, token, workload)
+
+            summary = asyncio.run(
+                run_load(
+                    args.url,
+                    args.connections,
+                    args.duration,
+                    headers={"Authorization": f"Bearer {token}"},
+                    next_request=workload,
+                )
+            )
+            results.append({"scenario": scenario, "cache": cache, **summary})
+            print(json.dumps(results[-1]), flush=True)
+            # leave the dataset as it was for the next run
+            delete_posts(args.url, token, workload.owned)
+
+    report = {
+        "revision": revision(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "url": args.url,
+        "connections": args.connections,
+        "duration": args.duration,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"Baseline saved to {args.baseline}.")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, nothing to compare with.")
+        return
+    with open(args.baseline) as file:
+        regressions = compare(results, json.load(file), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
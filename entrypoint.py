@@ -1,19 +1,65 @@
 import os
-import subprocess
-import sys
+import time
+
+started = time.perf_counter()
+
+import django
+from gunicorn.app.base import BaseApplication
+
+
+class Server(BaseApplication):
+    """Gunicorn serving an application already loaded in this process."""
+
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
 
 
 def main():
-    # Run database migrations
-    subprocess.check_call([sys.executable, "manage.py", "migrate"])
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "BlogApp.settings")
+    django.setup()
+
+    from BlogApp.boot import BootTimer, run_setup
+
+    timer = BootTimer()
+    timer.started = started
+    timer.phases.append(("django setup", time.perf_counter() - started))
+
+    # only one service runs the setup steps
+    if os.getenv("RUN_SETUP", "1") == "1":
+        run_setup(timer)
+
+    # the workers are forked from this process with the application loaded
+    options = {
+        "bind": "0.0.0.0:8000",
+        "preload_app": True,
+        # a sync worker is killed when a request outlasts it
+        "timeout": int(os.getenv("WEB_TIMEOUT", 30)),
+    }
+    with timer.phase("load application"):
+        if os.getenv("SERVER_MODE") == "asgi":
+            from BlogApp.asgi import application
+
+            options["worker_class"] = "uvicorn.workers.UvicornWorker"
+        else:
+            from BlogApp.wsgi import application
 
-    # create static files
-    subprocess.check_call([sys.executable, "manage.py", "collectstatic", "--noinput"])
+            if os.getenv("SERVER_MODE") == "exports":
+                # threads stream the downloads while the worker keeps its
+                # heartbeat, so the timeout does not cut long exports
+                options["worker_class"] = "gthread"
+                options["threads"] = int(os.getenv("WEB_THREADS", 8))
 
-    # Start the application
-    os.execlp(
-        "gunicorn", "gunicorn", "BlogApp.wsgi:application", "--bind", "0.0.0.0:8000"
-    )
+    print(timer.report(), flush=True)
+    Server(application, options).run()
 
 
 if __name__ == "__main__":